@@ -0,0 +1,262 @@
+"""
+Offline benchmark for the research pipeline. Starts the stub services from stubs.py, Redis
+(a throwaway redis-server, or fakeredis, unless --redis-url is given) and the API itself, then drives
+/api/answer at a fixed concurrency and reports latency percentiles, throughput, memory and
+per-stage timings. Nothing leaves the machine.
+
+    python bench/run.py --requests 100 --concurrency 8 --output results.json
+    python bench/run.py --baseline results.json --max-regression 0.15
+
+With --baseline, the run fails when p95 latency or throughput regress by more than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from stubs import add_stub_arguments, stub_command_line
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = ("plan", "search", "filter", "fetch", "synthesize", "total")
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return round(ordered[index], 3)
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "p99": percentile(values, 0.99)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis() -> Tuple[str, Optional[subprocess.Popen]]:
+    """
+    Starts a throwaway redis-server if one is installed, otherwise an in-process fakeredis
+    TCP server. The fakeredis server drops the connection on NOSCRIPT replies, so the
+    Lua-backed rate limiter and content cache only exercise their fallback paths with it.
+    """
+    port = free_port()
+    if shutil.which("redis-server"):
+        process = subprocess.Popen(
+            ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL
+        )
+        return f"redis://127.0.0.1:{port}/0", process
+
+    from fakeredis import TcpFakeServer
+
+    print("redis-server not found, falling back to fakeredis; Lua-backed features will run degraded")
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0", None
+
+
+def memory_kb(pid: int) -> Dict[str, int]:
+    """
+    Current and peak resident memory of a process, from /proc (Linux only).
+    """
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    stats[{"VmRSS": "rss_kb", "VmHWM": "peak_rss_kb"}[name]] = int(value.split()[0])
+    except OSError:
+        pass
+    return stats
+
+
+def backend_env(args: argparse.Namespace, redis_url: str) -> Dict[str, str]:
+    stub = f"http://127.0.0.1:{args.port}"
+    return {
+        # Required settings that do not matter for the benchmark, unless already set
+        "MAX_RESULTS": "10",
+        "DOMAIN": "http://localhost:3000",
+        "LIMIT_INTERVAL": "86400",
+        "ENFORCE_LIMIT_IN_LOCALNET": "False",
+        "LOG_LEVEL": "WARNING",
+        "USE_PROXY": "False",
+        "OBFUSCATE_IPS": "True",
+        "SECRET_SALT": "YmVuY2htYXJrLXNhbHQtMTIzNA==",
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"{stub}/v1",
+        "GOOGLE_SEARCH_API_KEY": "bench",
+        "SEARCH_ENGINE_ID": "bench",
+        "SEARCH_ENDPOINT": f"{stub}/customsearch/v1",
+        "EMBEDDING_BASE_URL": f"{stub}/v1",
+        "REDIS_URL": redis_url,
+        "API_HOST": "127.0.0.1",
+        "API_PORT": str(args.api_port),
+        "API_WORKERS": str(args.workers),
+        "LIMIT_PER_IP": str(10 ** 9),
+        "LIMIT_TOTAL": str(10 ** 9),
+        "ANSWER_CACHE_ENABLED": str(args.answer_cache),
+    }
+
+
+async def wait_until_healthy(client: httpx.AsyncClient, url: str, timeout: float, process: subprocess.Popen):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The API exited during startup with code {process.returncode}")
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not become healthy within {timeout} seconds")
+
+
+async def drive(args: argparse.Namespace, backend: subprocess.Popen) -> Dict[str, Any]:
+    api = f"http://127.0.0.1:{args.api_port}"
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    stages: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    errors: Dict[str, int] = {}
+
+    topics = max(int(args.requests * (1 - args.repeat_ratio)), 1)
+
+    async def ask(client: httpx.AsyncClient, question: str, record: bool):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post(f"{api}/api/answer", json={"content": question})
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                response, status = None, type(e).__name__
+            elapsed = time.perf_counter() - started
+        if not record:
+            return
+        if status != "200":
+            errors[status] = errors.get(status, 0) + 1
+            return
+        latencies.append(elapsed)
+        for stage, seconds in response.json().get("timings", {}).items():
+            if stage in stages:
+                stages[stage].append(seconds)
+
+    async with httpx.AsyncClient(timeout=args.request_timeout) as client:
+        await wait_until_healthy(client, f"{api}/health", args.startup_timeout, backend)
+        # Warmup questions have their own topics so that they do not pre-fill the answer cache
+        await asyncio.gather(*(
+            ask(client, f"What is the history of warmup subject {index}?", record=False) for index in range(args.warmup)
+        ))
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            ask(client, f"How does benchmark topic {index % topics} work?", record=True) for index in range(args.requests)
+        ))
+        wall = time.perf_counter() - started
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_seconds": summarize(latencies),
+        "stage_seconds": {stage: summarize(values) for stage, values in stages.items() if values},
+    }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], max_regression: float) -> List[str]:
+    """
+    Returns a description of every metric that regressed beyond the allowed fraction.
+    """
+    regressions = []
+    for name in ("p95", "p99"):
+        before, after = baseline["latency_seconds"][name], result["latency_seconds"][name]
+        if before and after > before * (1 + max_regression):
+            regressions.append(f"{name} latency {before}s -> {after}s")
+    before, after = baseline["throughput_rps"], result["throughput_rps"]
+    if before and after < before * (1 - max_regression):
+        regressions.append(f"throughput {before} -> {after} req/s")
+    return regressions
+
+
+def print_report(result: Dict[str, Any]):
+    latency = result["latency_seconds"]
+    print(f"\n{result['succeeded']}/{result['requests']} requests succeeded at concurrency {result['concurrency']}"
+          f" in {result['wall_seconds']}s ({result['throughput_rps']} req/s)")
+    if result["errors"]:
+        print(f"errors: {result['errors']}")
+    print(f"latency  p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s")
+    for stage, values in result["stage_seconds"].items():
+        print(f"  {stage:<11} p50 {values['p50']}s  p95 {values['p95']}s  p99 {values['p99']}s")
+    if result.get("memory"):
+        print(f"backend memory  rss {result['memory'].get('rss_kb', 0) // 1024} MiB"
+              f"  peak {result['memory'].get('peak_rss_kb', 0) // 1024} MiB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of repeated questions")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled")
+    parser.add_argument("--workers", type=int, default=1, help="API worker processes")
+    parser.add_argument("--api-port", type=int, default=8902)
+    parser.add_argument(
+        "--redis-url",
+        help="Use this Redis instead of a throwaway redis-server, or an in-process fakeredis server if none is installed"
+    )
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+
+    redis_url, redis_process = (args.redis_url, None) if args.redis_url else start_redis()
+    stubs = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "bench", "stubs.py")] + stub_command_line(args))
+    backend = subprocess.Popen([sys.executable, "main.py"], cwd=BACKEND_DIR, env=backend_env(args, redis_url))
+    try:
+        result = asyncio.run(drive(args, backend))
+        result["memory"] = memory_kb(backend.pid)
+    finally:
+        backend.terminate()
+        stubs.terminate()
+        backend.wait(timeout=30)
+        stubs.wait(timeout=30)
+        if redis_process is not None:
+            redis_process.terminate()
+
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(result, json.load(file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""
+Local stand-ins for the external services OpenAnswer calls, for offline benchmarks:
+an OpenAI-compatible chat completions and embeddings API, a Custom Search endpoint and
+a farm of static sites. Sites are spread over several loopback addresses (127.0.0.2, ...)
+so that per-domain crawl limits behave as they would on the real web.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from typing import List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+
+WORDS = (
+    "research data system network model energy market policy history science culture process "
+    "analysis design study result method value growth change language city water health report"
+).split()
+URL_PATTERN = re.compile(r'https?://[^\s"\'<>,\]]+')
+DOCUMENT_PATTERN = re.compile(r'<document id="(\d+)">')
+
+
+def _filler(seed: str, words: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _completion_text(messages: List[dict], completion_tokens: int, urls_to_select: int) -> str:
+    system = messages[0]["content"] if messages else ""
+    user = messages[-1]["content"] if messages else ""
+    seed = hashlib.sha256(user.encode()).hexdigest()
+    if "optimized search term" in system:
+        terms = "\n".join(_filler(f"{seed}{index}", 4) for index in range(2))
+        return f"<search_terms>\n{terms}\n</search_terms>\n<custom_urls>\n</custom_urls>"
+    if "selecting the most relevant URLs" in system:
+        urls = list(dict.fromkeys(URL_PATTERN.findall(user)))[:urls_to_select]
+        return "<selected_urls>\n" + "\n".join(urls) + "\n</selected_urls>"
+    if "extracting relevant information from several web pages" in system:
+        documents = DOCUMENT_PATTERN.findall(user)
+        return json.dumps({"extractions": [
+            {"document": int(document), "content": _filler(f"{seed}{document}", completion_tokens)} for document in documents
+        ]})
+    if "extracting relevant information" in system:
+        return _filler(seed, completion_tokens)
+    return f"{_filler(seed, completion_tokens)} [^1^]\n\n[^1]: benchmark source"
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    site_hosts = [f"127.0.0.{index}" for index in range(2, 2 + args.sites)]
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        model = body.get("model", "stub")
+        max_tokens = body.get("max_tokens") or args.completion_tokens
+        completion_tokens = min(args.completion_tokens, max_tokens)
+        text = _completion_text(messages, completion_tokens, args.urls_to_select)
+        usage = {
+            "prompt_tokens": sum(len(message.get("content", "")) for message in messages) // 4,
+            "completion_tokens": len(text.split()),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        await asyncio.sleep(args.llm_latency)
+        if not body.get("stream"):
+            await asyncio.sleep(usage["completion_tokens"] / args.llm_tokens_per_second)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        async def stream():
+            words = text.split(" ")
+            for start in range(0, len(words), 5):
+                piece = " ".join(words[start:start + 5]) + " "
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(5 / args.llm_tokens_per_second)
+            final = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for index, text in enumerate(inputs):
+            rng = random.Random(hashlib.sha256(text.encode()).hexdigest())
+            data.append({"object": "embedding", "index": index, "embedding": [rng.gauss(0, 1) for _ in range(64)]})
+        return {"object": "list", "data": data, "model": body.get("model", "stub"), "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    @app.get("/customsearch/v1")
+    async def custom_search(q: str, num: int = 10):
+        await asyncio.sleep(args.search_latency)
+        seed = hashlib.sha256(q.encode()).hexdigest()[:12]
+        items = []
+        for index in range(num):
+            host = site_hosts[(int(seed, 16) + index) % len(site_hosts)]
+            items.append({
+                "title": f"Result {index} for {q}",
+                "link": f"http://{host}:{args.port}/page/{seed}-{index}",
+                "snippet": _filler(f"{seed}{index}", 25),
+            })
+        return {"items": items}
+
+    @app.get("/page/{name}")
+    async def page(name: str):
+        await asyncio.sleep(args.site_latency)
+        paragraphs = "\n".join(
+            f"<h2>Section {index}</h2><p>{_filler(f'{name}{index}', args.page_words)}</p>"
+            for index in range(args.page_sections)
+        )
+        return HTMLResponse(
+            f"<html><head><title>Page {name}</title></head><body>"
+            f"<nav><a href='/'>Home</a></nav><main><h1>Page {name}</h1>{paragraphs}</main>"
+            f"<footer>Benchmark site farm</footer></body></html>"
+        )
+
+    return app
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--stub-port", dest="port", type=int, default=8901)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds before the first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=150.0)
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Tokens generated per completion")
+    parser.add_argument("--urls-to-select", type=int, default=5)
+    parser.add_argument("--search-latency", type=float, default=0.15)
+    parser.add_argument("--site-latency", type=float, default=0.05)
+    parser.add_argument("--sites", type=int, default=8, help="Number of distinct site hosts")
+    parser.add_argument("--page-sections", type=int, default=6)
+    parser.add_argument("--page-words", type=int, default=120)
+
+
+def stub_command_line(args: argparse.Namespace) -> List[str]:
+    """
+    Turns parsed stub options back into command-line arguments for a stubs.py subprocess.
+    """
+    return [
+        "--stub-port", str(args.port),
+        "--llm-latency", str(args.llm_latency),
+        "--llm-tokens-per-second", str(args.llm_tokens_per_second),
+        "--completion-tokens", str(args.completion_tokens),
+        "--urls-to-select", str(args.urls_to_select),
+        "--search-latency", str(args.search_latency),
+        "--site-latency", str(args.site_latency),
+        "--sites", str(args.sites),
+        "--page-sections", str(args.page_sections),
+        "--page-words", str(args.page_words),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark stub services")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args), host="0.0.0.0", port=args.port, log_level="warning")
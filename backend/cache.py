@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from pipeline import SharedUsage, shared_usage
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class CacheStats:
+    """
+    In-process hit/miss counters for a single cache.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.revalidated = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "revalidated": self.revalidated,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into a single execution.
+    The shared call runs as its own task: cancelling one waiter does not affect the others,
+    and the task is only cancelled once every waiter has gone away. Resource usage recorded
+    by the call is split evenly between the waiters that receive its outcome.
+    """
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._usage: Dict[str, SharedUsage] = {}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._calls
+
+    @staticmethod
+    async def _run(fn: Callable[[], Awaitable[Any]], usage: SharedUsage) -> Any:
+        shared_usage.set(usage)  # Only affects this task's copy of the context
+        return await fn()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            usage = SharedUsage()
+            task = asyncio.ensure_future(self._run(fn, usage))
+            self._calls[key] = task
+            self._usage[key] = usage
+            task.add_done_callback(lambda t: self._done(key, t))
+        usage = self._usage[key]
+        usage.waiters += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                usage.waiters -= 1
+                if usage.waiters == 0:
+                    task.cancel()
+            raise
+        except Exception:
+            usage.charge()
+            raise
+        usage.charge()
+        return result
+
+    def _done(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._usage[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved even if every waiter went away
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a search query so that trivially different spellings share a cache entry.
+    """
+    return re.sub(r'\s+', ' ', query.strip().lower())
+
+
+SENTENCE_PUNCTUATION = '.,;:!?¡¿"\'“”‘’()'
+TRAILING_PUNCTUATION_PATTERN = re.compile(rf"[{re.escape(SENTENCE_PUNCTUATION)}]+(?=\s|$)")
+LEADING_PUNCTUATION_PATTERN = re.compile(rf"(?<!\S)[{re.escape(SENTENCE_PUNCTUATION)}]+")
+
+
+def question_fingerprint(question: str) -> str:
+    """
+    Normalizes a question so that differences in case, spacing and sentence punctuation share a cache entry.
+    Only punctuation at word boundaries is dropped; symbols inside or at the end of terms such as
+    "C++", "C#" or "node.js" are kept so that they never collide with other questions.
+    """
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = LEADING_PUNCTUATION_PATTERN.sub(' ', TRAILING_PUNCTUATION_PATTERN.sub(' ', text))
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def hash_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+class RedisCache:
+    """
+    JSON values stored in Redis under hashed keys, with per-value TTLs and single-flight fills.
+    Redis errors are logged and treated as misses so that the cache never fails a request.
+    """
+    def __init__(self, redis_client: Optional[aioredis.Redis], ttl: int, key_prefix: str):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.stats = CacheStats()
+        self._single_flight = SingleFlight()
+
+    def _ttl_for(self, value: Any) -> int:
+        return self.ttl
+
+    async def _get(self, key: str) -> Optional[Any]:
+        try:
+            cached = await self.redis.get(key)
+        except aioredis.RedisError as e:
+            self.stats.errors += 1
+            logger.warning(f"Cache read failed for {self.key_prefix}: {str(e)}")
+            return None
+        return json.loads(cached) if cached is not None else None
+
+    async def _set(self, key: str, value: Any):
+        ttl = self._ttl_for(value)
+        if ttl <= 0:
+            return
+        try:
+            await self.redis.set(key, json.dumps(value), ex=ttl)
+        except aioredis.RedisError as e:
+            self.stats.errors += 1
+            logger.warning(f"Cache write failed for {self.key_prefix}: {str(e)}")
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], entry: Optional[Callable[[Any], Tuple[str, Any]]] = None) -> Any:
+        """
+        Returns the cached value for the key, calling fetch at most once per key across concurrent callers.
+        When given, entry maps a fetched value to the key and value to store and return instead.
+        Exceptions raised by fetch are propagated and never cached.
+        """
+        if self.redis is None:
+            value = await fetch()
+            return entry(value)[1] if entry else value
+
+        key = f"{self.key_prefix}{key}"
+        if self._single_flight.in_flight(key):
+            self.stats.coalesced += 1
+            return await self._single_flight.do(key, fetch)
+
+        cached = await self._get(key)
+        if cached is not None:
+            self.stats.hits += 1
+            return cached
+
+        self.stats.misses += 1
+
+        async def fetch_and_store():
+            value = await fetch()
+            if entry is None:
+                await self._set(key, value)
+                return value
+            store_key, value = entry(value)
+            await self._set(f"{self.key_prefix}{store_key}", value)
+            return value
+
+        return await self._single_flight.do(key, fetch_and_store)
+
+
+class SearchCache(RedisCache):
+    """
+    Cache of Custom Search results keyed on the normalized query and result count.
+    Empty result sets are cached with a shorter TTL.
+    """
+    def __init__(self, redis_client: Optional[aioredis.Redis], ttl: int, negative_ttl: int, key_prefix: str = "search:"):
+        super().__init__(redis_client, ttl, key_prefix)
+        self.negative_ttl = negative_ttl
+
+    def _ttl_for(self, value: List[Dict[str, str]]) -> int:
+        return self.ttl if value else self.negative_ttl
+
+    async def get_or_fetch_results(self, query: str, num: int, fetch: Callable[[], Awaitable[List[Dict[str, str]]]]) -> List[Dict[str, str]]:
+        return await self.get_or_fetch(hash_key(normalize_query(query), str(num)), fetch)
+
+
+NO_RELEVANT_INFO = "[no_relevant_info]"
+
+
+class Extraction(NamedTuple):
+    text: str
+    model: str
+
+
+class ExtractionCache(RedisCache):
+    """
+    Cache of per-URL extraction results keyed on the page content, question fingerprint,
+    prompt version and model. Negative verdicts are stored as NO_RELEVANT_INFO.
+    """
+    def __init__(self, redis_client: Optional[aioredis.Redis], ttl: int, key_prefix: str = "extraction:"):
+        super().__init__(redis_client, ttl, key_prefix)
+
+    @staticmethod
+    def make_key(content: str, question: str, prompt_version: str, model: str) -> str:
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        return hash_key(content_hash, question_fingerprint(question), prompt_version, model)
+
+    async def get_or_extract(
+        self, content: str, question: str, prompt_version: str, model: str, extract: Callable[[], Awaitable[Extraction]]
+    ) -> str:
+        """
+        Looks a page up under the model expected to extract it, but stores each result under the
+        model that produced it, so that a fallback model's extractions are never served as the primary's.
+        """
+        return await self.get_or_fetch(
+            self.make_key(content, question, prompt_version, model),
+            extract,
+            entry=lambda extraction: (self.make_key(content, question, prompt_version, extraction.model), extraction.text)
+        )
+
+
+class AnswerCache(RedisCache):
+    """
+    Cache of complete research results keyed on the normalized question.
+    Concurrent identical questions share a single pipeline run.
+    """
+    def __init__(self, redis_client: Optional[aioredis.Redis], ttl: int, key_prefix: str = "answer:"):
+        super().__init__(redis_client, ttl, key_prefix)
+
+    @staticmethod
+    def make_key(question: str) -> str:
+        return hash_key(question_fingerprint(question))
+
+    async def peek(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a cached result without starting a pipeline run; only hits are counted.
+        """
+        if self.redis is None:
+            return None
+        cached = await self._get(f"{self.key_prefix}{self.make_key(question)}")
+        if cached is not None:
+            self.stats.hits += 1
+        return cached
+
+    async def store(self, question: str, result: Dict[str, Any]):
+        if self.redis is not None:
+            await self._set(f"{self.key_prefix}{self.make_key(question)}", result)
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from pydantic import Field, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -17,25 +17,136 @@ class APIKeys(BaseSettings):
 class SearchSettings(BaseSettings):
     search_engine_id: SecretStr
     max_results: int
+    search_endpoint: str = "https://www.googleapis.com/customsearch/v1"
+    search_concurrency: int = 4
+    search_timeout: float = 10.0
+    search_retries: int = 2
+    search_backoff: float = 0.5
+    search_max_connections: int = 20
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
 class ModelSettings(BaseSettings):
+    openai_base_url: Optional[str] = None  # Any OpenAI-compatible endpoint; None uses api.openai.com
     search_model: str = "gpt-4o-mini"
     extract_model: str = "gpt-4o-mini"
     answer_model: str = "gpt-4o-mini"
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
+class RoutingSettings(BaseSettings):
+    # Ordered "model" or "model@endpoint" entries per stage (search_term, url_selection, extraction, answer);
+    # stages left out use the *_MODEL settings on the default endpoint
+    llm_routes: Dict[str, List[str]] = {}
+    # Additional OpenAI-compatible endpoints: name -> {"base_url": ..., "api_key": ...}
+    llm_endpoints: Dict[str, Dict[str, str]] = {}
+    llm_deadlines: Dict[str, float] = {"search_term": 20.0, "url_selection": 20.0, "extraction": 30.0, "answer": 90.0}
+    llm_hedge_enabled: bool = True
+    llm_hedge_percentile: float = 0.95
+    llm_hedge_min_delay: float = 1.0
+    llm_retries: int = 2
+    llm_backoff: float = 0.5
+    # Routes whose p95 latency exceeds this multiple of the fastest route's are tried after it;
+    # latency samples older than LLM_STATS_MAX_AGE seconds are forgotten
+    llm_demote_factor: float = 2.0
+    llm_stats_max_age: float = 300.0
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
 class CrawlerSettings(BaseSettings):
     max_urls: int = 10
     crawl_timeout: int = 30
+    min_extractions: int = 5  # Synthesize once this many good extractions are in (0 waits for all)
+    synthesis_deadline: float = 15.0  # Seconds after crawling starts to stop waiting (0 disables)
+    max_pages: int = 8  # Browser pages open at once, shared by all requests
+    max_pages_per_domain: int = 2
+    reuse_browser_sessions: bool = True
+    static_fetch_enabled: bool = True  # Try plain HTTP before the headless browser
+    static_fetch_timeout: float = 8.0
+    static_fetch_max_bytes: int = 3 * 1024 * 1024
+    static_min_text_length: int = 300  # Pages with less text than this are rendered in the browser
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class DomainSettings(BaseSettings):
+    domain_stats_enabled: bool = True  # Share per-domain crawl statistics between workers through Redis
+    domain_stats_window: int = 50  # Recent crawls kept per domain
+    domain_stats_ttl: int = 7 * 86400
+    domain_stats_refresh: float = 60.0
+    domain_stats_max_domains: int = 10000  # Domains whose statistics are cached in each process
+    domain_min_samples: int = 5  # Crawls needed before a domain's statistics are acted on
+    adaptive_crawl_timeouts: bool = True
+    domain_timeout_multiplier: float = 2.0  # Times the domain's p95 crawl latency, capped at CRAWL_TIMEOUT
+    domain_min_timeout: float = 5.0
+    skip_failing_domains: bool = True
+    domain_min_success_rate: float = 0.2  # Domains below this are skipped, apart from one probe per retry interval
+    domain_retry_after: int = 1800
+    domain_deprioritize_below: float = 0.6  # Domains below this preference go to the end of the URL list
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class ExtractionSettings(BaseSettings):
+    prune_content: bool = True
+    chunk_tokens: int = 400
+    max_chunks: int = 8
+    extraction_token_budget: int = 3000
+    # Pages up to batch_page_tokens share extraction calls of at most batch_max_documents pages
+    batch_extraction: bool = True
+    batch_page_tokens: int = 1000
+    batch_token_budget: int = 4000
+    batch_max_documents: int = 5
+    batch_max_output_tokens: int = 4096
+    batch_linger: float = 0.5
+    # Near-duplicate passages are collapsed and the rest packed into synthesis_token_budget
+    dedup_sources: bool = True
+    dedup_threshold: float = 0.7  # Estimated shingle overlap at which passages count as duplicates
+    synthesis_token_budget: int = 6000
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class RankingSettings(BaseSettings):
+    rank_enabled: bool = True
+    rank_embeddings: bool = False  # Blend in similarity from the EMBEDDING_* model
+    rank_embedding_weight: float = 0.5
+    rank_select: int = 5
+    rank_max_per_domain: int = 1
+    rank_min_coverage: float = 0.5  # Fraction of question terms every selected snippet must mention
+    rank_margin: float = 0.1  # Score lead of the last selected result over the next one
+    rank_speculative_crawls: int = 2  # Top-ranked URLs crawled while the LLM selector decides
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class CacheSettings(BaseSettings):
+    search_cache_enabled: bool = True
+    search_cache_ttl: int = 3600
+    search_cache_negative_ttl: int = 300
+    content_cache_enabled: bool = True
+    content_cache_backend: str = "redis"  # "redis" or "disk"
+    content_cache_dir: str = "./content_cache"
+    content_cache_ttl: int = 3600
+    content_cache_max_stale: int = 86400
+    content_cache_max_bytes: int = 256 * 1024 * 1024
+    content_cache_revalidate_timeout: float = 5.0
+    extraction_cache_enabled: bool = True
+    extraction_cache_ttl: int = 86400
+    answer_cache_enabled: bool = True
+    answer_cache_ttl: int = 900
+    semantic_cache_enabled: bool = False
+    semantic_cache_ttl: int = 900
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_hnsw_threshold: int = 5000
+    embedding_base_url: str = "http://localhost:11434/v1"
+    embedding_api_key: str = "local"
+    embedding_model: str = "nomic-embed-text"
+    embedding_timeout: float = 2.0
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
 class APISettings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    api_workers: int = 1
+    api_graceful_timeout: float = 60.0
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
@@ -49,6 +160,55 @@ class RateLimits(BaseSettings):
     limit_total: int
     limit_interval: int
     enforce_limit_in_localnet: bool
+    limit_algorithm: str = "fixed_window"  # "fixed_window", "sliding_window" or "token_bucket"
+    limit_global_shards: int = 1
+    limit_redis_timeout: float = 0.5
+    limit_breaker_threshold: int = 5
+    limit_breaker_reset: float = 30.0
+    limit_ip_failure_mode: str = "local"  # "open", "closed" or "local" when Redis is unavailable
+    limit_global_failure_mode: str = "open"
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class QuotaSettings(BaseSettings):
+    quota_enabled: bool = False
+    quota_per_ip: float = 100.0  # Budget units per IP per interval
+    quota_total: float = 1000.0  # Budget units for all clients per interval
+    quota_interval: int = 86400
+    quota_reservation: float = 10.0  # Units reserved up front for each request
+    cost_per_prompt_token: float = 0.001
+    cost_per_completion_token: float = 0.004
+    cost_per_crawl_second: float = 0.1
+    cost_per_search_call: float = 0.5
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+    def weights(self) -> Dict[str, float]:
+        return {
+            "prompt_tokens": self.cost_per_prompt_token,
+            "completion_tokens": self.cost_per_completion_token,
+            "crawl_seconds": self.cost_per_crawl_second,
+            "search_calls": self.cost_per_search_call
+        }
+
+class JobSettings(BaseSettings):
+    jobs_embedded_workers: int = 2  # Job slots run inside each API process; 0 leaves jobs to worker.py
+    jobs_worker_concurrency: int = 4  # Job slots per standalone worker.py process
+    jobs_max_queued: int = 1000
+    jobs_default_deadline: float = 600.0
+    jobs_result_ttl: int = 3600
+    jobs_poll_interval: float = 1.0
+    jobs_lease_timeout: float = 30.0  # Jobs of a worker that stops renewing for this long are requeued
+
+    model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
+
+class MetricsSettings(BaseSettings):
+    metrics_enabled: bool = True
+    metrics_max_domains: int = 500
+    # USD per million prompt, completion and (optionally) cached prompt tokens, used to estimate cost per model
+    llm_prices: Dict[str, List[float]] = {"gpt-4o-mini": [0.15, 0.6, 0.075], "gpt-4o": [2.5, 10.0, 1.25]}
+    otel_enabled: bool = False
+    otel_service_name: str = "openanswer"
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', extra='ignore')
 
@@ -77,10 +237,18 @@ class Config(BaseSettings):
     api_keys: APIKeys = Field(default_factory=APIKeys)
     search: SearchSettings = Field(default_factory=SearchSettings)
     models: ModelSettings = Field(default_factory=ModelSettings)
+    routing: RoutingSettings = Field(default_factory=RoutingSettings)
     crawler: CrawlerSettings = Field(default_factory=CrawlerSettings)
+    domains: DomainSettings = Field(default_factory=DomainSettings)
+    extraction: ExtractionSettings = Field(default_factory=ExtractionSettings)
+    ranking: RankingSettings = Field(default_factory=RankingSettings)
+    cache: CacheSettings = Field(default_factory=CacheSettings)
     api: APISettings = Field(default_factory=APISettings)
     cors: CORSSettings = Field(default_factory=CORSSettings)
     rate_limits: RateLimits = Field(default_factory=RateLimits)
+    quotas: QuotaSettings = Field(default_factory=QuotaSettings)
+    jobs: JobSettings = Field(default_factory=JobSettings)
+    metrics: MetricsSettings = Field(default_factory=MetricsSettings)
     logging: LoggingSettings = Field(default_factory=LoggingSettings)
     redis: RedisSettings = Field(default_factory=RedisSettings)
     proxy: ProxySettings = Field(default_factory=ProxySettings)
@@ -93,10 +261,18 @@ class Config(BaseSettings):
             "api_keys": self.api_keys.model_dump(),
             "search": self.search.model_dump(),
             "models": self.models.model_dump(),
+            "routing": self.routing.model_dump(),
             "crawler": self.crawler.model_dump(),
+            "domains": self.domains.model_dump(),
+            "extraction": self.extraction.model_dump(),
+            "ranking": self.ranking.model_dump(),
+            "cache": self.cache.model_dump(),
             "api": self.api.model_dump(),
             "cors": self.cors.model_dump(),
             "rate_limits": self.rate_limits.model_dump(),
+            "quotas": self.quotas.model_dump(),
+            "jobs": self.jobs.model_dump(),
+            "metrics": self.metrics.model_dump(),
             "logging": self.logging.model_dump(),
             "redis": self.redis.model_dump(),
             "proxy": self.proxy.model_dump(),
@@ -0,0 +1,218 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+import redis.asyncio as aioredis
+
+from cache import CacheStats, hash_key
+from utils import canonicalize_url
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class ContentEntry(NamedTuple):
+    url: str
+    markdown: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+def _encode_entry(entry: ContentEntry) -> Dict[str, str]:
+    return {
+        "url": entry.url,
+        "payload": base64.b64encode(zlib.compress(entry.markdown.encode('utf-8'))).decode('ascii'),
+        "etag": entry.etag or "",
+        "last_modified": entry.last_modified or "",
+        "fetched_at": repr(entry.fetched_at)
+    }
+
+
+def _decode_entry(data: Dict[str, str]) -> ContentEntry:
+    return ContentEntry(
+        url=data["url"],
+        markdown=zlib.decompress(base64.b64decode(data["payload"])).decode('utf-8'),
+        etag=data.get("etag") or None,
+        last_modified=data.get("last_modified") or None,
+        fetched_at=float(data["fetched_at"])
+    )
+
+
+class RedisContentBackend:
+    """
+    Stores compressed entries as Redis hashes with an LRU index kept in a sorted set.
+    Insertion and eviction under the byte budget run atomically in a Lua script.
+    """
+    def __init__(self, redis_client: aioredis.Redis, max_bytes: int, expire: int, key_prefix: str = "content:"):
+        self.redis = redis_client
+        self.max_bytes = max_bytes
+        self.expire = expire
+        self.entry_prefix = f"{key_prefix}entry:"
+        self.lru_key = f"{key_prefix}lru"
+        self.sizes_key = f"{key_prefix}sizes"
+        self.bytes_key = f"{key_prefix}bytes"
+
+        with open("./lua_scripts/content_cache_put.lua", 'r') as file:
+            self.put_script = self.redis.register_script(file.read())
+
+    async def get(self, member: str) -> Optional[Dict[str, str]]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(f"{self.entry_prefix}{member}")
+            pipe.zadd(self.lru_key, {member: time.time()}, xx=True)
+            data, _ = await pipe.execute()
+        return data or None
+
+    async def put(self, member: str, data: Dict[str, str]) -> int:
+        size = sum(len(value) for value in data.values())
+        fields = [item for pair in data.items() for item in pair]
+        return await self.put_script(
+            keys=[f"{self.entry_prefix}{member}", self.lru_key, self.sizes_key, self.bytes_key],
+            args=[self.entry_prefix, member, time.time(), size, self.max_bytes, self.expire, *fields]
+        )
+
+
+class DiskContentBackend:
+    """
+    Stores compressed entries as JSON files in a local directory.
+    The LRU order is kept in memory and persisted through file modification times.
+    """
+    def __init__(self, directory: str, max_bytes: int, expire: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.expire = expire
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._lock = asyncio.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _path(self, member: str) -> str:
+        return os.path.join(self.directory, f"{member}.json")
+
+    def _load_index(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".json"):
+                stat = os.stat(os.path.join(self.directory, filename))
+                entries.append((stat.st_mtime, filename[:-5], stat.st_size))
+        for _, member, size in sorted(entries):
+            self._index[member] = size
+            self._total += size
+
+    def _read(self, member: str) -> Optional[Dict[str, str]]:
+        path = self._path(member)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.expire:
+                return None
+            with open(path, 'r') as file:
+                data = json.load(file)
+            os.utime(path)
+            return data
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, member: str, data: Dict[str, str]) -> int:
+        path = self._path(member)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+        return os.stat(path).st_size
+
+    def _remove(self, member: str):
+        try:
+            os.remove(self._path(member))
+        except OSError:
+            pass
+
+    async def get(self, member: str) -> Optional[Dict[str, str]]:
+        if member not in self._index:
+            return None
+        data = await asyncio.to_thread(self._read, member)
+        if data is not None and member in self._index:
+            self._index.move_to_end(member)
+        return data
+
+    async def put(self, member: str, data: Dict[str, str]) -> int:
+        size = await asyncio.to_thread(self._write, member, data)
+        async with self._lock:
+            self._total += size - self._index.pop(member, 0)
+            self._index[member] = size
+
+            victims = []
+            while self._total > self.max_bytes and len(self._index) > 1:
+                victim, victim_size = self._index.popitem(last=False)
+                self._total -= victim_size
+                victims.append(victim)
+        for victim in victims:
+            await asyncio.to_thread(self._remove, victim)
+        return len(victims)
+
+
+class ContentCache:
+    """
+    Cache of crawled page markdown keyed by canonical URL.
+    Entries are fresh for `ttl` seconds; backends keep them a while longer so that stale
+    entries can be revalidated with a conditional request instead of a full crawl.
+    """
+    def __init__(self, backend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = CacheStats()
+
+    @staticmethod
+    def _member(url: str) -> str:
+        return hash_key(canonicalize_url(url))
+
+    def is_fresh(self, entry: ContentEntry) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    async def get(self, url: str) -> Optional[ContentEntry]:
+        try:
+            data = await self.backend.get(self._member(url))
+            return _decode_entry(data) if data else None
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning(f"Content cache read failed for {url}: {str(e)}")
+            return None
+
+    async def put(self, url: str, markdown: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        entry = ContentEntry(canonicalize_url(url), markdown, etag, last_modified, time.time())
+        try:
+            evicted = await self.backend.put(self._member(url), _encode_entry(entry))
+            if evicted:
+                logger.info(f"Content cache evicted {evicted} entries")
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning(f"Content cache write failed for {url}: {str(e)}")
+
+    async def refresh(self, entry: ContentEntry):
+        """
+        Marks a revalidated entry as fresh again.
+        """
+        self.stats.revalidated += 1
+        await self.put(entry.url, entry.markdown, entry.etag, entry.last_modified)
+
+
+def create_content_cache(redis_client: Optional[aioredis.Redis], settings) -> Optional[ContentCache]:
+    """
+    Builds the content cache configured in CacheSettings, or None when it is disabled.
+    """
+    if not settings.content_cache_enabled:
+        return None
+    expire = settings.content_cache_ttl + settings.content_cache_max_stale
+    if settings.content_cache_backend == "disk":
+        backend = DiskContentBackend(settings.content_cache_dir, settings.content_cache_max_bytes, expire)
+    elif settings.content_cache_backend == "redis" and redis_client is not None:
+        backend = RedisContentBackend(redis_client, settings.content_cache_max_bytes, expire)
+    else:
+        logger.warning(f"Content cache backend '{settings.content_cache_backend}' is unavailable, disabling content cache")
+        return None
+    return ContentCache(backend, settings.content_cache_ttl)
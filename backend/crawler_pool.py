@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from crawl4ai import AsyncWebCrawler, CrawlerRunConfig
+
+from metrics import record_crawl, span
+from pipeline import record_usage
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class CrawlScheduler:
+    """
+    Shared crawl queue for the single AsyncWebCrawler instance.
+    Bounds the number of open browser pages globally and per domain, hands out reusable
+    browser sessions and records queue depth and wait times.
+    """
+    def __init__(self, crawler: AsyncWebCrawler, max_pages: int, max_pages_per_domain: int, crawl_timeout: float, reuse_sessions: bool = True):
+        self.crawler = crawler
+        self.max_pages = max_pages
+        self.max_pages_per_domain = max_pages_per_domain
+        self.crawl_timeout = crawl_timeout
+        self.reuse_sessions = reuse_sessions
+
+        self._pages = asyncio.Semaphore(max_pages)
+        # Per-domain slots exist only while crawls of the domain are waiting or running
+        self._domains: Dict[str, asyncio.Semaphore] = {}
+        self._domain_users: Dict[str, int] = {}
+        self._sessions: asyncio.Queue = asyncio.Queue()
+        for index in range(max_pages):
+            self._sessions.put_nowait(f"crawler-session-{index}")
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.active = 0
+        self.completed = 0
+        self.deduplicated = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @staticmethod
+    def _domain(url: str) -> str:
+        return (urlsplit(url).hostname or "").lower()
+
+    @asynccontextmanager
+    async def _slot(self, url: str):
+        """
+        Waits for a per-domain slot first and a global page slot second, so that a busy
+        domain never holds global capacity while it waits.
+        """
+        queued_at = time.perf_counter()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        acquired = False
+        domain = self._domain(url)
+        if domain not in self._domains:
+            self._domains[domain] = asyncio.Semaphore(self.max_pages_per_domain)
+            self._domain_users[domain] = 0
+        self._domain_users[domain] += 1
+        try:
+            async with self._domains[domain]:
+                async with self._pages:
+                    self.queue_depth -= 1
+                    acquired = True
+                    wait = time.perf_counter() - queued_at
+                    self.total_wait += wait
+                    self.max_wait = max(self.max_wait, wait)
+                    self.active += 1
+                    try:
+                        yield
+                    finally:
+                        self.active -= 1
+                        self.completed += 1
+        finally:
+            if not acquired:
+                self.queue_depth -= 1
+            self._domain_users[domain] -= 1
+            if not self._domain_users[domain]:
+                del self._domains[domain], self._domain_users[domain]
+
+    async def _kill_session(self, session_id: str):
+        # Go through the browser manager directly; the strategy wrapper logs a deprecation warning
+        owner = getattr(self.crawler.crawler_strategy, "browser_manager", self.crawler.crawler_strategy)
+        kill_session = getattr(owner, "kill_session", None)
+        if kill_session is None:
+            return
+        try:
+            await kill_session(session_id)
+        except Exception as e:
+            logger.debug(f"Failed to close browser session {session_id}: {str(e)}")
+
+    async def crawl(self, url: str, timeout: Optional[float] = None) -> Any:
+        """
+        Crawls a URL once a slot is free, reusing a pooled browser session when enabled.
+        Raises asyncio.TimeoutError if the crawl itself exceeds the timeout.
+        """
+        timeout = timeout or self.crawl_timeout
+        async with self._slot(url):
+            started = time.perf_counter()
+            outcome = "failed"
+            try:
+                with span("browser_crawl", url=url):
+                    if not self.reuse_sessions:
+                        result = await asyncio.wait_for(self.crawler.arun(url=url), timeout=timeout)
+                    else:
+                        result = await self._crawl_in_session(url, timeout)
+                if result and result.success:
+                    outcome = "success"
+                return result
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise
+            finally:
+                record_crawl(url, "browser", outcome)
+                record_usage(crawl_seconds=time.perf_counter() - started)
+
+    async def _crawl_in_session(self, url: str, timeout: float) -> Any:
+        # A page slot guarantees a session, at most briefly delayed by the kill of a cancelled crawl
+        session_id = await self._sessions.get()
+        healthy = False
+        try:
+            result = await asyncio.wait_for(
+                self.crawler.arun(url=url, config=CrawlerRunConfig(session_id=session_id)),
+                timeout=timeout
+            )
+            healthy = bool(result and result.success)
+            return result
+        finally:
+            if healthy:
+                self._sessions.put_nowait(session_id)
+            else:
+                # Drop pages left in an unknown state; the session is recreated on next use.
+                # The kill finishes and returns the session even if this crawl is cancelled.
+                kill = asyncio.ensure_future(self._kill_session(session_id))
+                kill.add_done_callback(lambda _: self._sessions.put_nowait(session_id))
+                await asyncio.shield(kill)
+
+    async def close(self):
+        while not self._sessions.empty():
+            await self._kill_session(self._sessions.get_nowait())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "active_pages": self.active,
+            "completed": self.completed,
+            "deduplicated": self.deduplicated,
+            "average_wait_seconds": round(self.total_wait / self.completed, 3) if self.completed else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
@@ -0,0 +1,215 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+OUTCOMES = ("success", "empty", "timeout", "failed")
+
+
+def domain_of(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower()
+
+
+class DomainProfile:
+    """
+    Recent crawl history of one domain: outcomes and latencies of its last crawls, newest first,
+    and the latest verdicts on whether its pages need JavaScript rendering.
+    """
+    def __init__(self, crawls: List[Tuple[str, str, float, float]], js_verdicts: List[bool]):
+        self.crawls = crawls
+        self.js_verdicts = js_verdicts
+
+    @classmethod
+    def parse(cls, crawl_events: List[str], js_events: List[str]) -> "DomainProfile":
+        crawls = []
+        for event in crawl_events:
+            try:
+                outcome, method, seconds, timestamp = event.split(":")
+                crawls.append((outcome, method, float(seconds), float(timestamp)))
+            except ValueError:
+                continue
+        return cls(crawls, [event == "1" for event in js_events])
+
+    @property
+    def attempts(self) -> int:
+        return len(self.crawls)
+
+    def rate(self, outcome: str) -> float:
+        return sum(1 for crawl in self.crawls if crawl[0] == outcome) / len(self.crawls) if self.crawls else 0.0
+
+    def percentile(self, fraction: float, outcomes: Tuple[str, ...] = ("success",)) -> Optional[float]:
+        latencies = sorted(seconds for outcome, _, seconds, _ in self.crawls if outcome in outcomes)
+        if not latencies:
+            return None
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+    @property
+    def last_attempt(self) -> float:
+        return self.crawls[0][3] if self.crawls else 0.0
+
+    @property
+    def requires_browser(self) -> bool:
+        browser = sum(self.js_verdicts)
+        return browser >= 2 and browser > len(self.js_verdicts) - browser
+
+    def as_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "attempts": self.attempts,
+            **{f"{outcome}_rate": round(self.rate(outcome), 3) for outcome in OUTCOMES},
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "requires_browser": self.requires_browser,
+        }
+
+
+class DomainStatsStore:
+    """
+    Per-domain crawl statistics shared by all workers through Redis. Each domain keeps its last
+    `window` crawl events and JavaScript verdicts in two capped lists that expire after `ttl` seconds
+    without crawls. Profiles are cached in process for `refresh_interval` seconds, for at most
+    `max_domains` recently used domains; without Redis the statistics live in process only.
+    Redis errors are logged and never fail a crawl.
+    """
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis],
+        window: int = 50,
+        ttl: int = 7 * 86400,
+        refresh_interval: float = 60.0,
+        min_samples: int = 5,
+        max_domains: int = 10000,
+        key_prefix: str = "domain_stats:"
+    ):
+        self.redis = redis_client
+        self.window = window
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.min_samples = min_samples
+        self.max_domains = max_domains
+        self.key_prefix = key_prefix
+        self._crawl_events: Dict[str, List[str]] = {}
+        self._js_events: Dict[str, List[str]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self.errors = 0
+
+    def _touch(self, domain: str):
+        """
+        Marks a domain as recently used and forgets the least recently used ones beyond `max_domains`.
+        """
+        self._recent[domain] = None
+        self._recent.move_to_end(domain)
+        while len(self._recent) > self.max_domains:
+            oldest, _ = self._recent.popitem(last=False)
+            self._crawl_events.pop(oldest, None)
+            self._js_events.pop(oldest, None)
+            self._loaded_at.pop(oldest, None)
+
+    async def load(self, urls: Iterable[str]):
+        """
+        Refreshes the cached profiles of the URLs' domains that are missing or stale, in one round-trip.
+        """
+        if self.redis is None:
+            return
+        now = time.monotonic()
+        domains = list(dict.fromkeys(
+            domain for domain in map(domain_of, urls)
+            if domain and now - self._loaded_at.get(domain, float("-inf")) >= self.refresh_interval
+        ))
+        if not domains:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for domain in domains:
+                    pipe.lrange(f"{self.key_prefix}{domain}:crawls", 0, self.window - 1)
+                    pipe.lrange(f"{self.key_prefix}{domain}:js", 0, self.window - 1)
+                results = await pipe.execute()
+        except aioredis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Loading domain statistics failed: {str(e)}")
+            return
+        for index, domain in enumerate(domains):
+            self._crawl_events[domain] = results[2 * index]
+            self._js_events[domain] = results[2 * index + 1]
+            self._loaded_at[domain] = now
+            self._touch(domain)
+
+    def profile(self, url: str) -> DomainProfile:
+        """
+        The cached profile of the URL's domain; call load() first to pick up other workers' crawls.
+        """
+        domain = domain_of(url)
+        return DomainProfile.parse(self._crawl_events.get(domain, []), self._js_events.get(domain, []))
+
+    async def _push(self, kind: str, domain: str, event: str, local: Dict[str, List[str]]):
+        local[domain] = ([event] + local.get(domain, []))[:self.window]
+        self._touch(domain)
+        if self.redis is None:
+            return
+        key = f"{self.key_prefix}{domain}:{kind}"
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lpush(key, event)
+                pipe.ltrim(key, 0, self.window - 1)
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except aioredis.RedisError as e:
+            self.errors += 1
+            logger.warning(f"Recording domain statistics failed for {domain}: {str(e)}")
+
+    async def record_crawl(self, url: str, outcome: str, method: str, seconds: float):
+        await self._push("crawls", domain_of(url), f"{outcome}:{method}:{seconds:.3f}:{time.time():.0f}", self._crawl_events)
+
+    async def record_js(self, url: str, needs_browser: bool):
+        await self._push("js", domain_of(url), "1" if needs_browser else "0", self._js_events)
+
+    def timeout_for(self, url: str, default: float, multiplier: float, minimum: float) -> float:
+        """
+        A crawl timeout of `multiplier` times the domain's p95 latency, between `minimum` and `default`.
+        Timed-out crawls count with the time they ran, so that timeouts push the p95 up rather than
+        leaving it to the fast successes. Domains with too few crawls get the default.
+        """
+        profile = self.profile(url)
+        p95 = profile.percentile(0.95, outcomes=("success", "timeout"))
+        if p95 is None or profile.attempts < self.min_samples:
+            return default
+        return min(default, max(minimum, p95 * multiplier))
+
+    def should_skip(self, url: str, min_success_rate: float, retry_after: float) -> bool:
+        """
+        Skips domains whose recent crawls mostly failed or came back empty. One probe per
+        `retry_after` seconds is still let through so that a domain can recover.
+        """
+        profile = self.profile(url)
+        if profile.attempts < self.min_samples or profile.rate("success") >= min_success_rate:
+            return False
+        return time.time() - profile.last_attempt < retry_after
+
+    def preference(self, url: str, unknown: float) -> float:
+        """
+        Between 0 and 1, higher for domains that are reliable and fast. Domains with too few crawls
+        score `unknown`, so that callers can treat them as neutral.
+        """
+        profile = self.profile(url)
+        if profile.attempts < self.min_samples:
+            return unknown
+        p50 = profile.percentile(0.5)
+        speed = 1.0 / (1.0 + p50 / 5.0) if p50 is not None else 0.0
+        return profile.rate("success") * (0.5 + 0.5 * speed)
+
+    def stats(self) -> Dict[str, int]:
+        domains = set(self._crawl_events) | set(self._js_events)
+        profiles = [self.profile(f"http://{domain}/") for domain in domains]
+        return {
+            "known_domains": len(domains),
+            "browser_only_domains": sum(1 for profile in profiles if profile.requires_browser),
+            "unreliable_domains": sum(1 for profile in profiles if profile.attempts >= self.min_samples and profile.rate("success") < 0.5),
+            "errors": self.errors,
+        }
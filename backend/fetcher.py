@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import re
+from typing import Dict, NamedTuple, Optional, Tuple
+from urllib.parse import urljoin
+
+import httpx
+from bs4 import BeautifulSoup, NavigableString, Tag
+
+from domain_stats import DomainStatsStore
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+DROPPED_TAGS = ("script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "nav", "header", "footer", "aside", "button")
+BLOCK_TAGS = ("p", "div", "section", "article", "main", "blockquote", "figure", "figcaption", "dl", "dt", "dd", "details", "summary")
+STRUCTURAL_TAGS = BLOCK_TAGS + ("h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "table", "pre")
+SPA_ROOT_PATTERN = re.compile(r'<div[^>]+id=["\'](root|app|__next|__nuxt|svelte)["\'][^>]*>\s*</div>', re.IGNORECASE)
+NOSCRIPT_PATTERN = re.compile(r'<noscript[^>]*>[^<]*(enable|requires?)\s+javascript', re.IGNORECASE)
+
+
+class StaticPage(NamedTuple):
+    markdown: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+def _inline_text(node, base_url: str) -> str:
+    if isinstance(node, NavigableString):
+        return re.sub(r'\s+', ' ', str(node))
+    if not isinstance(node, Tag):
+        return ''
+    if node.name == 'br':
+        return '\n'
+    text = ''.join(_inline_text(child, base_url) for child in node.children)
+    if node.name == 'a' and node.get('href') and text.strip():
+        href = urljoin(base_url, node['href'])
+        if href.startswith(('http://', 'https://')):
+            return f"[{text.strip()}]({href})"
+    if node.name in ('strong', 'b') and text.strip():
+        return f"**{text.strip()}**"
+    if node.name in ('em', 'i') and text.strip():
+        return f"*{text.strip()}*"
+    if node.name == 'code' and text.strip():
+        return f"`{text.strip()}`"
+    return text
+
+
+def _block_markdown(node: Tag, base_url: str, blocks: list):
+    for child in node.children:
+        if isinstance(child, NavigableString):
+            text = re.sub(r'\s+', ' ', str(child)).strip()
+            if text:
+                blocks.append(text)
+            continue
+        if not isinstance(child, Tag):
+            continue
+        name = child.name
+        if name in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            text = _inline_text(child, base_url).strip()
+            if text:
+                blocks.append(f"{'#' * int(name[1])} {text}")
+        elif name in ('ul', 'ol'):
+            items = []
+            for index, item in enumerate(child.find_all('li', recursive=False), 1):
+                text = _inline_text(item, base_url).strip()
+                if text:
+                    items.append(f"{index}. {text}" if name == 'ol' else f"- {text}")
+            if items:
+                blocks.append('\n'.join(items))
+        elif name == 'pre':
+            blocks.append(f"```\n{child.get_text().strip()}\n```")
+        elif name == 'table':
+            rows = []
+            for row in child.find_all('tr'):
+                cells = [_inline_text(cell, base_url).strip().replace('|', '\\|') for cell in row.find_all(('th', 'td'))]
+                if cells:
+                    rows.append(f"| {' | '.join(cells)} |")
+                    if len(rows) == 1:
+                        rows.append(f"|{' --- |' * len(cells)}")
+            if rows:
+                blocks.append('\n'.join(rows))
+        elif child.find(STRUCTURAL_TAGS):
+            _block_markdown(child, base_url, blocks)
+        else:
+            text = _inline_text(child, base_url).strip()
+            if text:
+                blocks.append(text)
+
+
+def html_to_markdown(html: str, base_url: str) -> str:
+    """
+    Converts an HTML document to markdown, keeping headings, paragraphs, lists, tables, code and links.
+    Page chrome such as navigation, headers, footers and scripts is dropped.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup.find_all(DROPPED_TAGS):
+        tag.decompose()
+    root = soup.find('main') or soup.find('article') or soup.body or soup
+    blocks = []
+    title = soup.title.get_text().strip() if soup.title else ''
+    if title and not root.find('h1'):
+        blocks.append(f"# {title}")
+    _block_markdown(root, base_url, blocks)
+    return '\n\n'.join(blocks).strip()
+
+
+def needs_javascript(html: str, markdown: str, min_text_length: int) -> bool:
+    """
+    Heuristically decides whether a page only renders its content with JavaScript.
+    """
+    if len(re.sub(r'\W+', '', markdown)) < min_text_length:
+        return True
+    if SPA_ROOT_PATTERN.search(html) or NOSCRIPT_PATTERN.search(html):
+        # An empty mount point or a "please enable JavaScript" notice with little server-rendered text
+        return len(markdown) < 4 * min_text_length
+    return False
+
+
+class StaticFetcher:
+    """
+    Fast path that fetches pages with plain HTTP and converts them to markdown.
+    Pages that need JavaScript return None and are left to the headless browser; per-domain
+    verdicts go to the domain statistics store so that known JavaScript-only domains skip
+    straight to the browser, in every worker.
+    """
+    def __init__(self, client: httpx.AsyncClient, timeout: float, max_bytes: int, min_text_length: int, domain_stats: DomainStatsStore):
+        self.client = client
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.min_text_length = min_text_length
+        self.domain_stats = domain_stats
+        self.hits = 0
+        self.fallbacks = 0
+
+    def requires_browser(self, url: str) -> bool:
+        return self.domain_stats.profile(url).requires_browser
+
+    async def _download(self, url: str) -> Optional[Tuple[str, str, httpx.Headers]]:
+        """
+        Downloads an HTML or plain-text page, returning its text, final URL and headers.
+        """
+        async with self.client.stream(
+            "GET", url, headers={"User-Agent": USER_AGENT, "Accept": "text/html,text/plain;q=0.9"},
+            timeout=self.timeout, follow_redirects=True
+        ) as response:
+            content_type = response.headers.get("content-type", "")
+            if response.status_code != 200 or not content_type.startswith(("text/html", "application/xhtml", "text/plain")):
+                return None
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body.extend(chunk)
+                if len(body) > self.max_bytes:
+                    return None
+            return body.decode(response.encoding or 'utf-8', errors='replace'), str(response.url), response.headers
+
+    async def fetch(self, url: str) -> Optional[StaticPage]:
+        """
+        Returns the page as markdown, or None if it should be rendered by the headless browser.
+        The timeout bounds the whole download; HTML is converted in a worker thread.
+        """
+        try:
+            downloaded = await asyncio.wait_for(self._download(url), timeout=self.timeout)
+        except Exception as e:
+            logger.info(f"Static fetch failed for {url}: {str(e) or type(e).__name__}")
+            downloaded = None
+        if downloaded is None:
+            self.fallbacks += 1
+            return None
+
+        text, final_url, headers = downloaded
+        if headers.get("content-type", "").startswith("text/plain"):
+            markdown = text.strip()
+        else:
+            markdown = await asyncio.to_thread(html_to_markdown, text, final_url)
+
+        if needs_javascript(text, markdown, self.min_text_length):
+            await self.domain_stats.record_js(url, needs_browser=True)
+            self.fallbacks += 1
+            return None
+
+        await self.domain_stats.record_js(url, needs_browser=False)
+        self.hits += 1
+        return StaticPage(markdown, headers.get("etag"), headers.get("last-modified"))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "static_hits": self.hits,
+            "browser_fallbacks": self.fallbacks,
+            "browser_only_domains": self.domain_stats.stats()["browser_only_domains"]
+        }
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+import redis.asyncio as aioredis
+
+from pipeline import ResearchTrace
+from quotas import QuotaManager, QuotaReservation
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+TERMINAL_STATUSES = ("done", "failed", "cancelled", "expired")
+MAX_PRIORITY = 9
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Redis-backed research job queue. Jobs are ordered by priority, then by submission time;
+    each job keeps a hash with its status and result and a stream with its progress events.
+    Running jobs hold a lease that their worker renews; jobs whose lease runs out, e.g. because
+    the worker crashed, are put back in the queue.
+    """
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        max_queued: int,
+        result_ttl: int,
+        lease_timeout: float = 30.0,
+        max_events: int = 5000,
+        key_prefix: str = "jobs:"
+    ):
+        self.redis = redis_client
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.lease_timeout = lease_timeout
+        self.max_events = max_events
+        self.key_prefix = key_prefix
+        self.queue_key = f"{key_prefix}queue"
+        self.leases_key = f"{key_prefix}leases"
+
+        with open("./lua_scripts/job_claim.lua", 'r') as file:
+            self.claim_script = self.redis.register_script(file.read())
+        with open("./lua_scripts/job_renew.lua", 'r') as file:
+            self.renew_script = self.redis.register_script(file.read())
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}{job_id}"
+
+    def _events_key(self, job_id: str) -> str:
+        return f"{self.key_prefix}{job_id}:events"
+
+    @staticmethod
+    def _score(priority: int, created: float) -> float:
+        # Higher priorities sort first, submission order breaks ties
+        return (MAX_PRIORITY - priority) * 1e13 + created * 1000
+
+    async def submit(self, question: str, priority: int, deadline: float, reservation: Optional[QuotaReservation] = None) -> str:
+        """
+        Enqueues a job that must finish within `deadline` seconds and returns its id.
+        Raises JobQueueFull when the queue is at capacity.
+        """
+        if await self.redis.zcard(self.queue_key) >= self.max_queued:
+            raise JobQueueFull()
+
+        job_id = uuid.uuid4().hex
+        created = time.time()
+        job = {
+            "question": question,
+            "status": "queued",
+            "priority": priority,
+            "created": created,
+            "deadline": created + deadline,
+        }
+        if reservation is not None and reservation.ip_key is not None:
+            job.update(quota_key=reservation.ip_key, quota_amount=reservation.amount)
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._job_key(job_id), mapping=job)
+            pipe.expire(self._job_key(job_id), int(deadline) + self.result_ttl)
+            pipe.xadd(self._events_key(job_id), {"event": "queued", "data": json.dumps({"job_id": job_id})})
+            pipe.expire(self._events_key(job_id), int(deadline) + self.result_ttl)
+            pipe.zadd(self.queue_key, {job_id: self._score(priority, created)})
+            await pipe.execute()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if not job:
+            return None
+        status = {
+            "job_id": job_id,
+            "status": job["status"],
+            "priority": int(job["priority"]),
+            "created": float(job["created"]),
+            "deadline": float(job["deadline"]),
+        }
+        if job["status"] == "queued":
+            status["position"] = await self.redis.zrank(self.queue_key, job_id)
+        if "result" in job:
+            status["result"] = json.loads(job["result"])
+        if "detail" in job:
+            status["detail"] = job["detail"]
+        return status
+
+    async def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancels a queued job immediately; a running job is cancelled by its worker.
+        Returns the job's status after the request, or None if the job does not exist.
+        """
+        status = await self.redis.hget(self._job_key(job_id), "status")
+        if status is None or status in TERMINAL_STATUSES:
+            return status
+        if await self.redis.zrem(self.queue_key, job_id):
+            await self.finish(job_id, "cancelled")
+            return "cancelled"
+        await self.redis.hset(self._job_key(job_id), "cancel_requested", 1)
+        return "cancelling"
+
+    async def cancel_requested(self, job_id: str) -> bool:
+        return bool(await self.redis.hget(self._job_key(job_id), "cancel_requested"))
+
+    async def claim(self, timeout: float) -> Optional[Tuple[str, Dict[str, str]]]:
+        """
+        Takes the highest-priority job off the queue and leases it, sleeping `timeout` seconds
+        if the queue is empty. The same script first requeues jobs with an expired lease.
+        Jobs that were cancelled or ran past their deadline while queued are finished instead.
+        """
+        now = time.time()
+        recovered, *claimed = await self.claim_script(
+            keys=[self.queue_key, self.leases_key],
+            args=[self.key_prefix, now, now + self.lease_timeout, MAX_PRIORITY, 100, uuid.uuid4().hex]
+        )
+        if recovered:
+            logger.warning(f"Requeued {recovered} job(s) whose worker stopped renewing the lease")
+        if not claimed:
+            await asyncio.sleep(timeout)
+            return None
+        job_id = claimed[0]
+        job = await self.redis.hgetall(self._job_key(job_id))
+        if not job:
+            await self.redis.zrem(self.leases_key, job_id)
+            return None
+        if job.get("cancel_requested"):
+            await self.finish(job_id, "cancelled")
+            return None
+        if time.time() >= float(job["deadline"]):
+            await self.finish(job_id, "expired", detail="Deadline passed while queued")
+            return None
+        return job_id, job
+
+    async def renew_lease(self, job_id: str, job: Dict[str, str]) -> bool:
+        """
+        Extends the lease on a claimed job. Returns False if the lease ran out and the job was
+        requeued, possibly to another worker.
+        """
+        return bool(await self.renew_script(
+            keys=[self._job_key(job_id), self.leases_key],
+            args=[job_id, job["lease_token"], time.time() + self.lease_timeout]
+        ))
+
+    async def requeue(self, job_id: str, job: Dict[str, str]):
+        """
+        Puts a claimed job back at its original position, e.g. when its worker shuts down.
+        """
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.leases_key, job_id)
+            pipe.hset(self._job_key(job_id), "status", "queued")
+            pipe.zadd(self.queue_key, {job_id: self._score(int(job["priority"]), float(job["created"]))})
+            await pipe.execute()
+
+    async def publish(self, job_id: str, event: str, data: Dict[str, Any]):
+        await self.redis.xadd(
+            self._events_key(job_id),
+            {"event": event, "data": json.dumps(data)},
+            maxlen=self.max_events,
+            approximate=True
+        )
+
+    async def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None, detail: Optional[str] = None):
+        """
+        Records the final status of a job, publishes it as the last event and starts the result TTL.
+        """
+        fields = {"status": status, "finished": time.time()}
+        if result is not None:
+            fields["result"] = json.dumps(result)
+        if detail is not None:
+            fields["detail"] = detail
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.leases_key, job_id)
+            pipe.hset(self._job_key(job_id), mapping=fields)
+            pipe.expire(self._job_key(job_id), self.result_ttl)
+            pipe.xadd(self._events_key(job_id), {"event": status, "data": json.dumps(result if result is not None else {"detail": detail})})
+            pipe.expire(self._events_key(job_id), self.result_ttl)
+            await pipe.execute()
+
+    async def events(self, job_id: str, last_event_id: str = "0", block: float = 15.0) -> AsyncIterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        Yields (event id, event, data) for a job, starting after `last_event_id`, until the job finishes.
+        Yields a ("", "ping", {}) keep-alive whenever nothing happened for `block` seconds.
+        """
+        while True:
+            response = await self.redis.xread({self._events_key(job_id): last_event_id}, count=100, block=int(block * 1000))
+            if not response:
+                if not await self.redis.exists(self._job_key(job_id)):
+                    return
+                yield "", "ping", {}
+                continue
+            for event_id, fields in response[0][1]:
+                last_event_id = event_id
+                yield event_id, fields["event"], json.loads(fields["data"])
+                if fields["event"] in TERMINAL_STATUSES:
+                    return
+
+    async def stats(self) -> Dict[str, Any]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.queue_key)
+            pipe.zcard(self.leases_key)
+            queued, running = await pipe.execute()
+        return {"queued": queued, "running": running, "max_queued": self.max_queued}
+
+
+class JobWorker:
+    """
+    Runs queued research jobs with a fixed number of concurrent slots, forwarding stage
+    events to the job's stream and enforcing deadlines and cancellation.
+    """
+    def __init__(self, queue: JobQueue, research_assistant, concurrency: int, quota_manager: Optional[QuotaManager] = None, poll_interval: float = 1.0):
+        self.queue = queue
+        self.research_assistant = research_assistant
+        self.concurrency = concurrency
+        self.quota_manager = quota_manager
+        self.poll_interval = poll_interval
+        self._stopping = False
+
+    def stop(self):
+        """
+        Stops claiming new jobs; running jobs are allowed to finish.
+        """
+        self._stopping = True
+
+    async def run(self):
+        await asyncio.gather(*(self._slot() for _ in range(self.concurrency)))
+
+    async def _slot(self):
+        while not self._stopping:
+            try:
+                claimed = await self.queue.claim(timeout=self.poll_interval)
+            except aioredis.RedisError as e:
+                logger.warning(f"Failed to claim a job: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if claimed is not None:
+                await self._run_job(*claimed)
+
+    async def _execute(self, job_id: str, question: str, trace: ResearchTrace):
+        try:
+            async for event, data in self.research_assistant.research_and_answer_stream(question, trace=trace):
+                if event == "done":
+                    await self.queue.finish(job_id, "done", result=data)
+                elif event == "error":
+                    await self.queue.finish(job_id, "failed", detail=data["detail"])
+                else:
+                    await self.queue.publish(job_id, event, data)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            await self.queue.finish(job_id, "failed", detail="An unexpected error occurred")
+
+    async def _run_job(self, job_id: str, job: Dict[str, str]):
+        trace = ResearchTrace()
+        task = asyncio.ensure_future(self._execute(job_id, job["question"], trace))
+        deadline = float(job["deadline"])
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=max(min(self.poll_interval, deadline - time.time()), 0))
+                if task.done():
+                    break
+                if time.time() >= deadline:
+                    await self._abort(task)
+                    await self.queue.finish(job_id, "expired", detail="Deadline exceeded")
+                    break
+                if await self.queue.cancel_requested(job_id):
+                    await self._abort(task)
+                    await self.queue.finish(job_id, "cancelled")
+                    break
+                if not await self.queue.renew_lease(job_id, job):
+                    # Another worker has recovered the job and settles its quota
+                    logger.warning(f"Lost the lease on job {job_id}, abandoning it")
+                    await self._abort(task)
+                    return
+        except asyncio.CancelledError:
+            # The worker is shutting down; hand the job to another worker, which settles its quota
+            await self._abort(task)
+            await asyncio.shield(self.queue.requeue(job_id, job))
+            raise
+        await self._settle(job, trace)
+
+    @staticmethod
+    async def _abort(task: asyncio.Future):
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    async def _settle(self, job: Dict[str, str], trace: ResearchTrace):
+        if self.quota_manager is None or "quota_key" not in job:
+            return
+        reservation = QuotaReservation(True, None, None, None, None, job["quota_key"], float(job["quota_amount"]))
+        await self.quota_manager.settle(reservation, trace.usage)
@@ -1,17 +1,80 @@
-from typing import List, Tuple, Dict
-from openai import AsyncOpenAI
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 from config import config
-from utils import get_human_readable_datetime, extract_content_between_tags, fix_footnotes
+from utils import extract_content_between_tags, fix_footnotes
+from pipeline import ResearchPlan, ResearchTrace, prompt_date
+from cache import Extraction, ExtractionCache, NO_RELEVANT_INFO
+from llm_router import LLMResult, cached_tokens, create_llm_router
+from metrics import observe_stage
+from text_processing import PackedSource, count_tokens, pack_sources
+import redis.asyncio as aioredis
+import asyncio
+import hashlib
+import json
+import string
 import yaml
 import logging
 import os
+import time
 
 logger = logging.getLogger(__name__)
 logger.propagate = False
 
+BATCH_EXTRACTION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "batch_extraction",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "extractions": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"document": {"type": "integer"}, "content": {"type": "string"}},
+                        "required": ["document", "content"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["extractions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+class PromptTemplate:
+    """
+    A prompt section parsed once at load time into literal text and named fields.
+    Sections without fields are static and returned as is.
+    """
+    def __init__(self, text: str):
+        self.parts = list(string.Formatter().parse(text))
+        self.fields = {field for _, field, _, _ in self.parts if field is not None}
+        self.static = text.format() if not self.fields else None
+
+    def render(self, values: Dict[str, object]) -> str:
+        if self.static is not None:
+            return self.static
+        rendered = []
+        for literal, field, format_spec, conversion in self.parts:
+            rendered.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion:
+                    value = {"r": repr, "s": str, "a": ascii}[conversion](value)
+                rendered.append(format(value, format_spec or ""))
+        return "".join(rendered)
+
 class PromptManager:
+    """
+    Loads the prompt templates. System sections are kept free of variables so that they form
+    a byte-identical prefix across calls that the provider can cache; everything that changes
+    per call, including the date, belongs in the user section after it.
+    """
     def __init__(self, prompts_dir: str = "prompts"):
-        self.prompts = {}
+        self.prompts: Dict[str, Dict[str, PromptTemplate]] = {}
+        self.versions = {}
         self._load_all_prompts(prompts_dir)
 
     def _load_all_prompts(self, prompts_dir: str):
@@ -20,43 +83,167 @@ class PromptManager:
                 prompt_name = filename[:-5]  # Remove .yaml extension
                 try:
                     with open(os.path.join(prompts_dir, filename), 'r') as file:
-                        self.prompts[prompt_name] = yaml.safe_load(file)
+                        raw_prompt = file.read()
+                    templates = {key: PromptTemplate(value) for key, value in yaml.safe_load(raw_prompt).items()}
+                    if templates.get("system") and templates["system"].fields:
+                        logger.warning(f"System prompt of {prompt_name} uses {sorted(templates['system'].fields)}, so its prefix cannot be cached")
+                    self.prompts[prompt_name] = templates
+                    # Version prompts by content so cached results are invalidated when a prompt changes
+                    self.versions[prompt_name] = hashlib.sha256(raw_prompt.encode('utf-8')).hexdigest()[:12]
                 except Exception as e:
                     logger.error(f"Error loading prompt file {filename}: {str(e)}")
 
     def get_formatted_prompt(self, prompt_name: str, **kwargs) -> Dict[str, str]:
+        """
+        Fills in a prompt. The date defaults to the one fixed for the current research request.
+        """
         if prompt_name not in self.prompts:
             raise ValueError(f"Prompt '{prompt_name}' not found")
-        
-        formatted_prompt = {}
-        for key, value in self.prompts[prompt_name].items():
-            formatted_prompt[key] = value.format(date=get_human_readable_datetime(), **kwargs)
-        return formatted_prompt
+
+        values = {"date": kwargs.pop("date", None) or prompt_date(), **kwargs}
+        return {key: template.render(values) for key, template in self.prompts[prompt_name].items()}
+
+class ExtractionBatchClosed(Exception):
+    pass
+
+
+class ExtractionBatcher:
+    """
+    Packs the short pages of one research request into shared extraction calls. A batch is sent
+    when it reaches the token or document limit, when every other URL of the request has either
+    joined a batch or finished, or after a short linger, whichever comes first. Documents the
+    batched call fails to answer fall back to their own extraction call.
+    """
+    def __init__(self, llm_handler: "LLMHandler", question: str, urls: List[str]):
+        self.llm_handler = llm_handler
+        self.question = question
+        self.remaining = set(urls)
+        self.pending: List[Tuple[str, str, asyncio.Future]] = []
+        self.pending_tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Dict[asyncio.Task, List[Tuple[str, str, asyncio.Future]]] = {}
+
+    def submit(self, url: str, content: str) -> asyncio.Future:
+        """
+        Queues a page and returns a future for its extraction (or NO_RELEVANT_INFO).
+        """
+        tokens = count_tokens(content)
+        if self.pending and self.pending_tokens + tokens > config.extraction.batch_token_budget:
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((url, content, future))
+        self.pending_tokens += tokens
+        self.remaining.discard(url)
+        if len(self.pending) >= config.extraction.batch_max_documents or not self.remaining:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(config.extraction.batch_linger, self._flush)
+        return future
+
+    def release(self, url: str):
+        """
+        Marks a URL as finished, so that pending pages no longer wait for it.
+        """
+        self.remaining.discard(url)
+        if not self.remaining:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+        batch, self.pending, self.pending_tokens = self.pending, [], 0
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks[task] = batch
+        task.add_done_callback(lambda done: self._tasks.pop(done, None))
+
+    @staticmethod
+    def _abandon(batch: List[Tuple[str, str, asyncio.Future]]):
+        # Other requests may share these futures through the extraction cache; fail them instead of hanging
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(ExtractionBatchClosed("Extraction batch closed before it finished"))
+
+    async def _run(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        try:
+            await self._extract(batch)
+        finally:
+            self._abandon(batch)
+
+    async def _extract(self, batch: List[Tuple[str, str, asyncio.Future]]):
+        results: Dict[int, Extraction] = {}
+        if len(batch) > 1:
+            try:
+                results = await self.llm_handler._extract_batch(self.question, [(url, content) for url, content, _ in batch])
+                logger.info(f"Extracted {len(results)}/{len(batch)} pages in one call")
+            except Exception as e:
+                logger.warning(f"Batched extraction of {len(batch)} pages failed, extracting them one by one: {str(e)}")
+
+        async def extract_alone(url: str, content: str, future: asyncio.Future):
+            try:
+                result = await self.llm_handler._extract(self.question, content, url)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(result)
+
+        fallbacks = []
+        for index, (url, content, future) in enumerate(batch):
+            if index in results:
+                if not future.done():
+                    future.set_result(results[index])
+            else:
+                fallbacks.append(extract_alone(url, content, future))
+        await asyncio.gather(*fallbacks)
+
+    def close(self):
+        """
+        Cancels batches that are still queued or running, e.g. after the extraction quorum is reached.
+        Their unfinished pages fail with ExtractionBatchClosed.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._abandon(self.pending)
+        self.pending = []
+        for task, batch in list(self._tasks.items()):
+            task.cancel()
+            self._abandon(batch)
 
 class LLMHandler:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=config.api_keys.openai_api_key.get_secret_value())
+    def __init__(self, redis_client: Optional[aioredis.Redis] = None):
+        self.router = create_llm_router(config)
         self.prompt_manager = PromptManager()
+        self.extraction_cache = ExtractionCache(
+            redis_client if config.cache.extraction_cache_enabled else None,
+            ttl=config.cache.extraction_cache_ttl
+        )
 
-    async def _call_llm(self, model: str, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 150) -> str:
+    async def _complete(
+        self, stage: str, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 150, response_format: Optional[Dict[str, Any]] = None
+    ) -> LLMResult:
         try:
-            completion = await self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens
-            )
-            return completion.choices[0].message.content.strip()
+            return await self.router.complete(stage, messages, temperature=temperature, max_tokens=max_tokens, response_format=response_format)
         except Exception as e:
-            logger.error(f"Error calling LLM: {str(e)}")
+            logger.error(f"Error calling LLM for {stage}: {str(e) or type(e).__name__}")
             raise
 
-    async def generate_search_queries(self, question: str) -> Tuple[List[str], List[str]]:
+    async def _call_llm(
+        self, stage: str, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 150, response_format: Optional[Dict[str, Any]] = None
+    ) -> str:
+        result = await self._complete(stage, messages, temperature=temperature, max_tokens=max_tokens, response_format=response_format)
+        return result.text
+
+    async def generate_search_queries(self, question: str) -> ResearchPlan:
         formatted_prompt = self.prompt_manager.get_formatted_prompt("search_term", question=question)
         
         try:
             response = await self._call_llm(
-                config.models.search_model,
+                "search_term",
                 [
                     {"role": "system", "content": formatted_prompt['system']},
                     {"role": "user", "content": formatted_prompt['user']}
@@ -69,17 +256,17 @@ class LLMHandler:
             search_terms = [term.strip() for term in search_terms.split('\n') if term.strip()]
             custom_urls = [url.strip() for url in custom_urls.split('\n') if url.strip()]
             
-            return search_terms, custom_urls
+            return ResearchPlan(search_terms, custom_urls)
         except Exception as e:
             logger.error(f"Error in generate_search_queries: {str(e)}")
-            return [], []
+            return ResearchPlan([], [])
 
     async def filter_relevant_results(self, results: List[Dict[str, str]], question: str) -> List[str]:
         formatted_prompt = self.prompt_manager.get_formatted_prompt("url_selection", question=question, search_results=results)
         
         try:
             response = await self._call_llm(
-                config.models.search_model,
+                "url_selection",
                 [
                     {"role": "system", "content": formatted_prompt['system']},
                     {"role": "user", "content": formatted_prompt['user']}
@@ -93,40 +280,127 @@ class LLMHandler:
             logger.error(f"Error in filter_relevant_results: {str(e)}")
             return []
 
-    async def extract_relevant_info(self, question: str, content: str, url: str) -> str:
+    async def _extract(self, question: str, content: str, url: str) -> Extraction:
         formatted_prompt = self.prompt_manager.get_formatted_prompt("extraction", question=question, web_content=content, url=url)
         
+        started = time.perf_counter()
+        result = await self._complete(
+            "extraction",
+            [
+                {"role": "system", "content": formatted_prompt['system']},
+                {"role": "user", "content": formatted_prompt['user']}
+            ],
+            max_tokens=1024
+        )
+        observe_stage("extract", time.perf_counter() - started)
+        
+        if NO_RELEVANT_INFO in result.text:
+            return Extraction(NO_RELEVANT_INFO, result.route.model)
+        return Extraction(result.text, result.route.model)
+
+    async def _extract_batch(self, question: str, documents: List[Tuple[str, str]]) -> Dict[int, Extraction]:
+        """
+        Extracts several short pages in one structured-output call. Returns the results by
+        document index; documents missing from the response are left out.
+        """
+        documents_formatted = "\n".join(
+            f'<document id="{index}">\n<url>{url}</url>\n<web_content>\n{content}\n</web_content>\n</document>'
+            for index, (url, content) in enumerate(documents, start=1)
+        )
+        formatted_prompt = self.prompt_manager.get_formatted_prompt("batch_extraction", question=question, documents=documents_formatted)
+
+        started = time.perf_counter()
+        result = await self._complete(
+            "extraction",
+            [
+                {"role": "system", "content": formatted_prompt['system']},
+                {"role": "user", "content": formatted_prompt['user']}
+            ],
+            max_tokens=min(1024 * len(documents), config.extraction.batch_max_output_tokens),
+            response_format=BATCH_EXTRACTION_FORMAT
+        )
+        observe_stage("extract", time.perf_counter() - started)
+
+        results = {}
+        for item in json.loads(result.text).get("extractions", []):
+            index = item.get("document")
+            content = (item.get("content") or "").strip()
+            if isinstance(index, int) and 1 <= index <= len(documents):
+                text = NO_RELEVANT_INFO if not content or NO_RELEVANT_INFO in content else content
+                results[index - 1] = Extraction(text, result.route.model)
+        return results
+
+    def extraction_batcher(self, question: str, urls: List[str]) -> Optional["ExtractionBatcher"]:
+        """
+        Returns a batcher for the short pages of one research request, or None when batching is disabled.
+        """
+        if not config.extraction.batch_extraction or config.extraction.batch_max_documents < 2:
+            return None
+        return ExtractionBatcher(self, question, urls)
+
+    async def extract_relevant_info(self, question: str, content: str, url: str, batcher: Optional["ExtractionBatcher"] = None) -> str:
+        batched = batcher is not None and count_tokens(content) <= config.extraction.batch_page_tokens
+        prompt_name = "batch_extraction" if batched else "extraction"
         try:
-            response = await self._call_llm(
-                config.models.extract_model,
-                [
-                    {"role": "system", "content": formatted_prompt['system']},
-                    {"role": "user", "content": formatted_prompt['user']}
-                ],
-                max_tokens=1024
+            response = await self.extraction_cache.get_or_extract(
+                content,
+                question,
+                self.prompt_manager.versions.get(prompt_name, ""),
+                self.router.primary_model("extraction"),
+                (lambda: batcher.submit(url, content)) if batched else (lambda: self._extract(question, content, url))
             )
             
-            if "[no_relevant_info]" in response:
+            if response == NO_RELEVANT_INFO:
                 return None
             return response
         except Exception as e:
             logger.error(f"Error in extract_relevant_info: {str(e)}")
             return None
 
+    def _answer_messages(self, question: str, extracted_info: Dict[str, str], date: Optional[str] = None) -> List[Dict[str, str]]:
+        if config.extraction.dedup_sources:
+            packed = pack_sources(
+                question, extracted_info, config.extraction.synthesis_token_budget, threshold=config.extraction.dedup_threshold
+            )
+            logger.info(
+                f"Packed {len(extracted_info)} sources into {len(packed.sources)} blocks: {packed.original_tokens} -> {packed.kept_tokens} tokens, "
+                f"{packed.duplicates} duplicate passages"
+            )
+            sources = packed.sources
+        else:
+            sources = [PackedSource([url], content) for url, content in extracted_info.items()]
+        web_results_formatted = "\n\n".join([
+            "".join(f"<url>{url}</url>\n" for url in source.urls) + f"<content>\n{source.text}\n</content>" for source in sources
+        ])
+        formatted_prompt = self.prompt_manager.get_formatted_prompt("answer", web_results=web_results_formatted, question=question, date=date)
+        return [
+            {"role": "system", "content": formatted_prompt['system']},
+            {"role": "user", "content": formatted_prompt['user']}
+        ]
+
     async def synthesize_answer(self, question: str, extracted_info: Dict[str, str]) -> str:
-        web_results_formatted = "\n\n".join([f"<url>{url}</url>\n<content>\n{content}\n</content>" for url, content in extracted_info.items()])
-        formatted_prompt = self.prompt_manager.get_formatted_prompt("answer", web_results=web_results_formatted, question=question)
-        
+        """
+        Raises ValueError when the LLM fails, so that no placeholder answer ends up in the caches.
+        """
         try:
             response = await self._call_llm(
-                config.models.answer_model,
-                [
-                    {"role": "system", "content": formatted_prompt['system']},
-                    {"role": "user", "content": formatted_prompt['user']}
-                ],
+                "answer",
+                self._answer_messages(question, extracted_info),
                 max_tokens=2048
             )
             return fix_footnotes(response)
         except Exception as e:
             logger.error(f"Error in synthesize_answer: {str(e)}")
-            return "I'm sorry, but I encountered an error while trying to generate an answer. Please try again later."
\ No newline at end of file
+            raise ValueError("Failed to generate an answer") from e
+
+    async def synthesize_answer_stream(self, question: str, extracted_info: Dict[str, str], trace: Optional[ResearchTrace] = None) -> AsyncIterator[str]:
+        """
+        Streams the answer as raw text deltas. Footnotes are left untouched; callers fix the assembled answer.
+        Token usage from the final chunk is recorded on the given trace.
+        """
+        messages = self._answer_messages(question, extracted_info, date=trace.prompt_date if trace is not None else None)
+        async for delta, usage in self.router.stream("answer", messages, max_tokens=2048):
+            if usage is not None and trace is not None:
+                trace.add_usage(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cached_tokens=cached_tokens(usage))
+            if delta:
+                yield delta
@@ -0,0 +1,375 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+import openai
+from openai import AsyncOpenAI
+
+from config import Config
+from metrics import record_llm_call
+from pipeline import record_usage
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+STAGES = ("search_term", "url_selection", "extraction", "answer")
+
+
+class Route(NamedTuple):
+    endpoint: str
+    model: str
+
+    def __str__(self) -> str:
+        return f"{self.model}@{self.endpoint}"
+
+
+class LLMResult(NamedTuple):
+    text: str
+    route: Route
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int = 0
+
+
+def cached_tokens(usage: Any) -> int:
+    """
+    Prompt tokens served from the provider's prefix cache, when the endpoint reports them.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class RouteStats:
+    """
+    Rolling latency samples and recent outcomes for one model on one endpoint.
+    Samples older than max_age seconds are ignored, so a route that was slow gets another chance.
+    """
+    def __init__(self, window: int = 200, max_age: float = 300.0):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=20)
+        self.max_age = max_age
+        self.calls = 0
+        self.failures = 0
+        self.hedges_won = 0
+        self.hedges_lost = 0
+
+    def record(self, latency: Optional[float], ok: bool):
+        self.calls += 1
+        self.outcomes.append(ok)
+        if ok and latency is not None:
+            self.latencies.append((time.monotonic(), latency))
+        if not ok:
+            self.failures += 1
+
+    def record_censored(self, elapsed: float):
+        """
+        Records a call that was cancelled after elapsed seconds, a lower bound on its latency.
+        """
+        self.hedges_lost += 1
+        self.latencies.append((time.monotonic(), elapsed))
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        cutoff = time.monotonic() - self.max_age
+        ordered = sorted(latency for recorded, latency in self.latencies if recorded >= cutoff)
+        if len(ordered) < 5:
+            return None
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def healthy(self) -> bool:
+        # Demote routes whose recent calls mostly failed; one success restores them
+        return len(self.outcomes) < 5 or sum(self.outcomes) >= len(self.outcomes) / 2
+
+    def as_dict(self) -> Dict[str, Any]:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "hedges_won": self.hedges_won,
+            "hedges_lost": self.hedges_lost,
+            "healthy": self.healthy(),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class LLMRouter:
+    """
+    Sends each pipeline stage to an ordered list of models and endpoints.
+    Calls get a per-stage deadline and retries with backoff on 429/5xx. Once a call has taken
+    longer than its route's p95 latency, a hedged duplicate goes to the next route and the first
+    answer wins. Failing routes, and routes whose p95 is well above the fastest one's, are demoted
+    until they recover.
+    """
+    def __init__(
+        self,
+        clients: Dict[str, AsyncOpenAI],
+        routes: Dict[str, List[Route]],
+        deadlines: Dict[str, float],
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 0.95,
+        hedge_min_delay: float = 1.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        demote_factor: float = 2.0,
+        stats_max_age: float = 300.0,
+    ):
+        self.clients = clients
+        self.routes = routes
+        self.deadlines = deadlines
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.retries = retries
+        self.backoff = backoff
+        self.demote_factor = demote_factor
+        self.stats_max_age = stats_max_age
+        self.stats: Dict[Route, RouteStats] = {}
+
+    def _stats(self, route: Route) -> RouteStats:
+        if route not in self.stats:
+            self.stats[route] = RouteStats(max_age=self.stats_max_age)
+        return self.stats[route]
+
+    def candidates(self, stage: str) -> List[Route]:
+        """
+        Configured routes for a stage: healthy ones first, then healthy ones whose p95 is more than
+        demote_factor times the fastest known p95, then unhealthy ones, otherwise in configured order.
+        """
+        routes = self.routes[stage]
+        healthy = [route for route in routes if self._stats(route).healthy()]
+        p95s = {route: self._stats(route).percentile(self.hedge_percentile) for route in healthy}
+        known = [p95 for p95 in p95s.values() if p95 is not None]
+        if known:
+            cutoff = min(known) * self.demote_factor
+            slow = [route for route in healthy if p95s[route] is not None and p95s[route] > cutoff]
+            healthy = [route for route in healthy if route not in slow] + slow
+        return healthy + [route for route in routes if not self._stats(route).healthy()]
+
+    def primary_model(self, stage: str) -> str:
+        return self.routes[stage][0].model
+
+    def _hedge_delay(self, route: Route) -> float:
+        p95 = self._stats(route).percentile(self.hedge_percentile)
+        if p95 is None:
+            # Too few samples to know the tail yet; wait a generous multiple of the minimum
+            return self.hedge_min_delay * 4
+        return max(p95, self.hedge_min_delay)
+
+    async def _call(
+        self, route: Route, messages: List[Dict[str, str]], temperature: float, max_tokens: int, response_format: Optional[Dict[str, Any]] = None
+    ) -> LLMResult:
+        """
+        Calls one route, retrying transient errors with jittered exponential backoff.
+        """
+        extra = {"response_format": response_format} if response_format else {}
+        for attempt in range(self.retries + 1):
+            started = time.perf_counter()
+            try:
+                completion = await self.clients[route.endpoint].chat.completions.create(
+                    model=route.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **extra
+                )
+            except Exception as e:
+                self._stats(route).record(None, ok=False)
+                if not is_retryable(e) or attempt == self.retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (0.5 + random.random())
+                logger.warning(f"LLM call to {route} failed ({str(e)}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            elapsed = time.perf_counter() - started
+            self._stats(route).record(elapsed, ok=True)
+            usage = completion.usage
+            prompt_tokens, completion_tokens = (usage.prompt_tokens, usage.completion_tokens) if usage else (0, 0)
+            cached = cached_tokens(usage) if usage else 0
+            record_llm_call(route.model, elapsed, prompt_tokens, completion_tokens, cached)
+            return LLMResult(completion.choices[0].message.content.strip(), route, prompt_tokens, completion_tokens, cached)
+
+    async def _race(
+        self, stage: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int, response_format: Optional[Dict[str, Any]]
+    ) -> LLMResult:
+        candidates = self.candidates(stage)
+        pending: Dict[asyncio.Future, Route] = {}
+        launched: Dict[asyncio.Future, float] = {}
+        winner_launched: Optional[float] = None
+        next_index = 0
+        last_error: Optional[Exception] = None
+
+        def launch():
+            nonlocal next_index
+            route = candidates[next_index]
+            next_index += 1
+            task = asyncio.ensure_future(self._call(route, messages, temperature, max_tokens, response_format))
+            pending[task] = route
+            launched[task] = time.perf_counter()
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedge_enabled and next_index < len(candidates)
+                timeout = self._hedge_delay(candidates[next_index - 1]) if can_hedge else None
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"Hedging {stage} call to {candidates[next_index]} after {timeout:.2f}s")
+                    launch()
+                    continue
+                for task in done:
+                    route = pending.pop(task)
+                    if task.exception() is None:
+                        if next_index > 1 and route != candidates[0]:
+                            self._stats(route).hedges_won += 1
+                        winner_launched = launched[task]
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"LLM route {route} failed for {stage}: {str(last_error)}")
+                # Fall back to the next route as soon as every running call has failed
+                if not pending and next_index < len(candidates):
+                    launch()
+            raise last_error
+        finally:
+            now = time.perf_counter()
+            for task, route in pending.items():
+                task.cancel()
+                # A call launched before the winner, or cut off by the deadline, was at least this slow
+                if winner_launched is None or launched[task] < winner_launched:
+                    self._stats(route).record_censored(now - launched[task])
+
+    async def complete(
+        self,
+        stage: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.5,
+        max_tokens: int = 150,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> LLMResult:
+        """
+        Returns the first successful completion for a stage within its deadline.
+        Raises asyncio.TimeoutError or the last route's error if no route succeeds.
+        """
+        result = await asyncio.wait_for(
+            self._race(stage, messages, temperature, max_tokens, response_format), timeout=self.deadlines.get(stage)
+        )
+        record_usage(prompt_tokens=result.prompt_tokens, completion_tokens=result.completion_tokens, cached_tokens=result.cached_tokens)
+        return result
+
+    async def _open_stream(self, route: Route, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> Tuple[Any, Any]:
+        """
+        Starts a streamed completion and waits for its first chunk, which is None for an empty stream.
+        """
+        stream = await self.clients[route.endpoint].chat.completions.create(
+            model=route.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        try:
+            return stream, await stream.__anext__()
+        except StopAsyncIteration:
+            return stream, None
+        except BaseException:
+            await stream.close()
+            raise
+
+    async def stream(self, stage: str, messages: List[Dict[str, str]], temperature: float = 0.5, max_tokens: int = 2048) -> AsyncIterator[Tuple[str, Optional[Any]]]:
+        """
+        Streams (text delta, usage) pairs. Routes are tried in order until one produces its first
+        chunk within the stage deadline; once text has been sent there is no fallback.
+        """
+        last_error: Optional[Exception] = None
+        for route in self.candidates(stage):
+            started = time.perf_counter()
+            try:
+                stream, first = await asyncio.wait_for(
+                    self._open_stream(route, messages, temperature, max_tokens), timeout=self.deadlines.get(stage)
+                )
+            except Exception as e:
+                self._stats(route).record(None, ok=False)
+                last_error = e
+                logger.warning(f"LLM route {route} failed to start streaming {stage}: {str(e) or type(e).__name__}")
+                continue
+
+            try:
+                chunk = first
+                while chunk is not None:
+                    if chunk.usage:
+                        elapsed = time.perf_counter() - started
+                        self._stats(route).record(elapsed, ok=True)
+                        record_llm_call(route.model, elapsed, chunk.usage.prompt_tokens, chunk.usage.completion_tokens, cached_tokens(chunk.usage))
+                        yield "", chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content, None
+                    chunk = await stream.__anext__()
+            except StopAsyncIteration:
+                pass
+            except Exception as e:
+                self._stats(route).record(None, ok=False)
+                logger.warning(f"LLM route {route} failed while streaming {stage}: {str(e) or type(e).__name__}")
+                raise
+            finally:
+                await stream.close()
+            return
+        raise last_error
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {str(route): stats.as_dict() for route, stats in self.stats.items()}
+
+
+def parse_route(spec: str, default_endpoint: str = "default") -> Route:
+    """
+    Parses "model" or "model@endpoint".
+    """
+    model, _, endpoint = spec.partition("@")
+    return Route(endpoint or default_endpoint, model)
+
+
+def create_llm_router(settings: Config) -> LLMRouter:
+    """
+    Builds the router from the model and routing settings. Stages without configured routes
+    use their *_MODEL setting on the default endpoint.
+    """
+    default_key = settings.api_keys.openai_api_key.get_secret_value()
+    # Retries are handled by the router so that they count towards the stage deadline
+    clients = {"default": AsyncOpenAI(api_key=default_key, base_url=settings.models.openai_base_url, max_retries=0)}
+    for name, endpoint in settings.routing.llm_endpoints.items():
+        clients[name] = AsyncOpenAI(api_key=endpoint.get("api_key", default_key), base_url=endpoint.get("base_url"), max_retries=0)
+
+    stage_models = {
+        "search_term": settings.models.search_model,
+        "url_selection": settings.models.search_model,
+        "extraction": settings.models.extract_model,
+        "answer": settings.models.answer_model,
+    }
+    routes = {}
+    for stage, model in stage_models.items():
+        routes[stage] = [parse_route(spec) for spec in settings.routing.llm_routes.get(stage) or [model]]
+        for route in routes[stage]:
+            if route.endpoint not in clients:
+                raise ValueError(f"Unknown LLM endpoint '{route.endpoint}' in route for {stage}")
+
+    return LLMRouter(
+        clients=clients,
+        routes=routes,
+        deadlines=settings.routing.llm_deadlines,
+        hedge_enabled=settings.routing.llm_hedge_enabled,
+        hedge_percentile=settings.routing.llm_hedge_percentile,
+        hedge_min_delay=settings.routing.llm_hedge_min_delay,
+        retries=settings.routing.llm_retries,
+        backoff=settings.routing.llm_backoff,
+        demote_factor=settings.routing.llm_demote_factor,
+        stats_max_age=settings.routing.llm_stats_max_age,
+    )
@@ -0,0 +1,40 @@
+-- Get involved keys
+local entry_key = KEYS[1]
+local lru_key = KEYS[2]
+local sizes_key = KEYS[3]
+local bytes_key = KEYS[4]
+
+-- Arguments
+local entry_prefix = ARGV[1]
+local member = ARGV[2]
+local now = tonumber(ARGV[3])
+local size = tonumber(ARGV[4])
+local max_bytes = tonumber(ARGV[5])
+local expire = tonumber(ARGV[6])
+
+-- Replace any previous version of this entry
+local previous = tonumber(redis.call("HGET", sizes_key, member) or 0)
+redis.call("DEL", entry_key)
+for i = 7, #ARGV, 2 do
+    redis.call("HSET", entry_key, ARGV[i], ARGV[i + 1])
+end
+redis.call("EXPIRE", entry_key, expire)
+redis.call("HSET", sizes_key, member, size)
+redis.call("ZADD", lru_key, now, member)
+local total = redis.call("INCRBY", bytes_key, size - previous)
+
+-- Evict least recently used entries until the byte budget is respected
+local evicted = 0
+while total > max_bytes do
+    local oldest = redis.call("ZRANGE", lru_key, 0, 0)
+    if #oldest == 0 or oldest[1] == member then break end
+    local victim = oldest[1]
+    local victim_size = tonumber(redis.call("HGET", sizes_key, victim) or 0)
+    redis.call("DEL", entry_prefix .. victim)
+    redis.call("HDEL", sizes_key, victim)
+    redis.call("ZREM", lru_key, victim)
+    total = redis.call("DECRBY", bytes_key, victim_size)
+    evicted = evicted + 1
+end
+
+return evicted
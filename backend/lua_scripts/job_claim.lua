@@ -0,0 +1,34 @@
+-- Get involved keys
+local queue_key = KEYS[1]
+local leases_key = KEYS[2]
+
+-- Arguments
+local job_prefix = ARGV[1]
+local now = tonumber(ARGV[2])
+local lease_until = tonumber(ARGV[3])
+local max_priority = tonumber(ARGV[4])
+local max_recovered = tonumber(ARGV[5])
+local lease_token = ARGV[6]
+
+-- Requeue jobs whose worker stopped renewing their lease, at their original position
+local recovered = 0
+local expired = redis.call("ZRANGEBYSCORE", leases_key, "-inf", now, "LIMIT", 0, max_recovered)
+for _, job_id in ipairs(expired) do
+    redis.call("ZREM", leases_key, job_id)
+    local job = redis.call("HMGET", job_prefix .. job_id, "status", "priority", "created")
+    if job[1] == "running" then
+        redis.call("HSET", job_prefix .. job_id, "status", "queued")
+        redis.call("ZADD", queue_key, (max_priority - tonumber(job[2])) * 1e13 + tonumber(job[3]) * 1000, job_id)
+        recovered = recovered + 1
+    end
+end
+
+-- Take the highest-priority job and lease it
+local popped = redis.call("ZPOPMIN", queue_key)
+if #popped == 0 then
+    return {recovered}
+end
+local job_id = popped[1]
+redis.call("ZADD", leases_key, lease_until, job_id)
+redis.call("HSET", job_prefix .. job_id, "status", "running", "started", ARGV[2], "lease_token", lease_token)
+return {recovered, job_id}
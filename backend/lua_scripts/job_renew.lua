@@ -0,0 +1,15 @@
+-- Get involved keys
+local job_key = KEYS[1]
+local leases_key = KEYS[2]
+
+-- Arguments
+local job_id = ARGV[1]
+local lease_token = ARGV[2]
+local lease_until = tonumber(ARGV[3])
+
+-- Only the worker holding the current lease may renew it; a recovered job belongs to its new worker
+if redis.call("HGET", job_key, "lease_token") ~= lease_token or not redis.call("ZSCORE", leases_key, job_id) then
+    return 0
+end
+redis.call("ZADD", leases_key, lease_until, job_id)
+return 1
@@ -0,0 +1,33 @@
+-- Get involved keys
+local ip_key = KEYS[1]
+local total_key = KEYS[2]
+
+-- Arguments
+local amount = tonumber(ARGV[1])
+local ip_budget = tonumber(ARGV[2])
+local total_budget = tonumber(ARGV[3])
+local interval = tonumber(ARGV[4])
+
+local ip_used = tonumber(redis.call("GET", ip_key) or 0)
+local total_used = tonumber(redis.call("GET", total_key) or 0)
+
+-- Check per-IP budget
+if ip_used + amount > ip_budget then
+    return {0, "ip", redis.call("TTL", ip_key), tostring(ip_budget - ip_used), tostring(total_budget - total_used)}
+end
+
+-- Check global budget
+if total_used + amount > total_budget then
+    return {0, "global", redis.call("TTL", total_key), tostring(ip_budget - ip_used), tostring(total_budget - total_used)}
+end
+
+-- Reserve the estimated cost on both budgets, starting the interval on first use
+local function charge(key)
+    local used = tonumber(redis.call("INCRBYFLOAT", key, amount))
+    if redis.call("TTL", key) < 0 then redis.call("EXPIRE", key, interval) end
+    return used
+end
+ip_used = charge(ip_key)
+total_used = charge(total_key)
+
+return {1, "", -1, tostring(ip_budget - ip_used), tostring(total_budget - total_used)}
@@ -0,0 +1,19 @@
+-- Get involved keys
+local ip_key = KEYS[1]
+local total_key = KEYS[2]
+
+-- Arguments: difference between the actual and the reserved cost
+local delta = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+
+local function adjust(key)
+    local used = tonumber(redis.call("INCRBYFLOAT", key, delta))
+    if used < 0 then
+        redis.call("SET", key, 0, "KEEPTTL")
+        used = 0
+    end
+    if redis.call("TTL", key) < 0 then redis.call("EXPIRE", key, interval) end
+    return used
+end
+
+return {tostring(adjust(ip_key)), tostring(adjust(total_key))}
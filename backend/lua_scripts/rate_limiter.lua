@@ -1,8 +1,8 @@
 -- Get involved keys
 local ip_key = KEYS[1]
+local total_key = KEYS[2]
 
 -- Embedded configuration parameters
-local total_key = "{{TOTAL_KEY}}"
 local per_ip_limit = {{PER_IP_LIMIT}}
 local total_limit = {{TOTAL_LIMIT}}
 local limit_interval = {{LIMIT_INTERVAL}}
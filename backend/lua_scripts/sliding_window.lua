@@ -0,0 +1,42 @@
+-- Get involved keys
+local ip_key = KEYS[1]
+local total_key = KEYS[2]
+
+-- Embedded configuration parameters
+local per_ip_limit = {{PER_IP_LIMIT}}
+local total_limit = {{TOTAL_LIMIT}}
+local window_ms = {{LIMIT_INTERVAL}} * 1000
+
+-- Current time in milliseconds and a unique member for this request
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local member = ARGV[1]
+
+-- Returns the seconds until the oldest entry in the log leaves the window
+local function retry_after(key)
+    local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+    return math.max(1, math.ceil((tonumber(oldest[2]) + window_ms - now) / 1000))
+end
+
+-- Drop entries that fell out of the window
+redis.call("ZREMRANGEBYSCORE", ip_key, "-inf", now - window_ms)
+redis.call("ZREMRANGEBYSCORE", total_key, "-inf", now - window_ms)
+
+-- Check per-IP limit
+if redis.call("ZCARD", ip_key) >= per_ip_limit then
+    return {0, "ip", retry_after(ip_key)} -- Return deny message
+end
+
+-- Check global limit
+if redis.call("ZCARD", total_key) >= total_limit then
+    return {0, "global", retry_after(total_key)} -- Return deny message
+end
+
+-- Record the request in both logs
+redis.call("ZADD", total_key, now, member)
+redis.call("PEXPIRE", total_key, window_ms)
+redis.call("ZADD", ip_key, now, member)
+redis.call("PEXPIRE", ip_key, window_ms)
+
+-- Return allow message
+return {1, nil, nil}
@@ -0,0 +1,46 @@
+-- Generic cell rate algorithm (GCRA): a token bucket that stores a single
+-- "theoretical arrival time" per key instead of a counter.
+
+-- Get involved keys
+local ip_key = KEYS[1]
+local total_key = KEYS[2]
+
+-- Embedded configuration parameters
+local per_ip_limit = {{PER_IP_LIMIT}}
+local total_limit = {{TOTAL_LIMIT}}
+local window_ms = {{LIMIT_INTERVAL}} * 1000
+
+-- Current time in milliseconds
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- Returns the new arrival time, or nil and the milliseconds to wait if the bucket is empty
+local function check(key, limit)
+    local interval = window_ms / limit
+    local tat = math.max(tonumber(redis.call("GET", key) or 0), now)
+    local new_tat = math.ceil(tat + interval)
+    local allow_at = new_tat - window_ms
+    if now < allow_at then
+        return nil, allow_at - now
+    end
+    return new_tat, 0
+end
+
+-- Check per-IP limit
+local ip_tat, ip_wait = check(ip_key, per_ip_limit)
+if not ip_tat then
+    return {0, "ip", math.max(1, math.ceil(ip_wait / 1000))} -- Return deny message
+end
+
+-- Check global limit
+local total_tat, total_wait = check(total_key, total_limit)
+if not total_tat then
+    return {0, "global", math.max(1, math.ceil(total_wait / 1000))} -- Return deny message
+end
+
+-- Consume a token from both buckets
+redis.call("SET", ip_key, ip_tat, "PX", math.ceil(ip_tat - now))
+redis.call("SET", total_key, total_tat, "PX", math.ceil(total_tat - now))
+
+-- Return allow message
+return {1, nil, nil}
@@ -1,16 +1,27 @@
 import asyncio
-from fastapi import FastAPI, HTTPException, Request, Body
+from fastapi import FastAPI, HTTPException, Request, Body, Header
 from fastapi.middleware.cors import CORSMiddleware
+import uvicorn
+from uvicorn.importer import import_from_string
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
-from pydantic import BaseModel
+from uvicorn.supervisors import Multiprocess
+from pydantic import BaseModel, Field
 from web_research import WebResearcher
 from llm_operations import LLMHandler
+from pipeline import ResearchPlan, ResearchTrace
 from config import config
-from utils import setup_logging
+from utils import setup_logging, fix_footnotes, CircuitBreaker
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+import json
 import logging
-from contextlib import asynccontextmanager
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager, contextmanager
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from rate_limiter import RateLimiter, aioredis
+from quotas import QuotaManager
+from cache import AnswerCache
+from jobs import JobQueue, JobQueueFull, JobWorker, MAX_PRIORITY
+from metrics import observe_stage, register_stats_source, render_metrics, setup_tracing
+from semantic_cache import Embedder, SemanticCache
 from ipaddress import ip_network, ip_address
 
 # Setup logging
@@ -19,42 +30,130 @@ setup_logging(log_file='app.log', log_level=log_level)
 logger = logging.getLogger(__name__)
 
 class ResearchAssistant:
-    def __init__(self):
-        self.web_researcher = WebResearcher()
-        self.llm_handler = LLMHandler()
+    def __init__(self, redis_client: aioredis.Redis = None):
+        self.llm_handler = LLMHandler(redis_client=redis_client)
+        self.web_researcher = WebResearcher(llm_handler=self.llm_handler, redis_client=redis_client)
+        self.answer_cache = AnswerCache(
+            redis_client if config.cache.answer_cache_enabled else None,
+            ttl=config.cache.answer_cache_ttl
+        )
+        self.semantic_cache = None
+        if config.cache.semantic_cache_enabled and redis_client is not None:
+            self.semantic_cache = SemanticCache(
+                redis_client,
+                Embedder(
+                    base_url=config.cache.embedding_base_url,
+                    api_key=config.cache.embedding_api_key,
+                    model=config.cache.embedding_model,
+                    timeout=config.cache.embedding_timeout
+                ),
+                threshold=config.cache.semantic_cache_threshold,
+                ttl=config.cache.semantic_cache_ttl,
+                hnsw_threshold=config.cache.semantic_cache_hnsw_threshold
+            )
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
     
     async def __aenter__(self):
         await self.web_researcher.__aenter__()
         return self
 
+    @contextmanager
+    def _job(self):
+        """
+        Counts a research request as in flight until it finishes, so that shutdown can wait for it.
+        """
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def drain(self, timeout: float):
+        """
+        Waits up to `timeout` seconds for in-flight research to finish.
+        """
+        if self.in_flight:
+            logger.info(f"Waiting for {self.in_flight} in-flight research request(s) to finish")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self.in_flight} research request(s) still in flight")
+
     async def __aexit__(self, exc_type, exc_value, traceback):
         await self.web_researcher.__aexit__(exc_type, exc_value, traceback)
 
-    async def research_and_answer(self, question: str) -> dict:
+    async def _research(self, question: str, trace: ResearchTrace) -> Tuple[ResearchPlan, Dict[str, str]]:
+        # Generate the research plan once; it is reused by every later stage
+        with trace.stage("plan"):
+            plan = await self.web_researcher.plan(question)
+        if plan.is_empty():
+            raise ValueError("Failed to generate search terms")
+        trace.emit("plan", search_terms=plan.search_terms, custom_urls=plan.custom_urls)
+
+        # Perform web research
+        extracted_info = await self.web_researcher.research(question, plan=plan, trace=trace)
+        if not extracted_info:
+            raise ValueError("Failed to extract relevant information")
+        return plan, extracted_info
+
+    def _build_result(self, question: str, answer: str, plan: ResearchPlan, extracted_info: Dict[str, str], trace: ResearchTrace) -> dict:
+        timings = trace.as_dict()
+        observe_stage("total", timings["total"])
+        logger.info(f"Stage timings: {timings}")
+        logger.info(f"Tokens saved by pruning: {sum(page.get('tokens_saved', 0) for page in trace.pages.values())}")
+
+        return {
+            "question": question,
+            "answer": answer,
+            "search_terms": plan.search_terms,
+            "relevant_urls": list(extracted_info.keys()),
+            "timings": timings,
+            "pages": trace.pages,
+            "usage": trace.run_usage()
+        }
+
+    async def _semantic_lookup(self, question: str) -> Tuple[Optional[dict], Any]:
+        if self.semantic_cache is None:
+            return None, None
+        return await self.semantic_cache.lookup(question)
+
+    async def research_and_answer(self, question: str, trace: Optional[ResearchTrace] = None) -> dict:
+        """
+        Answers a question, serving cached answers (also for paraphrased questions) and sharing
+        one pipeline run between concurrent identical questions.
+        """
+        trace = trace or ResearchTrace()
+        with self._job():
+            cached, embedding = await self._semantic_lookup(question)
+            if cached is not None:
+                return cached
+            # Bound while waiting, so that this request is charged its share of a coalesced run
+            with trace.bind():
+                return await self.answer_cache.get_or_fetch(
+                    AnswerCache.make_key(question),
+                    lambda: self._research_and_answer(question, trace, embedding)
+                )
+
+    async def _research_and_answer(self, question: str, trace: ResearchTrace, embedding: Any = None) -> dict:
         try:
-            # Generate search queries
-            search_terms, custom_urls = await self.llm_handler.generate_search_queries(question)
-            if not search_terms and not custom_urls:
-                raise ValueError("Failed to generate search terms")
-            logger.info(f"Generated search terms: {search_terms}")
-            logger.info(f"Custom URLs: {custom_urls}")
-
-            # Perform web research
-            extracted_info = await self.web_researcher.research(question)
-            if not extracted_info:
-                raise ValueError("Failed to extract relevant information")
-            
-            # Synthesize answer
-            answer = await self.llm_handler.synthesize_answer(question, extracted_info)
+            with trace.activate():
+                plan, extracted_info = await self._research(question, trace)
+                
+                # Synthesize answer
+                with trace.stage("synthesize"):
+                    answer = await self.llm_handler.synthesize_answer(question, extracted_info)
             if not answer:
                 raise ValueError("Failed to generate an answer")
 
-            return {
-                "question": question,
-                "answer": answer,
-                "search_terms": search_terms,
-                "relevant_urls": list(extracted_info.keys())
-            }
+            result = self._build_result(question, answer, plan, extracted_info, trace)
+            if self.semantic_cache is not None:
+                await self.semantic_cache.add(question, result, embedding)
+            return result
         except ValueError as e:
             logger.error(f"Research process failed: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
@@ -62,6 +161,88 @@ class ResearchAssistant:
             logger.error(f"Unexpected error: {str(e)}")
             raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
+    async def _research_in_trace(self, question: str, trace: ResearchTrace) -> Tuple[ResearchPlan, Dict[str, str]]:
+        with trace.activate():
+            return await self._research(question, trace)
+
+    async def research_and_answer_stream(self, question: str, trace: Optional[ResearchTrace] = None) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Runs the same pipeline as research_and_answer, yielding (event, data) pairs as stages progress
+        and streaming the answer tokens. Failures are reported as a final "error" event.
+        """
+        stream = self._research_and_answer_stream(question, trace)
+        with self._job():
+            try:
+                async for item in stream:
+                    yield item
+            finally:
+                await stream.aclose()
+
+    async def _research_and_answer_stream(self, question: str, trace: Optional[ResearchTrace]) -> AsyncIterator[Tuple[str, dict]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        trace = trace or ResearchTrace()
+        trace.on_event = lambda event, data: queue.put_nowait((event, data))
+        yield "accepted", {"question": question}
+
+        cached, embedding = await self._semantic_lookup(question)
+        if cached is not None:
+            yield "done", cached
+            return
+
+        research_task = asyncio.ensure_future(self._research_in_trace(question, trace))
+        research_task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            plan, extracted_info = research_task.result()
+
+            chunks = []
+            with trace.stage("synthesize"):
+                async for delta in self.llm_handler.synthesize_answer_stream(question, extracted_info, trace=trace):
+                    chunks.append(delta)
+                    yield "answer_delta", {"text": delta}
+            answer = fix_footnotes("".join(chunks))
+            if not answer:
+                raise ValueError("Failed to generate an answer")
+
+            result = self._build_result(question, answer, plan, extracted_info, trace)
+            await self.answer_cache.store(question, result)
+            if self.semantic_cache is not None:
+                await self.semantic_cache.add(question, result, embedding)
+            yield "done", result
+        except ValueError as e:
+            logger.error(f"Research process failed: {str(e)}")
+            yield "error", {"detail": str(e)}
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            yield "error", {"detail": "An unexpected error occurred"}
+        finally:
+            # Stop crawling if the client went away before the research finished
+            research_task.cancel()
+
+def register_metrics_sources(research_assistant: ResearchAssistant):
+    """
+    Exposes the in-process cache and crawler statistics on /metrics.
+    """
+    web_researcher = research_assistant.web_researcher
+    register_stats_source("search_cache", web_researcher.search_cache.stats.as_dict)
+    register_stats_source("extraction_cache", research_assistant.llm_handler.extraction_cache.stats.as_dict)
+    register_stats_source("answer_cache", research_assistant.answer_cache.stats.as_dict)
+    if web_researcher.content_cache:
+        register_stats_source("content_cache", web_researcher.content_cache.stats.as_dict)
+    if research_assistant.semantic_cache:
+        register_stats_source("semantic_cache", research_assistant.semantic_cache.stats_dict)
+    if web_researcher.static_fetcher:
+        register_stats_source("static_fetcher", web_researcher.static_fetcher.stats)
+    register_stats_source("crawler", web_researcher.crawl_scheduler.stats)
+    register_stats_source("domains", web_researcher.domain_stats.stats)
+    if web_researcher.ranker:
+        register_stats_source("url_ranker", web_researcher.ranker.stats)
+    register_stats_source("research", lambda: {"in_flight": research_assistant.in_flight})
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Initialize Redis client
@@ -74,18 +255,81 @@ async def lifespan(app: FastAPI):
         total_limit=config.rate_limits.limit_total,
         limit_interval=config.rate_limits.limit_interval,
         obfuscate_ips=config.obfuscation.obfuscate_ips,
-        salt=config.obfuscation.secret_salt
+        salt=config.obfuscation.secret_salt,
+        algorithm=config.rate_limits.limit_algorithm,
+        global_shards=config.rate_limits.limit_global_shards,
+        redis_timeout=config.rate_limits.limit_redis_timeout,
+        breaker=CircuitBreaker(
+            failure_threshold=config.rate_limits.limit_breaker_threshold,
+            reset_timeout=config.rate_limits.limit_breaker_reset
+        ),
+        ip_failure_mode=config.rate_limits.limit_ip_failure_mode,
+        global_failure_mode=config.rate_limits.limit_global_failure_mode
     )
     
+    # Create QuotaManager instance
+    app.state.quota_manager = QuotaManager(
+        redis_client=app.state.redis,
+        client_id=app.state.rate_limiter.client_id,
+        per_ip_budget=config.quotas.quota_per_ip,
+        total_budget=config.quotas.quota_total,
+        interval=config.quotas.quota_interval,
+        reservation=config.quotas.quota_reservation,
+        weights=config.quotas.weights()
+    ) if config.quotas.quota_enabled else None
+    
     # Create ResearchAssistant instance
-    app.state.research_assistant = await ResearchAssistant().__aenter__()
+    app.state.research_assistant = await ResearchAssistant(redis_client=app.state.redis).__aenter__()
+    setup_tracing()
+    register_metrics_sources(app.state.research_assistant)
+
+    # Create the job queue and, if configured, run job slots inside this process
+    app.state.job_queue = JobQueue(
+        redis_client=app.state.redis,
+        max_queued=config.jobs.jobs_max_queued,
+        result_ttl=config.jobs.jobs_result_ttl,
+        lease_timeout=config.jobs.jobs_lease_timeout
+    )
+    job_worker = job_worker_task = None
+    if config.jobs.jobs_embedded_workers > 0:
+        job_worker = JobWorker(
+            queue=app.state.job_queue,
+            research_assistant=app.state.research_assistant,
+            concurrency=config.jobs.jobs_embedded_workers,
+            quota_manager=app.state.quota_manager,
+            poll_interval=config.jobs.jobs_poll_interval
+        )
+        job_worker_task = asyncio.ensure_future(job_worker.run())
+    
+    app.state.job_worker, app.state.job_worker_task, app.state.drain_task = job_worker, job_worker_task, None
     
     try:
         yield
     finally:
+        # Normally started by DrainingServer when the shutdown began
+        await start_draining(app)
         await app.state.research_assistant.__aexit__(None, None, None)
         await app.state.redis.close()
 
+async def drain(app: FastAPI):
+    """
+    Stops the job slots and lets running jobs and research finish, within one graceful timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config.api.api_graceful_timeout
+    if app.state.job_worker is not None:
+        app.state.job_worker.stop()
+        try:
+            await asyncio.wait_for(app.state.job_worker_task, timeout=config.api.api_graceful_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Job slots did not finish in time, requeueing their jobs")
+    await app.state.research_assistant.drain(max(0.0, deadline - loop.time()))
+
+def start_draining(app: FastAPI) -> asyncio.Future:
+    if getattr(app.state, "drain_task", None) is None:
+        app.state.drain_task = asyncio.ensure_future(drain(app))
+    return app.state.drain_task
+
 app = FastAPI(
     title="OpenAnswer Research Assistant API",
     description="This API provides answers to user questions by performing web research and utilizing large language models (LLMs) to synthesize responses.",
@@ -101,14 +345,14 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=[config.cors.domain],
     allow_credentials=True,
-    allow_methods=["POST", "GET"],
+    allow_methods=["POST", "GET", "DELETE"],
     allow_headers=["*"],
 )
 
 # Define CORS headers to dynamically add in responses
 cors_headers = {
     "Access-Control-Allow-Origin": config.cors.domain,
-    "Access-Control-Allow-Methods": "POST, GET",
+    "Access-Control-Allow-Methods": "POST, GET, DELETE",
     "Access-Control-Allow-Headers": "*",
     "Access-Control-Allow-Credentials": "true"
 }
@@ -119,29 +363,83 @@ LOCAL_NETS = [
     ip_network("172.16.0.0/12")
 ]
 
+RATE_LIMITED_PATHS = ("/api/answer", "/api/answer/stream", "/api/answer/jobs")
+
 def is_local_network(ip: str):
     """Check if the IP address belongs to a local network."""
     ip_obj = ip_address(ip)
     return any(ip_obj in net for net in LOCAL_NETS)
 
+def rate_limit_response(detail: dict, retry_after) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content=detail,
+        headers={
+            "Retry-After": str(retry_after),
+            **cors_headers  # Include CORS headers
+        }
+    )
+
+async def settle_quota(request: Request, trace: ResearchTrace):
+    """
+    Charges the actual resources used by a request against the reservation made by the middleware.
+    """
+    reservation = getattr(request.state, "quota_reservation", None)
+    if reservation is None:
+        return
+    cost = await request.app.state.quota_manager.settle(reservation, trace.usage)
+    logger.info(f"Request cost {cost:.2f} units (reserved {reservation.amount:.2f}): {trace.usage}")
+
+async def cached_answer_response(request: Request):
+    """
+    Returns a response for a question whose answer is already cached, or None.
+    """
+    answer_cache: AnswerCache = request.app.state.research_assistant.answer_cache
+    if answer_cache.redis is None or request.url.path == "/api/answer/jobs":
+        return None
+    try:
+        question = Question.model_validate_json(await request.body())
+    except ValueError:
+        return None  # Let the endpoint report the validation error
+    result = await answer_cache.peek(question.content)
+    if result is None:
+        return None
+
+    result = {**result, "cached": True}
+    if request.url.path == "/api/answer/stream":
+        events = format_sse("accepted", {"question": question.content}) + format_sse("done", result)
+        return StreamingResponse(
+            iter([events]),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", **cors_headers}  # Include CORS headers
+        )
+    return JSONResponse(content=result, headers=cors_headers)
+
 # Rate limiting middleware
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
     if request.method == "OPTIONS":
         return await call_next(request)
 
-    # Apply rate limiting only to /api/answer
-    if request.url.path == "/api/answer":
+    # Apply rate limiting only to the answer endpoints
+    if request.url.path in RATE_LIMITED_PATHS:
         # Use request.client.host to get the client IP
         # This will be automatically updated by ProxyHeadersMiddleware if a proxy is used
         client_ip = request.client.host
         if config.proxy.use_proxy:
             client_ip = request.headers.get('X-Real-IP')
 
+        # Serve cached answers before any rate limit or quota is charged
+        cached_response = await cached_answer_response(request)
+        if cached_response is not None:
+            return cached_response
+
         if config.rate_limits.enforce_limit_in_localnet or not is_local_network(client_ip):
             rate_limiter: RateLimiter = request.app.state.rate_limiter
             limit_status = await rate_limiter.check_limits(client_ip)
 
+            quota_manager: QuotaManager = request.app.state.quota_manager
+
             if not limit_status["allowed"]:
                 limit_type = limit_status["exceeded"]
                 retry_after = limit_status["retry_after"]
@@ -152,14 +450,21 @@ async def rate_limit_middleware(request: Request, call_next):
                     "limit_type": limit_type.upper(),
                     "retry_after_seconds": retry_after
                 }
-                return JSONResponse(
-                    status_code=429,
-                    content=detail,
-                    headers={
-                        "Retry-After": str(retry_after),
-                        **cors_headers  # Include CORS headers
+                if quota_manager:
+                    detail["remaining_budget"] = await quota_manager.remaining(client_ip)
+                return rate_limit_response(detail, retry_after)
+
+            if quota_manager:
+                reservation = await quota_manager.reserve(client_ip)
+                if not reservation.allowed:
+                    detail = {
+                        "detail": "Usage quota exceeded",
+                        "limit_type": f"{reservation.exceeded.upper()}_QUOTA",
+                        "retry_after_seconds": reservation.retry_after,
+                        "remaining_budget": reservation.remaining_budget()
                     }
-                )
+                    return rate_limit_response(detail, reservation.retry_after)
+                request.state.quota_reservation = reservation
 
     # Proceed with the request if rate limits are not exceeded or for other paths
     response = await call_next(request)
@@ -170,26 +475,153 @@ class Question(BaseModel):
     content: str
 
 @app.post("/api/answer")
-async def get_answer_for_question(question: Question = Body(...)):
-    result = await app.state.research_assistant.research_and_answer(question.content)
+async def get_answer_for_question(request: Request, question: Question = Body(...)):
+    trace = ResearchTrace()
+    try:
+        result = await app.state.research_assistant.research_and_answer(question.content, trace=trace)
+    finally:
+        await settle_quota(request, trace)
     return result
 
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/api/answer/stream")
+async def stream_answer_for_question(request: Request, question: Question = Body(...)):
+    trace = ResearchTrace()
+
+    async def event_stream():
+        try:
+            async for event, data in app.state.research_assistant.research_and_answer_stream(question.content, trace=trace):
+                yield format_sse(event, data)
+        finally:
+            await settle_quota(request, trace)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering so events are delivered immediately
+        }
+    )
+
+class JobRequest(BaseModel):
+    content: str
+    priority: int = Field(default=0, ge=0, le=MAX_PRIORITY)
+    deadline_seconds: Optional[float] = Field(default=None, gt=0)
+
+@app.post("/api/answer/jobs", status_code=202)
+async def submit_answer_job(request: Request, job: JobRequest = Body(...)):
+    job_queue: JobQueue = app.state.job_queue
+    try:
+        job_id = await job_queue.submit(
+            job.content,
+            priority=job.priority,
+            deadline=job.deadline_seconds or config.jobs.jobs_default_deadline,
+            reservation=getattr(request.state, "quota_reservation", None)
+        )
+    except JobQueueFull:
+        raise HTTPException(status_code=503, detail="Job queue is full", headers={"Retry-After": "30"})
+    return await job_queue.get(job_id)
+
+@app.get("/api/answer/jobs/{job_id}")
+async def get_answer_job(job_id: str):
+    job = await app.state.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/api/answer/jobs/{job_id}")
+async def cancel_answer_job(job_id: str):
+    status = await app.state.job_queue.cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
+@app.get("/api/answer/jobs/{job_id}/events")
+async def stream_answer_job(job_id: str, last_event_id: Optional[str] = Header(default=None)):
+    job_queue: JobQueue = app.state.job_queue
+    if await job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event_id, event, data in job_queue.events(job_id, last_event_id=last_event_id or "0"):
+            if event == "ping":
+                yield ": ping\n\n"  # Keeps idle proxies from closing the connection
+            else:
+                yield f"id: {event_id}\n" + format_sse(event, data)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # Redis backs the limits, caches and jobs; without it the service still answers, but degraded
+    try:
+        await asyncio.wait_for(app.state.redis.ping(), timeout=1.0)
+    except Exception:
+        return {"status": "degraded", "redis": False}
+    return {"status": "healthy", "redis": True}
 
-def main():
-    from uvicorn import Config, Server
+@app.get("/metrics")
+async def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/api/stats")
+async def cache_stats():
+    web_researcher = app.state.research_assistant.web_researcher
+    return {
+        "search_cache": web_researcher.search_cache.stats.as_dict(),
+        "content_cache": web_researcher.content_cache.stats.as_dict() if web_researcher.content_cache else None,
+        "extraction_cache": app.state.research_assistant.llm_handler.extraction_cache.stats.as_dict(),
+        "semantic_cache": app.state.research_assistant.semantic_cache.stats_dict() if app.state.research_assistant.semantic_cache else None,
+        "crawler": web_researcher.crawl_scheduler.stats(),
+        "static_fetcher": web_researcher.static_fetcher.stats() if web_researcher.static_fetcher else None,
+        "url_ranker": web_researcher.ranker.stats() if web_researcher.ranker else None,
+        "domains": web_researcher.domain_stats.stats(),
+        "rate_limiter": app.state.rate_limiter.stats(),
+        "llm_routes": app.state.research_assistant.llm_handler.router.stats_dict(),
+        "jobs": await app.state.job_queue.stats()
+    }
+
+class DrainingServer(uvicorn.Server):
+    """
+    Starts draining research and job slots as soon as shutdown begins, while uvicorn waits for
+    open connections. Both use the same graceful timeout, so research gets to finish before
+    uvicorn cancels the requests that are waiting for it.
+    """
+    async def shutdown(self, sockets=None):
+        # The app uvicorn imported, which is not this module's copy when run as a script
+        served_app = import_from_string(self.config.app)
+        if getattr(served_app.state, "research_assistant", None) is not None:
+            start_draining(served_app)
+        await super().shutdown(sockets)
 
-    uvicorn_config = Config(
+def main():
+    uvicorn_config = uvicorn.Config(
         app="main:app",
         host=config.api.api_host,
         port=config.api.api_port,
+        workers=config.api.api_workers,
         reload=False,
-        log_level="info"
+        log_level="info",
+        timeout_graceful_shutdown=int(config.api.api_graceful_timeout)
     )
-    server = Server(config=uvicorn_config)
-    
+    server = DrainingServer(config=uvicorn_config)
+
+    if config.api.api_workers > 1:
+        # Uvicorn's process manager forks the workers; each one runs its own lifespan
+        Multiprocess(uvicorn_config, target=server.run, sockets=[uvicorn_config.bind_socket()]).run()
+        return
+
     asyncio.run(server.serve())
 
 if __name__ == "__main__":
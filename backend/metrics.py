@@ -0,0 +1,170 @@
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Tuple
+from urllib.parse import urlsplit
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from config import config
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # OpenTelemetry is optional; spans are skipped without it
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "openanswer_stage_seconds", "Wall-clock time per research stage", ["stage"], buckets=STAGE_BUCKETS
+)
+LLM_CALL_SECONDS = Histogram(
+    "openanswer_llm_call_seconds", "LLM request latency by model", ["model"], buckets=STAGE_BUCKETS
+)
+LLM_TOKENS = Counter("openanswer_llm_tokens", "LLM tokens by model and kind", ["model", "kind"])
+LLM_COST = Counter("openanswer_llm_cost_dollars", "Estimated LLM cost by model", ["model"])
+CRAWLS = Counter("openanswer_crawls", "Page fetches by domain, method and outcome", ["domain", "method", "outcome"])
+RATE_LIMIT_DECISIONS = Counter("openanswer_rate_limit_decisions", "Rate limiter decisions", ["source", "decision"])
+
+_stats_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+_domains = set()
+_tracer = None
+
+
+def observe_stage(stage: str, seconds: float):
+    if config.metrics.metrics_enabled:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_llm_call(model: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0, cached_tokens: int = 0):
+    """
+    Records latency, token counts and the estimated cost of one LLM call. Cached prompt tokens
+    are part of prompt_tokens and are billed at the optional third price, if configured.
+    """
+    if not config.metrics.metrics_enabled:
+        return
+    if seconds:
+        LLM_CALL_SECONDS.labels(model).observe(seconds)
+    LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+    LLM_TOKENS.labels(model, "cached").inc(cached_tokens)
+    prices = config.metrics.llm_prices.get(model)
+    if prices:
+        cached_price = prices[2] if len(prices) > 2 else prices[0]
+        prompt_cost = (prompt_tokens - cached_tokens) * prices[0] + cached_tokens * cached_price
+        LLM_COST.labels(model).inc((prompt_cost + completion_tokens * prices[1]) / 1_000_000)
+
+
+def _domain_label(url: str) -> str:
+    # Bound label cardinality; domains beyond the limit are reported together
+    domain = (urlsplit(url).hostname or "").lower()
+    if domain in _domains:
+        return domain
+    if len(_domains) < config.metrics.metrics_max_domains:
+        _domains.add(domain)
+        return domain
+    return "other"
+
+
+def record_crawl(url: str, method: str, outcome: str):
+    if config.metrics.metrics_enabled:
+        CRAWLS.labels(_domain_label(url), method, outcome).inc()
+
+
+def record_rate_limit(source: str, decision: str):
+    if config.metrics.metrics_enabled:
+        RATE_LIMIT_DECISIONS.labels(source, decision).inc()
+
+
+def register_stats_source(name: str, source: Callable[[], Dict[str, Any]]):
+    """
+    Exposes an in-process stats() dictionary, e.g. cache counters, on /metrics.
+    """
+    _stats_sources[name] = source
+
+
+class StatsCollector:
+    """
+    Converts the in-process cache and crawler statistics into Prometheus metrics at scrape time.
+    """
+    def __init__(self, per_worker: bool = False):
+        self.extra_labels = ["worker"] if per_worker else []
+        self.extra_values = [str(os.getpid())] if per_worker else []
+
+    def collect(self):
+        events = CounterMetricFamily("openanswer_cache_events", "Cache lookups by outcome", labels=["cache", "event"] + self.extra_labels)
+        ratios = GaugeMetricFamily("openanswer_cache_hit_ratio", "Cache hit ratio", labels=["cache"] + self.extra_labels)
+        gauges = GaugeMetricFamily("openanswer_component_stat", "Numeric component statistics", labels=["component", "stat"] + self.extra_labels)
+        for name, source in list(_stats_sources.items()):
+            try:
+                stats = source()
+            except Exception as e:
+                logger.warning(f"Failed to collect {name} stats: {str(e)}")
+                continue
+            if stats is None:
+                continue
+            if "hit_ratio" in stats:
+                ratios.add_metric([name] + self.extra_values, stats["hit_ratio"])
+                for event in ("hits", "misses", "coalesced", "revalidated", "errors"):
+                    events.add_metric([name, event] + self.extra_values, stats.get(event, 0))
+            else:
+                for stat, value in stats.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        gauges.add_metric([name, stat] + self.extra_values, value)
+        yield events
+        yield ratios
+        yield gauges
+
+
+if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+    REGISTRY.register(StatsCollector())
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Renders all metrics in the Prometheus text format. With several workers, PROMETHEUS_MULTIPROC_DIR
+    aggregates the histograms and counters of every worker; in-process stats are labelled per worker.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(StatsCollector(per_worker=True))
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def setup_tracing():
+    """
+    Exports OpenTelemetry spans over OTLP when enabled and the SDK is installed.
+    """
+    global _tracer
+    if not config.metrics.otel_enabled:
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning("OpenTelemetry is enabled but opentelemetry-sdk or the OTLP exporter is not installed")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": config.metrics.otel_service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    _tracer = otel_trace.get_tracer("openanswer")
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[None]:
+    """
+    Wraps the block in an OpenTelemetry span, nested under the current one, when tracing is set up.
+    """
+    if _tracer is None:
+        yield
+        return
+    with _tracer.start_as_current_span(name, attributes=attributes):
+        yield
@@ -0,0 +1,135 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from metrics import observe_stage, span
+from utils import get_human_readable_datetime
+
+
+class ResearchPlan(NamedTuple):
+    search_terms: List[str]
+    custom_urls: List[str]
+
+    def is_empty(self) -> bool:
+        return not self.search_terms and not self.custom_urls
+
+
+current_trace: "ContextVar[Optional[ResearchTrace]]" = ContextVar("current_trace", default=None)
+
+
+class SharedUsage:
+    """
+    Usage recorded by work that several requests share, such as a coalesced search, crawl or
+    extraction. Every request that receives the shared result is charged an equal share.
+    """
+    def __init__(self):
+        self.usage: Dict[str, float] = {}
+        self.waiters = 0
+
+    def add_usage(self, **amounts):
+        for name, amount in amounts.items():
+            self.usage[name] = self.usage.get(name, 0) + amount
+
+    def charge(self):
+        """
+        Charges one waiter's share to the caller's own trace (or enclosing shared work).
+        """
+        if self.usage and self.waiters:
+            record_usage(**{name: round(amount / self.waiters, 3) for name, amount in self.usage.items()})
+
+
+shared_usage: "ContextVar[Optional[SharedUsage]]" = ContextVar("shared_usage", default=None)
+
+
+def record_usage(**amounts):
+    """
+    Adds resource usage to the shared work being run, if any, otherwise to the active research trace.
+    """
+    sink = shared_usage.get() or current_trace.get()
+    if sink is not None:
+        sink.add_usage(**amounts)
+
+
+def prompt_date() -> str:
+    """
+    The date shown to the LLM: fixed once per research request so that every prompt of a
+    request agrees, or the current time outside of one.
+    """
+    trace = current_trace.get()
+    return trace.prompt_date if trace is not None else get_human_readable_datetime()
+
+
+class ResearchTrace:
+    """
+    Collects per-stage wall-clock timings and per-page statistics for a single research request.
+    Progress events are forwarded to `on_event` when a listener is attached, e.g. for streaming.
+    Resource usage (LLM tokens, crawl seconds, search calls) is accumulated while the trace is active.
+    """
+    def __init__(self, on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None):
+        self.timings: Dict[str, float] = {}
+        self.pages: Dict[str, Dict[str, Any]] = {}
+        self.usage: Dict[str, float] = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "crawl_seconds": 0.0, "search_calls": 0}
+        self.on_event = on_event
+        self.prompt_date = get_human_readable_datetime()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def bind(self):
+        """
+        Makes this trace the current one, so that deeper layers can record usage against it.
+        """
+        token = current_trace.set(self)
+        try:
+            yield self
+        finally:
+            current_trace.reset(token)
+
+    @contextmanager
+    def activate(self):
+        """
+        Binds this trace for a research run, traced as one span.
+        """
+        with self.bind(), span("research"):
+            yield self
+
+    def add_usage(self, **amounts):
+        for name, amount in amounts.items():
+            self.usage[name] = self.usage.get(name, 0) + amount
+
+    def run_usage(self) -> Dict[str, float]:
+        """
+        Usage of the research run so far. A run shared by coalesced requests records into its
+        SharedUsage until it finishes, so that usage is included here as well.
+        """
+        shared = shared_usage.get()
+        if shared is None:
+            return dict(self.usage)
+        return {name: self.usage.get(name, 0) + shared.usage.get(name, 0) for name in {**self.usage, **shared.usage}}
+
+    def emit(self, event: str, **data):
+        if self.on_event is not None:
+            self.on_event(event, data)
+
+    def record_page(self, url: str, **stats):
+        self.pages.setdefault(url, {}).update(stats)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the enclosed block and records it under the given stage name.
+        """
+        start = time.perf_counter()
+        try:
+            with span(name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = round(self.timings.get(name, 0.0) + elapsed, 3)
+            observe_stage(name, elapsed)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def as_dict(self) -> Dict[str, float]:
+        return {**self.timings, "total": round(self.elapsed(), 3)}
@@ -0,0 +1,113 @@
+import logging
+from typing import Callable, Dict, NamedTuple, Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class QuotaReservation(NamedTuple):
+    allowed: bool
+    exceeded: Optional[str]
+    retry_after: Optional[int]
+    remaining_ip: Optional[float]
+    remaining_global: Optional[float]
+    ip_key: Optional[str]
+    amount: float
+
+    def remaining_budget(self) -> Dict[str, Optional[float]]:
+        return {"ip": self.remaining_ip, "global": self.remaining_global}
+
+
+class QuotaManager:
+    """
+    Charges per-IP and global budgets by the resources a request actually uses.
+    A fixed estimate is reserved before the request runs and the difference to the
+    actual cost (LLM tokens, crawl seconds, search calls) is settled afterwards.
+    """
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        client_id: Callable[[str], str],
+        per_ip_budget: float,
+        total_budget: float,
+        interval: int,
+        reservation: float,
+        weights: Dict[str, float],
+    ):
+        self.redis = redis_client
+        self.client_id = client_id
+        self.per_ip_budget = per_ip_budget
+        self.total_budget = total_budget
+        self.interval = interval
+        self.reservation = reservation
+        self.weights = weights
+        self.total_key = "quota:global"
+        self.ip_key_prefix = "quota:ip:"
+
+        with open("./lua_scripts/quota_reserve.lua", 'r') as file:
+            self.reserve_script = self.redis.register_script(file.read())
+        with open("./lua_scripts/quota_settle.lua", 'r') as file:
+            self.settle_script = self.redis.register_script(file.read())
+
+    def cost(self, usage: Dict[str, float]) -> float:
+        """
+        Converts resource usage into budget units using the configured weights.
+        """
+        return sum(usage.get(resource, 0) * weight for resource, weight in self.weights.items())
+
+    async def reserve(self, ip: str, amount: Optional[float] = None) -> QuotaReservation:
+        """
+        Reserves the estimated cost of a request. Fails open if Redis is unavailable.
+        """
+        amount = self.reservation if amount is None else amount
+        try:
+            ip_key = f"{self.ip_key_prefix}{self.client_id(ip)}"
+            result = await self.reserve_script(
+                keys=[ip_key, self.total_key],
+                args=[amount, self.per_ip_budget, self.total_budget, self.interval]
+            )
+        except (aioredis.RedisError, ValueError) as e:
+            logger.warning(f"Quota reservation failed, allowing request: {str(e)}")
+            return QuotaReservation(True, None, None, None, None, None, 0.0)
+
+        allowed = bool(result[0])
+        return QuotaReservation(
+            allowed=allowed,
+            exceeded=result[1] or None,
+            retry_after=max(int(result[2]), 1) if not allowed else None,
+            remaining_ip=round(max(float(result[3]), 0.0), 2),
+            remaining_global=round(max(float(result[4]), 0.0), 2),
+            ip_key=ip_key if allowed else None,
+            amount=amount
+        )
+
+    async def settle(self, reservation: QuotaReservation, usage: Dict[str, float]) -> float:
+        """
+        Replaces the reserved amount with the actual cost of the request and returns that cost.
+        """
+        actual = self.cost(usage)
+        if reservation.ip_key is None:
+            return actual
+        try:
+            await self.settle_script(
+                keys=[reservation.ip_key, self.total_key],
+                args=[actual - reservation.amount, self.interval]
+            )
+        except aioredis.RedisError as e:
+            logger.warning(f"Quota settlement failed: {str(e)}")
+        return actual
+
+    async def remaining(self, ip: str) -> Dict[str, Optional[float]]:
+        """
+        Returns the remaining per-IP and global budget without charging anything.
+        """
+        try:
+            ip_used, total_used = await self.redis.mget(f"{self.ip_key_prefix}{self.client_id(ip)}", self.total_key)
+        except (aioredis.RedisError, ValueError):
+            return {"ip": None, "global": None}
+        return {
+            "ip": round(max(self.per_ip_budget - float(ip_used or 0), 0.0), 2),
+            "global": round(max(self.total_budget - float(total_used or 0), 0.0), 2)
+        }
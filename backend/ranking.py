@@ -0,0 +1,101 @@
+import logging
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from semantic_cache import Embedder
+from text_processing import BM25, tokenize
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class Ranking(NamedTuple):
+    urls: List[str]
+    confident: bool
+
+
+class ResultRanker:
+    """
+    Ranks search results locally on their title and snippet with BM25, optionally blended with
+    embedding similarity, so that URL selection does not have to wait for an LLM round-trip.
+
+    A ranking is confident when every selected result mentions at least `min_coverage` of the
+    question's terms and the last selected result beats the best remaining one by `margin`.
+    """
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        embedding_weight: float = 0.5,
+        select: int = 5,
+        max_per_domain: int = 1,
+        min_coverage: float = 0.5,
+        margin: float = 0.1
+    ):
+        self.embedder = embedder
+        self.embedding_weight = embedding_weight
+        self.select = select
+        self.max_per_domain = max_per_domain
+        self.min_coverage = min_coverage
+        self.margin = margin
+        self.confident = 0
+        self.ambiguous = 0
+
+    async def _scores(self, question: str, texts: List[str], documents: List[List[str]], query: List[str]) -> np.ndarray:
+        scores = np.asarray(BM25(documents).scores(query), dtype=np.float32)
+        if scores.max() > 0:
+            scores /= scores.max()
+        if self.embedder is None:
+            return scores
+        try:
+            vectors = await self.embedder.embed_many([question] + texts)
+        except Exception as e:
+            logger.warning(f"Embedding search results failed, ranking with BM25 only: {str(e)}")
+            return scores
+        similarity = np.clip(vectors[1:] @ vectors[0], 0.0, 1.0)
+        return (1 - self.embedding_weight) * scores + self.embedding_weight * similarity
+
+    async def rank(self, question: str, results: Sequence[Any], preferences: Optional[Sequence[float]] = None) -> Ranking:
+        """
+        Orders results (anything with title, url and snippet) by relevance to the question,
+        keeping at most `max_per_domain` URLs per domain among the selected ones.
+        Results with practically equal scores are ordered by their preference, if given.
+        """
+        if not results:
+            return Ranking([], False)
+        texts = [f"{result.title}\n{result.snippet}" for result in results]
+        documents = [tokenize(text) for text in texts]
+        query = tokenize(question)
+        scores = await self._scores(question, texts, documents, query)
+        query_terms = set(query)
+        coverage = [len(query_terms & set(document)) / len(query_terms) if query_terms else 0.0 for document in documents]
+
+        selected: List[int] = []
+        runner_up: Optional[int] = None
+        per_domain: Counter = Counter()
+        preferences = np.asarray(preferences if preferences is not None else np.zeros(len(results)), dtype=np.float32)
+        for index in np.lexsort((-preferences, -np.round(scores, 2))):
+            domain = (urlsplit(results[index].url).hostname or "").lower()
+            if per_domain[domain] >= self.max_per_domain:
+                continue
+            if len(selected) == self.select:
+                runner_up = int(index)
+                break
+            per_domain[domain] += 1
+            selected.append(int(index))
+
+        confident = bool(
+            len(selected) == self.select
+            and all(coverage[index] >= self.min_coverage for index in selected)
+            and (runner_up is None or scores[selected[-1]] - scores[runner_up] >= self.margin)
+        )
+        if confident:
+            self.confident += 1
+        else:
+            self.ambiguous += 1
+        return Ranking([results[index].url for index in selected], confident)
+
+    def stats(self) -> Dict[str, int]:
+        return {"confident": self.confident, "ambiguous": self.ambiguous}
@@ -1,10 +1,31 @@
 import redis.asyncio as aioredis
+import asyncio
 import base64
+import logging
+import math
+import random
+import time
+import uuid
 import mmh3
 from ipaddress import ip_address, AddressValueError
 from jinja2 import Template
+from typing import Callable, Dict, List, Optional, Tuple
+from utils import CircuitBreaker, LatencyHistogram
+from metrics import record_rate_limit
 import traceback
 
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+FAILURE_MODES = ("open", "closed", "local")
+
+# Lua script and key namespace for each supported limiting algorithm
+ALGORITHMS = {
+    "fixed_window": ("./lua_scripts/rate_limiter.lua", ""),
+    "sliding_window": ("./lua_scripts/sliding_window.lua", "sw:"),
+    "token_bucket": ("./lua_scripts/token_bucket.lua", "tb:"),
+}
+
 class RateLimiter:
     def __init__(
         self,
@@ -14,19 +35,48 @@ class RateLimiter:
         limit_interval: int,  # in seconds
         obfuscate_ips: bool,
         salt: str,
+        algorithm: str = "fixed_window",
+        global_shards: int = 1,
+        redis_timeout: float = 0.5,
+        breaker: Optional[CircuitBreaker] = None,
+        ip_failure_mode: str = "local",
+        global_failure_mode: str = "open",
+        max_local_entries: int = 10000,
     ):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown rate limiting algorithm: {algorithm}")
+        for mode in (ip_failure_mode, global_failure_mode):
+            if mode not in FAILURE_MODES:
+                raise ValueError(f"Unknown rate limiter failure mode: {mode}")
+
         self.redis = redis_client
         self.per_ip_limit = per_ip_limit
         self.total_limit = total_limit
         self.limit_interval = limit_interval
-        self.total_key = "global"
-        self.ip_key_prefix = "ip:"
+        self.algorithm = algorithm
+        self.global_shards = max(1, global_shards)
+        script_path, key_namespace = ALGORITHMS[algorithm]
+        self.total_key = f"global:{key_namespace}".rstrip(":")
+        self.ip_key_prefix = f"ip:{key_namespace}"
         self.obfuscate_ips = obfuscate_ips
         self.salt = base64.b64decode(salt)
 
-        self.script_content = self._load_and_format_lua_script("./lua_scripts/rate_limiter.lua")
+        self.script_content = self._load_and_format_lua_script(script_path)
         self.script = self.redis.register_script(self.script_content)
 
+        # Redis protection: a circuit breaker and a per-limit policy for when Redis is unavailable
+        self.redis_timeout = redis_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.failure_modes = {"ip": ip_failure_mode, "global": global_failure_mode}
+        self.redis_latency = LatencyHistogram()
+
+        # In-process state: known denials until their retry-after expires, and fallback counters,
+        # each bounded to `max_local_entries` keys
+        self.max_local_entries = max_local_entries
+        self._denials: Dict[str, Tuple[str, float]] = {}
+        self._local_counts: Dict[str, Tuple[int, float]] = {}
+        self.decisions: Dict[str, int] = {}
+
     def _load_and_format_lua_script(self, lua_script_path: str) -> str:
         """
         Loads the Lua script from the given path and replaces placeholders with actual configuration values using str.format().
@@ -38,11 +88,11 @@ class RateLimiter:
             raise FileNotFoundError(f"Lua script not found at path: {lua_script_path}")
 
         # Replace placeholders with actual configuration values using str.format()
+        # With a sharded global counter each shard enforces its share of the global limit
         template = Template(script)
         script = template.render(
-            TOTAL_KEY=self.total_key,
             PER_IP_LIMIT=self.per_ip_limit,
-            TOTAL_LIMIT=self.total_limit,
+            TOTAL_LIMIT=math.ceil(self.total_limit / self.global_shards),
             LIMIT_INTERVAL=self.limit_interval
         )
 
@@ -69,21 +119,148 @@ class RateLimiter:
         hash = mmh3.hash_bytes(hash_input, 42)[:9]
         return base64.urlsafe_b64encode(hash).decode('utf-8')
 
+    def _global_keys(self) -> List[str]:
+        """
+        Returns the global counter keys in the order to try them: the shards in random order
+        when sharding is enabled, so that requests spread evenly over them.
+        """
+        if self.global_shards == 1:
+            return [self.total_key]
+        shards = random.sample(range(self.global_shards), self.global_shards)
+        return [f"{self.total_key}:{shard}" for shard in shards]
+
+    def client_id(self, ip: str) -> str:
+        """
+        Returns the (optionally obfuscated) identifier used in Redis keys for an IP address.
+        """
+        return self._hash_ip(self._validate_and_encode_ip(ip))
+
     async def _run_script(self, ip_key):
-        result = await self.script(
-            keys=[ip_key]
-        )
-        print(len(result))
+        """
+        Runs the limiting script against one global shard after another until one has capacity,
+        so that a full shard does not enforce the global limit below its configured value.
+        A global denial means every shard is full; it lasts until the first shard frees up.
+        """
+        retry_afters = []
+        for global_key in self._global_keys():
+            result = await self.script(
+                keys=[ip_key, global_key],
+                args=[uuid.uuid4().hex]
+            )
 
-        allowed = bool(result[0])
-        exceeded = result[1] if len(result) > 1 else None
-        retry_after = result[2] if len(result) > 2 else None
-        
-        return allowed, exceeded, retry_after
+            allowed = bool(result[0])
+            exceeded = result[1] if len(result) > 1 else None
+            retry_after = result[2] if len(result) > 2 else None
+            if exceeded != "global":
+                return allowed, exceeded, retry_after
+            retry_afters.append(retry_after)
+
+        known = [retry_after for retry_after in retry_afters if retry_after is not None and retry_after > 0]
+        return False, "global", min(known) if known else None
+
+    def _count_decision(self, result: dict, source: str) -> dict:
+        decision = "allowed" if result["allowed"] else f"denied_{str(result['exceeded']).lower().replace(' ', '_')}"
+        key = f"{source}:{decision}"
+        self.decisions[key] = self.decisions.get(key, 0) + 1
+        record_rate_limit(source, decision)
+        return result
+
+    def _remember_denial(self, ip_key: str, exceeded: str, retry_after: Optional[int]):
+        """
+        Remembers a denial so that repeated requests are rejected without a Redis round-trip.
+        Global denials apply to every IP.
+        """
+        if not retry_after or retry_after <= 0:
+            return
+        key = self.total_key if exceeded == "global" else ip_key
+        now = time.monotonic()
+        self._store(self._denials, key, (exceeded, now + retry_after), lambda denial: denial[1] <= now)
+
+    def _store(self, entries: Dict[str, Tuple], key: str, value: Tuple, expired: Callable[[Tuple], bool]):
+        """
+        Stores an in-process entry as the most recent one. Past `max_local_entries` keys, expired
+        entries are dropped first, then the oldest, leaving room for a quarter of the limit.
+        """
+        entries.pop(key, None)
+        entries[key] = value
+        if len(entries) <= self.max_local_entries:
+            return
+        for stale in [stale for stale, entry in entries.items() if expired(entry)]:
+            del entries[stale]
+        while len(entries) > self.max_local_entries * 3 // 4:
+            del entries[next(iter(entries))]
+
+    def _local_denial(self, ip_key: str) -> Optional[dict]:
+        now = time.monotonic()
+        for key in (self.total_key, ip_key):
+            denial = self._denials.get(key)
+            if denial is None:
+                continue
+            exceeded, until = denial
+            if until <= now:
+                del self._denials[key]
+                continue
+            return {
+                "allowed": False,
+                "exceeded": exceeded,
+                "retry_after": math.ceil(until - now)
+            }
+        return None
+
+    def _local_limit(self, key: str, limit: int) -> Tuple[bool, int]:
+        """
+        Fixed-window counter kept in process memory, used while Redis is unavailable.
+        """
+        now = time.monotonic()
+        count, window_start = self._local_counts.get(key, (0, now))
+        if now - window_start >= self.limit_interval:
+            count, window_start = 0, now
+        retry_after = math.ceil(window_start + self.limit_interval - now)
+        return count < limit, retry_after
+
+    def _fallback(self, ip_key: str) -> dict:
+        """
+        Decides a request without Redis according to the failure mode of each limit type.
+        """
+        limits = (("ip", ip_key, self.per_ip_limit), ("global", self.total_key, self.total_limit))
+        for limit_type, key, limit in limits:
+            mode = self.failure_modes[limit_type]
+            if mode == "closed":
+                return {
+                    "allowed": False,
+                    "exceeded": "REDIS ERROR",
+                    "retry_after": None
+                }
+            if mode == "local":
+                allowed, retry_after = self._local_limit(key, limit)
+                if not allowed:
+                    return {
+                        "allowed": False,
+                        "exceeded": limit_type,
+                        "retry_after": retry_after
+                    }
+
+        now = time.monotonic()
+        for limit_type, key, _ in limits:
+            if self.failure_modes[limit_type] == "local":
+                count, window_start = self._local_counts.get(key, (0, now))
+                if now - window_start >= self.limit_interval:
+                    count, window_start = 0, now
+                self._store(
+                    self._local_counts, key, (count + 1, window_start),
+                    lambda counter: now - counter[1] >= self.limit_interval
+                )
+        return {
+            "allowed": True,
+            "exceeded": None,
+            "retry_after": None
+        }
 
     async def check_limits(self, ip: str):
         """
         Checks and updates the rate limits for a given IP address.
+        Known denials are answered from process memory; when Redis is slow or down the
+        configured failure mode of each limit type decides the request.
 
         Returns:
             dict: {
@@ -98,40 +275,62 @@ class RateLimiter:
             # Hash the IP address
             hashed_ip = self._hash_ip(ip_bytes)
             ip_key = f"{self.ip_key_prefix}{hashed_ip}"
-
-            # Execute the Lua script atomically
-            allowed, exceeded, retry_after = await self._run_script(ip_key)
-
-            return {
-                "allowed": allowed,
-                "exceeded": exceeded,
-                "retry_after": retry_after
-            }
-
         except ValueError as ve:
             print(f"An error occurred: {ve}")
             traceback.print_exc()
             
-            return {
+            return self._count_decision({
                 "allowed": False,
                 "exceeded": "INVALID IP ERROR",
                 "retry_after": None
-            }
-        except aioredis.RedisError as re:
-            print(f"An error occurred: {re}")
-            traceback.print_exc()
+            }, "local")
 
-            return {
-                "allowed": False,
-                "exceeded": "REDIS ERROR",
-                "retry_after": None
-            }
+        local_denial = self._local_denial(ip_key)
+        if local_denial is not None:
+            return self._count_decision(local_denial, "local")
+
+        trial = self.breaker.state == "half_open"
+        if not self.breaker.allow_request():
+            return self._count_decision(self._fallback(ip_key), "fallback")
+
+        start = time.perf_counter()
+        try:
+            # Execute the Lua script atomically
+            allowed, exceeded, retry_after = await asyncio.wait_for(self._run_script(ip_key), timeout=self.redis_timeout)
+            self.breaker.record_success()
+        except (aioredis.RedisError, asyncio.TimeoutError) as re:
+            self.breaker.record_failure()
+            logger.warning(f"Rate limiter Redis call failed ({self.breaker.state}): {re!r}")
+            return self._count_decision(self._fallback(ip_key), "fallback")
         except Exception as e:
             print(f"An error occurred: {e}")
             traceback.print_exc()
 
-            return {
+            return self._count_decision({
                 "allowed": False,
                 "exceeded": "UNKNOWN ERROR",
                 "retry_after": None
-            }
\ No newline at end of file
+            }, "redis")
+        finally:
+            self.redis_latency.observe(time.perf_counter() - start)
+            if trial:
+                # Errors other than Redis failures, and cancellation, must not leave the trial taken
+                self.breaker.release_trial()
+
+        if not allowed:
+            self._remember_denial(ip_key, exceeded, retry_after)
+
+        return self._count_decision({
+            "allowed": allowed,
+            "exceeded": exceeded,
+            "retry_after": retry_after
+        }, "redis")
+
+    def stats(self) -> dict:
+        return {
+            "algorithm": self.algorithm,
+            "circuit": self.breaker.state,
+            "decisions": dict(self.decisions),
+            "known_denials": len(self._denials),
+            "redis_latency_seconds": self.redis_latency.as_dict()
+        }
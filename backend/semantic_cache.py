@@ -0,0 +1,235 @@
+import base64
+import json
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import redis.asyncio as aioredis
+from openai import AsyncOpenAI
+
+from cache import CacheStats, question_fingerprint
+
+try:
+    import hnswlib
+except ImportError:  # hnswlib is optional; the brute-force index is used without it
+    hnswlib = None
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+
+class Embedder:
+    """
+    Embeds text through an OpenAI-compatible embeddings endpoint, e.g. a locally served model.
+    """
+    def __init__(self, base_url: str, api_key: str, model: str, timeout: float):
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, timeout=timeout)
+        self.model = model
+
+    async def embed(self, text: str) -> np.ndarray:
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeds several texts in one request and returns their unit vectors as matrix rows.
+        """
+        response = await self.client.embeddings.create(model=self.model, input=texts)
+        vectors = np.asarray([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+class VectorIndex:
+    """
+    Nearest-neighbour index over unit vectors using cosine similarity.
+    Searches by brute force with NumPy and switches to HNSW once the index grows past
+    `hnsw_threshold` entries, if hnswlib is installed. Vectors are kept in a matrix whose
+    capacity doubles when full, so that adding is amortised O(1).
+    """
+    def __init__(self, hnsw_threshold: int):
+        self.hnsw_threshold = hnsw_threshold
+        self.ids: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._hnsw = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def vectors(self) -> Optional[np.ndarray]:
+        return self._matrix[:len(self.ids)] if self._matrix is not None else None
+
+    def add(self, entry_id: str, vector: np.ndarray):
+        vector = vector.reshape(1, -1).astype(np.float32)
+        if self._matrix is not None and self._matrix.shape[1] != vector.shape[1]:
+            logger.warning("Embedding dimension changed, resetting semantic index")
+            self.ids, self._matrix, self._hnsw = [], None, None
+        if self._matrix is None:
+            self._matrix = np.empty((64, vector.shape[1]), dtype=np.float32)
+        elif len(self.ids) == self._matrix.shape[0]:
+            matrix = np.empty((2 * self._matrix.shape[0], self._matrix.shape[1]), dtype=np.float32)
+            matrix[:len(self.ids)] = self._matrix
+            self._matrix = matrix
+        self._matrix[len(self.ids)] = vector[0]
+        self.ids.append(entry_id)
+
+        if self._hnsw is not None:
+            if self._hnsw.get_current_count() >= self._hnsw.get_max_elements():
+                self._hnsw.resize_index(2 * self._hnsw.get_max_elements())
+            self._hnsw.add_items(vector, [len(self.ids) - 1])
+        elif hnswlib is not None and len(self.ids) >= self.hnsw_threshold:
+            self._build_hnsw()
+
+    def remove(self, entry_ids: Set[str]):
+        """
+        Drops the given entries, compacting the matrix. The HNSW graph is rebuilt since its labels are row numbers.
+        """
+        keep = [index for index, entry_id in enumerate(self.ids) if entry_id not in entry_ids]
+        if len(keep) == len(self.ids):
+            return
+        self.ids = [self.ids[index] for index in keep]
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._hnsw = None
+        if hnswlib is not None and len(self.ids) >= self.hnsw_threshold:
+            self._build_hnsw()
+
+    def _build_hnsw(self):
+        dimension = self.vectors.shape[1]
+        self._hnsw = hnswlib.Index(space='ip', dim=dimension)
+        self._hnsw.init_index(max_elements=max(2 * len(self.ids), 1024), ef_construction=200, M=16)
+        self._hnsw.add_items(self.vectors, np.arange(len(self.ids)))
+        self._hnsw.set_ef(64)
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[str, float]]:
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            return []
+        k = min(k, len(self.ids))
+        if self._hnsw is not None:
+            labels, distances = self._hnsw.knn_query(vector.reshape(1, -1), k=k)
+            return [(self.ids[label], 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+
+        similarities = self.vectors @ vector
+        best = np.argpartition(-similarities, k - 1)[:k] if k < len(self.ids) else np.arange(len(self.ids))
+        best = best[np.argsort(-similarities[best])]
+        return [(self.ids[index], float(similarities[index])) for index in best]
+
+
+def _encode_vector(vector: np.ndarray) -> str:
+    return base64.b64encode(vector.astype(np.float32).tobytes()).decode('ascii')
+
+
+def _decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class SemanticCache:
+    """
+    Serves cached answers for paraphrased questions. Entries live in Redis so that every worker
+    can use them; each worker keeps a local vector index that is synced incrementally.
+    """
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        embedder: Embedder,
+        threshold: float,
+        ttl: int,
+        hnsw_threshold: int,
+        key_prefix: str = "semantic:",
+    ):
+        self.redis = redis_client
+        self.embedder = embedder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.index = VectorIndex(hnsw_threshold)
+        self.entries_key = f"{key_prefix}entries"
+        self.timeline_key = f"{key_prefix}timeline"
+        self.stats = CacheStats()
+        self._created: Dict[str, float] = {}
+        self._synced_until = 0.0
+
+    async def _sync(self):
+        """
+        Loads entries added by other workers since the last sync, deletes expired entries from
+        Redis and drops them from the local index.
+        """
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zrangebyscore(self.timeline_key, "-inf", now - self.ttl)
+            pipe.zremrangebyscore(self.timeline_key, "-inf", now - self.ttl)
+            pipe.zrangebyscore(self.timeline_key, self._synced_until, "+inf", withscores=True)
+            expired_ids, _, new_entries = await pipe.execute()
+        if expired_ids:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hdel(self.entries_key, *expired_ids)
+                pipe.hdel(f"{self.entries_key}:vectors", *expired_ids)
+                await pipe.execute()
+
+        # Other workers may have deleted entries from Redis already, so expire by local age
+        expired = {entry_id for entry_id, created in self._created.items() if now - created > self.ttl}
+        if expired:
+            self.index.remove(expired)
+            for entry_id in expired:
+                del self._created[entry_id]
+
+        new_ids = [(entry_id, created) for entry_id, created in new_entries if entry_id not in self._created]
+        if new_ids:
+            vectors = await self.redis.hmget(f"{self.entries_key}:vectors", [entry_id for entry_id, _ in new_ids])
+            for (entry_id, created), vector in zip(new_ids, vectors):
+                if vector:
+                    self.index.add(entry_id, _decode_vector(vector))
+                    self._created[entry_id] = created
+        self._synced_until = max([self._synced_until] + [created for _, created in new_entries])
+
+    async def lookup(self, question: str) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """
+        Returns the cached result of the most similar fresh question above the threshold,
+        together with the question's embedding so that a later add() can reuse it.
+        """
+        try:
+            vector = await self.embedder.embed(question_fingerprint(question))
+            await self._sync()
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning(f"Semantic cache lookup failed: {str(e)}")
+            return None, None
+
+        now = time.time()
+        for entry_id, similarity in self.index.search(vector, k=5):
+            if similarity < self.threshold:
+                break
+            if now - self._created.get(entry_id, 0) > self.ttl:
+                continue
+            try:
+                cached = await self.redis.hget(self.entries_key, entry_id)
+            except aioredis.RedisError as e:
+                self.stats.errors += 1
+                logger.warning(f"Semantic cache read failed: {str(e)}")
+                break
+            if cached:
+                self.stats.hits += 1
+                entry = json.loads(cached)
+                return {**entry["result"], "matched_question": entry["question"], "similarity": round(similarity, 4)}, vector
+
+        self.stats.misses += 1
+        return None, vector
+
+    async def add(self, question: str, result: Dict[str, Any], vector: Optional[np.ndarray] = None):
+        try:
+            if vector is None:
+                vector = await self.embedder.embed(question_fingerprint(question))
+            entry_id = uuid.uuid4().hex
+            created = time.time()
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self.entries_key, entry_id, json.dumps({"question": question, "result": result}))
+                pipe.hset(f"{self.entries_key}:vectors", entry_id, _encode_vector(vector))
+                pipe.zadd(self.timeline_key, {entry_id: created})
+                await pipe.execute()
+            self.index.add(entry_id, vector)
+            self._created[entry_id] = created
+        except Exception as e:
+            self.stats.errors += 1
+            logger.warning(f"Semantic cache write failed: {str(e)}")
+
+    def stats_dict(self) -> Dict[str, Any]:
+        return {**self.stats.as_dict(), "entries": len(self.index), "hnsw": self.index._hnsw is not None}
@@ -0,0 +1,13 @@
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)  # Lua scripts and prompts are loaded relative to the backend directory
+
+# Without a .env, settings fall back to the documented example values
+with open(os.path.join(BACKEND_DIR, ".env.example"), 'r') as file:
+    for line in file:
+        name, separator, value = line.strip().partition("=")
+        if separator and not name.startswith("#"):
+            os.environ.setdefault(name, value)
@@ -0,0 +1,28 @@
+import asyncio
+
+import fakeredis
+
+from cache import Extraction, ExtractionCache
+
+
+def test_fallback_extractions_are_stored_under_their_own_model():
+    async def scenario():
+        cache = ExtractionCache(fakeredis.FakeAsyncRedis(decode_responses=True), ttl=60)
+        calls = []
+
+        async def extract_with(model):
+            calls.append(model)
+            return Extraction("Cats are mammals.", model)
+
+        args = ("<page>", "What are cats?", "v1")
+        # The primary model failed over to the fallback, which produced the extraction
+        assert await cache.get_or_extract(*args, "primary", lambda: extract_with("fallback")) == "Cats are mammals."
+        # It is not served as the primary model's extraction...
+        assert await cache.get_or_extract(*args, "primary", lambda: extract_with("primary")) == "Cats are mammals."
+        assert calls == ["fallback", "primary"]
+        # ...but is reused when the fallback model is the one asked for
+        assert await cache.get_or_extract(*args, "fallback", lambda: extract_with("fallback")) == "Cats are mammals."
+        assert calls == ["fallback", "primary"]
+        assert cache.stats.hits == 1
+
+    asyncio.run(scenario())
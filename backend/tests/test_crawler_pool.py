@@ -0,0 +1,47 @@
+import asyncio
+import types
+
+from crawler_pool import CrawlScheduler
+
+
+class StubBrowserManager:
+    def __init__(self, kill_delay: float):
+        self.kill_delay = kill_delay
+        self.killed = []
+
+    async def kill_session(self, session_id):
+        await asyncio.sleep(self.kill_delay)
+        self.killed.append(session_id)
+
+
+class StubCrawler:
+    """
+    A crawler whose pages fail, so that every crawl ends by killing its session.
+    """
+    def __init__(self, kill_delay: float = 0.05):
+        self.crawler_strategy = types.SimpleNamespace(browser_manager=StubBrowserManager(kill_delay))
+
+    async def arun(self, url, config=None):
+        await asyncio.sleep(0.01)
+        return types.SimpleNamespace(success=False, markdown="")
+
+
+def test_cancelled_session_kill_returns_the_session():
+    async def scenario():
+        crawler = StubCrawler()
+        scheduler = CrawlScheduler(crawler, max_pages=2, max_pages_per_domain=2, crawl_timeout=5)
+
+        # Cancel more crawls than there are sessions while each is killing its session
+        for _ in range(5):
+            crawl = asyncio.ensure_future(scheduler.crawl("https://a.com/"))
+            await asyncio.sleep(0.03)
+            crawl.cancel()
+            await asyncio.gather(crawl, return_exceptions=True)
+
+        result = await asyncio.wait_for(scheduler.crawl("https://a.com/"), timeout=1)
+        assert result.success is False
+        await asyncio.sleep(0.1)
+        assert scheduler._sessions.qsize() == 2
+        assert len(crawler.crawler_strategy.browser_manager.killed) == 6
+
+    asyncio.run(scenario())
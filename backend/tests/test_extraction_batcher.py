@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from cache import SingleFlight
+from llm_operations import ExtractionBatchClosed, ExtractionBatcher
+
+
+class StalledLLMHandler:
+    """
+    Extraction calls that never return until cancelled.
+    """
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def _extract_batch(self, question, documents):
+        self.started.set()
+        await asyncio.Event().wait()
+
+    async def _extract(self, question, content, url):
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def test_close_while_running_fails_shared_waiters():
+    async def scenario():
+        llm_handler = StalledLLMHandler()
+        batcher = ExtractionBatcher(llm_handler, "What are cats?", ["https://a.com", "https://b.com"])
+        single_flight = SingleFlight()
+
+        # Request A owns both pages; request B coalesces onto the first one through the extraction cache
+        owner = [
+            asyncio.ensure_future(single_flight.do(url, lambda url=url: batcher.submit(url, "Cats are mammals.")))
+            for url in ("https://a.com", "https://b.com")
+        ]
+        await asyncio.wait_for(llm_handler.started.wait(), timeout=1)
+        other_request = asyncio.ensure_future(single_flight.do("https://a.com", lambda: batcher.submit("https://a.com", "")))
+        await asyncio.sleep(0)
+
+        # Request A reaches its quorum and gives up on the running batch
+        batcher.close()
+        for task in owner:
+            task.cancel()
+
+        with pytest.raises(ExtractionBatchClosed):
+            await asyncio.wait_for(other_request, timeout=1)
+        await asyncio.gather(*owner, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert not single_flight.in_flight("https://a.com")
+        assert not single_flight.in_flight("https://b.com")
+        assert not batcher._tasks
+
+    asyncio.run(scenario())
+
+
+def test_close_fails_pending_pages():
+    async def scenario():
+        batcher = ExtractionBatcher(StalledLLMHandler(), "What are cats?", ["https://a.com", "https://b.com"])
+        future = batcher.submit("https://a.com", "Cats are mammals.")
+        batcher.close()
+        with pytest.raises(ExtractionBatchClosed):
+            await future
+        assert not batcher.pending and batcher._timer is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+import asyncio
+
+import fakeredis
+
+from jobs import JobQueue
+
+
+def make_queue(lease_timeout: float = 30.0) -> JobQueue:
+    return JobQueue(fakeredis.FakeAsyncRedis(decode_responses=True), max_queued=10, result_ttl=60, lease_timeout=lease_timeout)
+
+
+def test_claim_takes_the_highest_priority_job_first():
+    async def scenario():
+        queue = make_queue()
+        low = await queue.submit("What are dogs?", priority=1, deadline=60)
+        first_high = await queue.submit("What are cats?", priority=5, deadline=60)
+        second_high = await queue.submit("What are birds?", priority=5, deadline=60)
+
+        claimed = [(await queue.claim(timeout=0))[0] for _ in range(3)]
+        assert claimed == [first_high, second_high, low]
+        assert await queue.claim(timeout=0) is None
+        assert (await queue.get(low))["status"] == "running"
+        assert await queue.redis.zcard(queue.leases_key) == 3
+
+    asyncio.run(scenario())
+
+
+def test_expired_lease_moves_the_job_to_another_worker():
+    async def scenario():
+        queue = make_queue(lease_timeout=0.1)
+        job_id = await queue.submit("What are cats?", priority=1, deadline=60)
+        _, job = await queue.claim(timeout=0)
+        assert await queue.renew_lease(job_id, job)
+
+        # The first worker stops renewing; the next claim requeues the job and hands it out again
+        await asyncio.sleep(0.15)
+        claimed_id, new_job = await queue.claim(timeout=0)
+        assert claimed_id == job_id
+        assert new_job["lease_token"] != job["lease_token"]
+
+        # Only the new worker may keep the lease
+        assert not await queue.renew_lease(job_id, job)
+        assert await queue.renew_lease(job_id, new_job)
+
+    asyncio.run(scenario())
+
+
+def test_expired_lease_of_a_finished_job_is_dropped():
+    async def scenario():
+        queue = make_queue(lease_timeout=0.1)
+        job_id = await queue.submit("What are cats?", priority=1, deadline=60)
+        _, job = await queue.claim(timeout=0)
+        await queue.finish(job_id, "done", result={"answer": "Cats are mammals."})
+        # A worker that finished the job after its lease ran out left the lease behind
+        await queue.redis.zadd(queue.leases_key, {job_id: 0})
+
+        assert await queue.claim(timeout=0) is None
+        assert (await queue.get(job_id))["status"] == "done"
+        assert not await queue.renew_lease(job_id, job)
+        assert await queue.redis.zcard(queue.leases_key) == 0
+
+    asyncio.run(scenario())
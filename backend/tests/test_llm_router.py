@@ -0,0 +1,62 @@
+import asyncio
+import time
+import types
+
+from llm_router import LLMRouter, Route
+
+
+def make_client(delay: float, text: str):
+    """
+    An OpenAI-compatible client whose completions take a fixed time.
+    """
+    async def create(**kwargs):
+        await asyncio.sleep(delay)
+        usage = types.SimpleNamespace(prompt_tokens=10, completion_tokens=5, prompt_tokens_details=None)
+        return types.SimpleNamespace(usage=usage, choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+
+def test_hedged_out_route_is_demoted_until_its_samples_expire():
+    async def scenario():
+        slow, fast = Route("primary", "m"), Route("backup", "m")
+        router = LLMRouter(
+            {"primary": make_client(1.0, "slow"), "backup": make_client(0.01, "fast")},
+            {"answer": [slow, fast]},
+            {"answer": 5},
+            hedge_min_delay=0.02,
+            stats_max_age=0.5,
+        )
+
+        # Every call to the primary is hedged and cancelled once the backup answers
+        for _ in range(5):
+            result = await router.complete("answer", [])
+            assert result.text == "fast"
+        assert router.stats[slow].hedges_lost == 5
+        assert router.stats[slow].percentile(0.95) >= 0.08
+        assert router.candidates("answer") == [fast, slow]
+
+        # The next call goes straight to the backup without waiting for a hedge
+        started = time.perf_counter()
+        assert (await router.complete("answer", [])).route == fast
+        assert time.perf_counter() - started < 0.05
+
+        # Once the samples expire, the primary gets another chance
+        await asyncio.sleep(0.55)
+        assert router.candidates("answer") == [slow, fast]
+
+    asyncio.run(scenario())
+
+
+def test_winning_hedge_does_not_censor_later_routes():
+    async def scenario():
+        first, second = Route("a", "m"), Route("b", "m")
+        router = LLMRouter(
+            {"a": make_client(0.03, "first"), "b": make_client(1.0, "second")}, {"answer": [first, second]}, {"answer": 5}, hedge_min_delay=0.005
+        )
+        # The hedge to the second route starts later and loses; its short run says nothing about its latency
+        assert (await router.complete("answer", [])).text == "first"
+        assert router.stats[second].hedges_lost == 0
+        assert not router.stats[second].latencies
+
+    asyncio.run(scenario())
@@ -0,0 +1,77 @@
+import asyncio
+
+import fakeredis
+
+from pipeline import ResearchTrace
+from quotas import QuotaManager
+from test_usage import make_assistant
+
+WEIGHTS = {"prompt_tokens": 0.01, "completion_tokens": 0.01, "crawl_seconds": 0.5, "search_calls": 1.0}
+
+
+def make_quotas(redis_client=None, **kwargs) -> QuotaManager:
+    settings = dict(per_ip_budget=10, total_budget=25, interval=60, reservation=4, weights=WEIGHTS)
+    settings.update(kwargs)
+    return QuotaManager(redis_client or fakeredis.FakeAsyncRedis(decode_responses=True), client_id=lambda ip: ip, **settings)
+
+
+def test_reservations_stop_at_the_per_ip_and_global_budgets():
+    async def scenario():
+        quotas = make_quotas()
+        first, second = await quotas.reserve("a"), await quotas.reserve("a")
+        assert first.allowed and second.allowed
+        assert second.remaining_budget() == {"ip": 2.0, "global": 17.0}
+
+        denied = await quotas.reserve("a")
+        assert not denied.allowed and denied.exceeded == "ip" and denied.ip_key is None
+        assert 1 <= denied.retry_after <= 60
+        # A denied reservation charges nothing
+        assert await quotas.remaining("a") == {"ip": 2.0, "global": 17.0}
+
+        for ip in ("b", "b", "c", "c"):
+            assert (await quotas.reserve(ip)).allowed
+        denied = await quotas.reserve("d", amount=2)
+        assert not denied.allowed and denied.exceeded == "global"
+        assert denied.remaining_budget() == {"ip": 10.0, "global": 1.0}
+
+    asyncio.run(scenario())
+
+
+def test_settle_replaces_the_reservation_with_the_actual_cost():
+    async def scenario():
+        redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        quotas = make_quotas(redis_client)
+
+        reservation = await quotas.reserve("a")
+        assert await quotas.settle(reservation, {"prompt_tokens": 100, "completion_tokens": 50, "search_calls": 1}) == 2.5
+        assert await quotas.remaining("a") == {"ip": 7.5, "global": 22.5}
+
+        # Requests that cost less than nothing still leave the budgets at zero or above
+        reservation = await quotas.reserve("b")
+        await quotas.settle(reservation, {})
+        assert await quotas.remaining("b") == {"ip": 10.0, "global": 22.5}
+        assert 0 < await redis_client.ttl("quota:ip:b") <= 60
+
+        # Denied reservations are never settled
+        denied = await make_quotas(redis_client, per_ip_budget=1).reserve("c")
+        await quotas.settle(denied, {"search_calls": 5})
+        assert await quotas.remaining("c") == {"ip": 10.0, "global": 22.5}
+
+    asyncio.run(scenario())
+
+
+def test_usage_recorded_by_a_request_is_charged_to_its_client():
+    async def scenario():
+        quotas = make_quotas()
+        assistant = make_assistant(research_delay=0.05)
+        reservations = [await quotas.reserve("a"), await quotas.reserve("b")]
+        traces = [ResearchTrace(), ResearchTrace()]
+
+        # Both requests share one pipeline run, so each pays half of its cost
+        await asyncio.gather(*(assistant.research_and_answer("What are cats?", trace=trace) for trace in traces))
+        for reservation, trace in zip(reservations, traces):
+            assert await quotas.settle(reservation, trace.usage) == 3.75
+        assert await quotas.remaining("a") == {"ip": 6.25, "global": 17.5}
+        assert await quotas.remaining("b") == {"ip": 6.25, "global": 17.5}
+
+    asyncio.run(scenario())
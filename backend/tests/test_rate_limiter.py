@@ -0,0 +1,88 @@
+import asyncio
+import base64
+
+import fakeredis
+import pytest
+
+from rate_limiter import RateLimiter
+
+SALT = base64.b64encode(b"test-salt").decode()
+
+
+def make_limiter(redis_client, **kwargs) -> RateLimiter:
+    settings = dict(per_ip_limit=5, total_limit=40, limit_interval=86400, obfuscate_ips=True, salt=SALT)
+    settings.update(kwargs)
+    return RateLimiter(redis_client=redis_client, **settings)
+
+
+@pytest.mark.parametrize("algorithm", ["fixed_window", "sliding_window", "token_bucket"])
+def test_sharded_global_limit_admits_its_configured_total(algorithm):
+    async def scenario():
+        limiter = make_limiter(fakeredis.FakeAsyncRedis(decode_responses=True), algorithm=algorithm, global_shards=4)
+        results = [await limiter.check_limits(f"10.1.{index // 250}.{index % 250}") for index in range(60)]
+
+        # A full shard sends requests to the others instead of denying them
+        assert sum(result["allowed"] for result in results) == 40
+        assert all(result["exceeded"] == "global" for result in results[40:])
+        # Once every shard is full, the global denial is answered from process memory
+        assert (await limiter.check_limits("10.9.9.9"))["exceeded"] == "global"
+        assert limiter.decisions["local:denied_global"] >= 1
+
+    asyncio.run(scenario())
+
+
+def test_fallback_state_stays_bounded():
+    async def scenario():
+        limiter = make_limiter(fakeredis.FakeAsyncRedis(decode_responses=True), per_ip_limit=1, max_local_entries=100)
+        for index in range(1000):
+            ip_key = f"ip:client-{index}"
+            assert limiter._fallback(ip_key)["allowed"]
+            assert not limiter._fallback(ip_key)["allowed"]
+            limiter._remember_denial(ip_key, "ip", 60)
+        assert len(limiter._local_counts) <= 100
+        assert len(limiter._denials) <= 100
+        # The most recent clients are still remembered
+        assert limiter._local_denial("ip:client-999") is not None
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("algorithm", ["sliding_window", "token_bucket"])
+def test_per_ip_limit_denies_with_retry_after(algorithm):
+    async def scenario():
+        limiter = make_limiter(fakeredis.FakeAsyncRedis(decode_responses=True), algorithm=algorithm, per_ip_limit=3, limit_interval=60)
+        results = [await limiter.check_limits("10.0.0.1") for _ in range(4)]
+
+        assert [result["allowed"] for result in results] == [True, True, True, False]
+        assert results[-1]["exceeded"] == "ip"
+        assert 1 <= results[-1]["retry_after"] <= 60
+        # Other clients are unaffected
+        assert (await limiter.check_limits("10.0.0.2"))["allowed"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("algorithm", ["sliding_window", "token_bucket"])
+def test_requests_are_admitted_again_once_the_window_passes(algorithm):
+    async def scenario():
+        limiter = make_limiter(fakeredis.FakeAsyncRedis(decode_responses=True), algorithm=algorithm, per_ip_limit=2, limit_interval=1)
+        assert [(await limiter.check_limits("10.0.0.1"))["allowed"] for _ in range(3)] == [True, True, False]
+
+        await asyncio.sleep(1.1)
+        assert [(await limiter.check_limits("10.0.0.1"))["allowed"] for _ in range(3)] == [True, True, False]
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_refills_one_token_at_a_time():
+    async def scenario():
+        limiter = make_limiter(fakeredis.FakeAsyncRedis(decode_responses=True), algorithm="token_bucket", per_ip_limit=2, limit_interval=1)
+        assert [(await limiter.check_limits("10.0.0.1"))["allowed"] for _ in range(2)] == [True, True]
+
+        # Half the window refills one of the two tokens
+        await asyncio.sleep(0.6)
+        assert (await limiter.check_limits("10.0.0.1"))["allowed"]
+        denied = await limiter.check_limits("10.0.0.1")
+        assert not denied["allowed"] and denied["retry_after"] == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+
+import fakeredis
+
+from main import ResearchAssistant
+from pipeline import ResearchPlan, ResearchTrace, record_usage
+
+
+def make_assistant(research_delay: float = 0.0) -> ResearchAssistant:
+    """
+    A research assistant on fakeredis whose research and synthesis only record usage.
+    """
+    assistant = ResearchAssistant(redis_client=fakeredis.FakeAsyncRedis(decode_responses=True))
+    assistant.semantic_cache = None
+
+    async def research(question, trace):
+        await asyncio.sleep(research_delay)
+        record_usage(search_calls=2, crawl_seconds=4.0)
+        return ResearchPlan([question], []), {"https://a.com": "Cats are mammals."}
+
+    async def synthesize_answer(question, extracted_info):
+        record_usage(prompt_tokens=150, completion_tokens=200)
+        return "Cats are mammals[^1].\n\n[^1]: https://a.com"
+
+    assistant._research = research
+    assistant.llm_handler.synthesize_answer = synthesize_answer
+    return assistant
+
+
+def test_usage_is_charged_through_the_answer_cache():
+    async def scenario():
+        assistant = make_assistant()
+        assert assistant.answer_cache.redis is not None
+        trace = ResearchTrace()
+        result = await assistant.research_and_answer("What are cats?", trace=trace)
+
+        expected = {"prompt_tokens": 150, "completion_tokens": 200, "crawl_seconds": 4.0, "search_calls": 2}
+        assert {name: trace.usage[name] for name in expected} == expected
+        assert {name: result["usage"][name] for name in expected} == expected
+
+    asyncio.run(scenario())
+
+
+def test_coalesced_requests_split_the_usage():
+    async def scenario():
+        assistant = make_assistant(research_delay=0.05)
+        traces = [ResearchTrace(), ResearchTrace()]
+        results = await asyncio.gather(*(assistant.research_and_answer("What are cats?", trace=trace) for trace in traces))
+
+        assert assistant.answer_cache.stats.coalesced == 1
+        for trace in traces:
+            assert trace.usage["prompt_tokens"] == 75
+            assert trace.usage["search_calls"] == 1
+        # The result describes the whole run, whoever ends up paying for it
+        assert all(result["usage"]["prompt_tokens"] == 150 for result in results)
+
+    asyncio.run(scenario())
@@ -0,0 +1,278 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple
+
+import numpy as np
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character-based estimate
+    _encoding = None
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+HEADING_PATTERN = re.compile(r'^#{1,6}\s', re.MULTILINE)
+LINK_PATTERN = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+BOILERPLATE_PATTERN = re.compile(
+    r'^\W*(skip to (main )?content|accept( all)? cookies|cookie (settings|policy|preferences)|'
+    r'sign in|log in|subscribe|share (this|on)|back to top|all rights reserved|privacy policy|terms of (use|service))\b',
+    re.IGNORECASE
+)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i in is it of on or that the this to was what when where "
+    "which who why will with".split()
+)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts tokens with tiktoken when available, otherwise estimates roughly four characters per token.
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases and splits text into word terms, dropping common stopwords.
+    """
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def _is_link_line(line: str) -> bool:
+    """
+    A line made up mostly of links is treated as navigation.
+    """
+    links = LINK_PATTERN.findall(line)
+    if not links:
+        return False
+    remainder = LINK_PATTERN.sub('', line)
+    return len(re.sub(r'[\W_]+', '', remainder)) < 0.2 * max(1, sum(len(text) for text in links))
+
+
+def strip_boilerplate(markdown: str) -> str:
+    """
+    Removes images, navigation link lists and common banner lines from crawled markdown.
+    """
+    lines = []
+    for line in markdown.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('!['):
+            continue
+        if _is_link_line(stripped) or BOILERPLATE_PATTERN.match(stripped):
+            continue
+        lines.append(line.rstrip())
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+def split_markdown_sections(markdown: str, max_tokens: int) -> List[str]:
+    """
+    Splits markdown on headings, then splits oversized sections on paragraph boundaries
+    so that each chunk stays within max_tokens where possible.
+    """
+    starts = [match.start() for match in HEADING_PATTERN.finditer(markdown)]
+    boundaries = [0] + [start for start in starts if start > 0] + [len(markdown)]
+    sections = [markdown[start:end].strip() for start, end in zip(boundaries, boundaries[1:])]
+
+    chunks = []
+    for section in sections:
+        if not section:
+            continue
+        if count_tokens(section) <= max_tokens:
+            chunks.append(section)
+            continue
+        current, current_tokens = [], 0
+        for paragraph in section.split('\n\n'):
+            paragraph_tokens = count_tokens(paragraph)
+            if current and current_tokens + paragraph_tokens > max_tokens:
+                chunks.append('\n\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(paragraph)
+            current_tokens += paragraph_tokens
+        if current:
+            chunks.append('\n\n'.join(current))
+    return chunks
+
+
+class BM25:
+    """
+    Okapi BM25 scoring over a small in-memory corpus of documents.
+    """
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = sum(self.lengths) / len(documents) if documents else 0.0
+        document_frequencies = Counter(term for document in documents for term in set(document))
+        count = len(documents)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequencies.items()
+        }
+
+    def scores(self, query: List[str]) -> List[float]:
+        query_terms = set(query)
+        results = []
+        for frequencies, length in zip(self.term_frequencies, self.lengths):
+            norm = self.k1 * (1 - self.b + self.b * length / (self.average_length or 1))
+            score = 0.0
+            for term in query_terms:
+                frequency = frequencies.get(term)
+                if frequency:
+                    score += self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            results.append(score)
+        return results
+
+
+class PrunedContent(NamedTuple):
+    text: str
+    original_tokens: int
+    kept_tokens: int
+    chunks_total: int
+    chunks_kept: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.kept_tokens
+
+
+def prune_content(question: str, markdown: str, chunk_tokens: int, max_chunks: int, token_budget: int) -> PrunedContent:
+    """
+    Strips boilerplate and keeps only the chunks that score best against the question with BM25,
+    within max_chunks and token_budget. Kept chunks are returned in their original order.
+    """
+    original_tokens = count_tokens(markdown)
+    cleaned = strip_boilerplate(markdown)
+    chunks = split_markdown_sections(cleaned, chunk_tokens)
+    chunk_token_counts = [count_tokens(chunk) for chunk in chunks]
+
+    if sum(chunk_token_counts) <= token_budget and len(chunks) <= max_chunks:
+        return PrunedContent(cleaned, original_tokens, count_tokens(cleaned), len(chunks), len(chunks))
+
+    scores = BM25([tokenize(chunk) for chunk in chunks]).scores(tokenize(question))
+    ranked = sorted(range(len(chunks)), key=lambda index: (-scores[index], index))
+
+    selected, used_tokens = [], 0
+    for index in ranked:
+        if len(selected) >= max_chunks:
+            break
+        if used_tokens + chunk_token_counts[index] > token_budget:
+            continue
+        selected.append(index)
+        used_tokens += chunk_token_counts[index]
+
+    if not selected and ranked:
+        # Even the best chunk is over budget on its own; keep a truncated prefix of it
+        text = chunks[ranked[0]][:token_budget * 4]
+        return PrunedContent(text, original_tokens, count_tokens(text), len(chunks), 1)
+
+    text = '\n\n'.join(chunks[index] for index in sorted(selected))
+    return PrunedContent(text, original_tokens, used_tokens, len(chunks), len(selected))
+
+
+PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+
+
+MINHASH_PRIME = (1 << 31) - 1
+_minhash_rng = np.random.default_rng(20240601)
+MINHASH_A = _minhash_rng.integers(1, MINHASH_PRIME, size=64, dtype=np.int64)
+MINHASH_B = _minhash_rng.integers(0, MINHASH_PRIME, size=64, dtype=np.int64)
+
+
+def minhash(terms: List[str], shingle_size: int = 2) -> np.ndarray:
+    """
+    MinHash signature of the word shingles of a text. The fraction of equal positions in two
+    signatures estimates the Jaccard similarity of their shingle sets.
+    """
+    shingles = {' '.join(terms[index:index + shingle_size]) for index in range(max(1, len(terms) - shingle_size + 1))}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'big') % MINHASH_PRIME for shingle in shingles),
+        dtype=np.int64, count=len(shingles)
+    )
+    return ((np.outer(hashes, MINHASH_A) + MINHASH_B) % MINHASH_PRIME).min(axis=0)
+
+
+class PackedSource(NamedTuple):
+    urls: List[str]
+    text: str
+
+
+class PackedSources(NamedTuple):
+    sources: List[PackedSource]
+    original_tokens: int
+    kept_tokens: int
+    duplicates: int
+
+
+def pack_sources(question: str, extracted: Dict[str, str], token_budget: int, threshold: float = 0.7, min_terms: int = 8) -> PackedSources:
+    """
+    Collapses near-duplicate passages across extractions, those whose MinHash-estimated shingle
+    similarity reaches threshold, keeping the URL of every copy with the passage so that all of
+    them can still be cited. If the remaining passages exceed token_budget, keeps those that score
+    best against the question with BM25, favouring passages found on several pages. Passages keep
+    their source and original order; consecutive passages of a source that were found on the same
+    other pages are packed together, so every packed source lists exactly the URLs its text is on.
+    """
+    sources: List[str] = []
+    passages = []  # [source index, text, tokens, terms, copies, other urls]
+    signatures, owners = [], []  # MinHash signatures and the passages they belong to
+    original_tokens = duplicates = 0
+    for url, text in extracted.items():
+        source = len(sources)
+        sources.append(url)
+        for paragraph in PARAGRAPH_PATTERN.split(text.strip()):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            tokens = count_tokens(paragraph)
+            original_tokens += tokens
+            terms = tokenize(paragraph)
+            if len(terms) >= min_terms:
+                signature = minhash(terms)
+                match = None
+                if signatures:
+                    similarities = (np.vstack(signatures) == signature).mean(axis=1)
+                    if similarities.max() >= threshold:
+                        match = owners[int(similarities.argmax())]
+                if match is not None:
+                    duplicates += 1
+                    passages[match][4] += 1
+                    if url != sources[passages[match][0]] and url not in passages[match][5]:
+                        passages[match][5].append(url)
+                    continue
+                signatures.append(signature)
+                owners.append(len(passages))
+            passages.append([source, paragraph, tokens, terms, 1, []])
+
+    selected = set(range(len(passages)))
+    if sum(passage[2] for passage in passages) > token_budget:
+        scores = BM25([passage[3] for passage in passages]).scores(tokenize(question))
+        ranked = sorted(range(len(passages)), key=lambda index: (-scores[index] * (1 + 0.25 * (passages[index][4] - 1)), index))
+        selected, used_tokens = set(), 0
+        for index in ranked:
+            if used_tokens + passages[index][2] <= token_budget:
+                selected.add(index)
+                used_tokens += passages[index][2]
+        if not selected and ranked:
+            selected.add(ranked[0])  # Even the best passage is over budget on its own; keep it anyway
+
+    packed = []
+    for source, url in enumerate(sources):
+        block_urls, texts = None, []
+        for index, passage in enumerate(passages):
+            if passage[0] != source or index not in selected:
+                continue
+            urls = [url] + passage[5]
+            if texts and urls != block_urls:
+                packed.append(PackedSource(block_urls, '\n\n'.join(texts)))
+                texts = []
+            block_urls = urls
+            texts.append(passage[1])
+        if texts:
+            packed.append(PackedSource(block_urls, '\n\n'.join(texts)))
+    kept_tokens = sum(passages[index][2] for index in selected)
+    return PackedSources(packed, original_tokens, kept_tokens, duplicates)
@@ -1,23 +1,28 @@
+import bisect
 import datetime
-import locale
 import re
 from bs4 import BeautifulSoup
 import markdown
 from markdown.extensions.toc import TocExtension
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import json
 import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
-def get_human_readable_datetime() -> str:
+MONTH_NAMES = (
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+)
+
+def get_human_readable_datetime(now: Optional[datetime.datetime] = None) -> str:
     """
-    Returns the current date and time in a human-readable format.
+    Returns the given or current date and time in a human-readable format.
+    Month names are spelled out without going through the process-global locale.
     """
-    locale.setlocale(locale.LC_TIME, '')
-    now = datetime.datetime.now()
-    return now.strftime("%d{} of %B %Y, %H:%M").format(
-        'th' if 11 <= now.day <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(now.day % 10, 'th')
-    )
+    now = now or datetime.datetime.now()
+    suffix = 'th' if 11 <= now.day <= 13 else {1: 'st', 2: 'nd', 3: 'rd'}.get(now.day % 10, 'th')
+    return f"{now.day:02d}{suffix} of {MONTH_NAMES[now.month - 1]} {now.year}, {now:%H:%M}"
 
 def fix_footnotes(text: str) -> str:
     """
@@ -112,6 +117,31 @@ def normalize_url(url: str) -> str:
     """
     return re.sub(r'^(https?://)?(www\.)?', '', url.lower())
 
+def url_key(url: str) -> str:
+    """
+    Returns a key identifying the given URL for deduplication purposes.
+    Builds on normalize_url and additionally drops the fragment and trailing slash.
+    """
+    return normalize_url(url.strip()).split('#', 1)[0].rstrip('/')
+
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref_src')
+
+def canonicalize_url(url: str) -> str:
+    """
+    Returns a canonical form of the given URL: lowercased scheme and host, no default port,
+    no fragment, no tracking parameters and a sorted query string.
+    """
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or 'http').lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith(TRACKING_PARAMS)
+    )
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
 def group_by(items: List[Dict[str, Any]], key: str) -> Dict[Any, List[Dict[str, Any]]]:
     """
     Groups a list of dictionaries by a specified key.
@@ -135,4 +165,78 @@ def retry(func, max_attempts: int = 3, delay: int = 1):
                 if attempts == max_attempts:
                     raise
                 time.sleep(delay * (2 ** (attempts - 1)))
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker. Opens after `failure_threshold` failures in a row,
+    rejects calls for `reset_timeout` seconds, then lets a single trial call through (half-open).
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_progress = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """
+        Ends a half-open trial that finished without a verdict, e.g. because it was cancelled,
+        so that the next call can try again.
+        """
+        self._trial_in_progress = False
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram with fixed bucket upper bounds in seconds.
+    """
+    def __init__(self, buckets: List[float] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        cumulative, buckets = 0, {}
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            cumulative += count
+            buckets["+Inf" if bound == float('inf') else str(bound)] = cumulative
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "buckets": buckets
+        }
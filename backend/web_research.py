@@ -1,9 +1,23 @@
 import httpx
 import asyncio
-from typing import List, Dict, NamedTuple
+import random
+import time
+from typing import List, Dict, NamedTuple, Optional
 from config import config
 from crawl4ai import AsyncWebCrawler
 from llm_operations import LLMHandler
+from pipeline import ResearchPlan, ResearchTrace, record_usage
+from utils import url_key, canonicalize_url
+from text_processing import prune_content
+from cache import SearchCache, SingleFlight
+from crawler_pool import CrawlScheduler
+from fetcher import StaticFetcher
+from content_cache import ContentEntry, create_content_cache
+from metrics import observe_stage, record_crawl
+from ranking import ResultRanker
+from domain_stats import DomainStatsStore
+from semantic_cache import Embedder
+import redis.asyncio as aioredis
 import logging
 from logging import Filter
 
@@ -28,12 +42,62 @@ class SearchResult(NamedTuple):
     snippet: str
 
 class WebResearcher:
-    def __init__(self):
+    def __init__(self, llm_handler: Optional[LLMHandler] = None, redis_client: Optional[aioredis.Redis] = None):
         self.api_key = config.api_keys.google_search_api_key.get_secret_value()
         self.search_engine_id = config.search.search_engine_id.get_secret_value()
-        self.llm_handler = LLMHandler()
+        self.llm_handler = llm_handler or LLMHandler()
         self.crawler = AsyncWebCrawler(verbose=False)
-        self.httpx_client = httpx.AsyncClient()
+        self.httpx_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=config.search.search_max_connections,
+                max_keepalive_connections=config.search.search_max_connections
+            ),
+            timeout=config.search.search_timeout
+        )
+        self.search_semaphore = asyncio.Semaphore(config.search.search_concurrency)
+        self.search_cache = SearchCache(
+            redis_client if config.cache.search_cache_enabled else None,
+            ttl=config.cache.search_cache_ttl,
+            negative_ttl=config.cache.search_cache_negative_ttl
+        )
+        self.content_cache = create_content_cache(redis_client, config.cache)
+        self.crawl_scheduler = CrawlScheduler(
+            self.crawler,
+            max_pages=config.crawler.max_pages,
+            max_pages_per_domain=config.crawler.max_pages_per_domain,
+            crawl_timeout=config.crawler.crawl_timeout,
+            reuse_sessions=config.crawler.reuse_browser_sessions
+        )
+        self.crawl_flights = SingleFlight()
+        self.domain_stats = DomainStatsStore(
+            redis_client if config.domains.domain_stats_enabled else None,
+            window=config.domains.domain_stats_window,
+            ttl=config.domains.domain_stats_ttl,
+            refresh_interval=config.domains.domain_stats_refresh,
+            min_samples=config.domains.domain_min_samples,
+            max_domains=config.domains.domain_stats_max_domains
+        )
+        self.static_fetcher = StaticFetcher(
+            self.httpx_client,
+            timeout=config.crawler.static_fetch_timeout,
+            max_bytes=config.crawler.static_fetch_max_bytes,
+            min_text_length=config.crawler.static_min_text_length,
+            domain_stats=self.domain_stats
+        ) if config.crawler.static_fetch_enabled else None
+        self.ranker = ResultRanker(
+            embedder=Embedder(
+                base_url=config.cache.embedding_base_url,
+                api_key=config.cache.embedding_api_key,
+                model=config.cache.embedding_model,
+                timeout=config.cache.embedding_timeout
+            ) if config.ranking.rank_embeddings else None,
+            embedding_weight=config.ranking.rank_embedding_weight,
+            select=config.ranking.rank_select,
+            max_per_domain=config.ranking.rank_max_per_domain,
+            min_coverage=config.ranking.rank_min_coverage,
+            margin=config.ranking.rank_margin
+        ) if config.ranking.rank_enabled else None
 
     async def __aenter__(self):
         await self.crawler.__aenter__()
@@ -41,74 +105,354 @@ class WebResearcher:
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.crawl_scheduler.close()
         if self.crawler:
             await self.crawler.__aexit__(exc_type, exc_val, exc_tb)
         if self.httpx_client:
             await self.httpx_client.__aexit__(exc_type, exc_val, exc_tb)
 
-    async def research(self, question: str) -> Dict[str, str]:
-        search_terms, custom_urls = await self.llm_handler.generate_search_queries(question)
-        logger.info(f"Generated search terms: {search_terms}")
-        logger.info(f"Custom URLs: {custom_urls}")
+    async def plan(self, question: str) -> ResearchPlan:
+        plan = await self.llm_handler.generate_search_queries(question)
+        logger.info(f"Generated search terms: {plan.search_terms}")
+        logger.info(f"Custom URLs: {plan.custom_urls}")
+        return plan
+
+    async def research(self, question: str, plan: Optional[ResearchPlan] = None, trace: Optional[ResearchTrace] = None) -> Dict[str, str]:
+        """
+        Runs search, filtering and crawling for an already generated plan.
+        A plan is only generated here when the caller did not provide one.
+        """
+        trace = trace or ResearchTrace()
+        if plan is None:
+            with trace.stage("plan"):
+                plan = await self.plan(question)
+
+        with trace.stage("search"):
+            search_results = await self.search_web(plan.search_terms)
+        trace.emit("search_results", results=[{"title": r.title, "url": r.url} for r in search_results])
+
+        prefetched: Dict[str, asyncio.Future] = {}
+        try:
+            with trace.stage("filter"):
+                await self.domain_stats.load([r.url for r in search_results] + plan.custom_urls)
+                relevant_urls, method = await self.select_urls(self.reachable_results(search_results), question, prefetched)
+                relevant_urls = list(dict.fromkeys(relevant_urls + plan.custom_urls))  # Remove duplicates while preserving order
+                relevant_urls = self.prioritise_urls(relevant_urls)[:config.crawler.max_urls]
+            logger.info(f"Filtered relevant URLs ({method}): {relevant_urls}")
+            trace.emit("urls_selected", urls=relevant_urls, method=method)
+            # Speculative crawls of URLs that did not make the final selection only hold crawler slots
+            for url in set(prefetched) - set(relevant_urls):
+                prefetched.pop(url).cancel()
+
+            with trace.stage("fetch"):
+                extracted_info = await self.fetch_and_extract_content(relevant_urls, question, trace=trace, prefetched=prefetched)
+        finally:
+            for task in prefetched.values():
+                task.cancel()
+        return extracted_info
+
+    def reachable_results(self, search_results: List[SearchResult]) -> List[SearchResult]:
+        """
+        Drops results from domains whose recent crawls keep failing, unless that would drop them all.
+        """
+        if not config.domains.skip_failing_domains:
+            return search_results
+        reachable = [
+            result for result in search_results
+            if not self.domain_stats.should_skip(result.url, config.domains.domain_min_success_rate, config.domains.domain_retry_after)
+        ]
+        if len(reachable) < len(search_results):
+            logger.info(f"Skipping {len(search_results) - len(reachable)} results from failing domains")
+        return reachable or search_results
+
+    def prioritise_urls(self, urls: List[str]) -> List[str]:
+        """
+        Moves URLs of slow or unreliable domains behind the others, keeping the order otherwise.
+        Domains without enough crawls are not moved.
+        """
+        return sorted(urls, key=lambda url: self.domain_preference(url) < config.domains.domain_deprioritize_below)
+
+    def domain_preference(self, url: str) -> float:
+        # Unknown domains sit exactly at the threshold: behind proven domains, ahead of poor ones
+        return self.domain_stats.preference(url, unknown=config.domains.domain_deprioritize_below)
 
-        search_results = await self.search_web(search_terms)
-        
-        all_urls = custom_urls + [result.url for result in search_results]
+    async def select_urls(self, search_results: List[SearchResult], question: str, prefetched: Dict[str, asyncio.Future]) -> tuple[List[str], str]:
+        """
+        Picks the URLs to crawl. A confident local ranking is used directly; otherwise the LLM selector
+        decides while the top-ranked URLs are already being crawled into `prefetched`.
+        Returns the URLs and the method that chose them.
+        """
+        ranking = await self.ranker.rank(
+            question, search_results, preferences=[self.domain_preference(r.url) for r in search_results]
+        ) if self.ranker else None
+        if ranking is not None and ranking.confident:
+            return ranking.urls, "ranker"
 
+        if ranking is not None:
+            for url in ranking.urls[:config.ranking.rank_speculative_crawls]:
+                task = asyncio.ensure_future(self.fetch_page_content(url))
+                # Failures of crawls that end up unused must not be reported as unretrieved
+                task.add_done_callback(lambda done: done.cancelled() or done.exception())
+                prefetched[url] = task
         relevant_urls = await self.llm_handler.filter_relevant_results(
             [{"title": r.title, "url": r.url, "snippet": r.snippet} for r in search_results],
             question
         )
-        relevant_urls = list(dict.fromkeys(relevant_urls + custom_urls))  # Remove duplicates while preserving order
-        logger.info(f"Filtered relevant URLs: {relevant_urls}")
-
-        extracted_info = await self.fetch_and_extract_content(relevant_urls, question)
-        return extracted_info
+        if not relevant_urls and ranking is not None and ranking.urls:
+            logger.warning("LLM URL selection returned nothing, using the local ranking")
+            return ranking.urls, "ranker"
+        return relevant_urls, "llm"
 
-    async def search_web(self, queries: List[str], results_per_query: int = config.search.max_results) -> List[SearchResult]:
-        all_results = []
-        for query in queries:
+    async def _search_query(self, query: str, results_per_query: int) -> List[Dict[str, str]]:
+        """
+        Runs a single Custom Search query, retrying transient failures with jittered backoff.
+        Raises once all attempts are exhausted so that failures are never cached.
+        """
+        url = config.search.search_endpoint
+        params = {
+            "q": query,
+            "cx": self.search_engine_id,
+            "key": self.api_key,
+            "num": results_per_query
+        }
+        attempts = config.search.search_retries + 1
+        for attempt in range(attempts):
             try:
-                url = "https://www.googleapis.com/customsearch/v1"
-                params = {
-                    "q": query,
-                    "cx": self.search_engine_id,
-                    "key": self.api_key,
-                    "num": results_per_query
-                }
-                response = await self.httpx_client.get(url, params=params)
+                async with self.search_semaphore:
+                    record_usage(search_calls=1)
+                    response = await asyncio.wait_for(
+                        self.httpx_client.get(url, params=params),
+                        timeout=config.search.search_timeout
+                    )
                 response.raise_for_status()  # Raise an exception for a failed request
                 search_results = response.json()
-                for item in search_results.get('items', []):
-                    result = SearchResult(
-                        title=item['title'],
-                        url=item['link'],
-                        snippet=item['snippet']
-                    )
-                    if result not in all_results:
-                        all_results.append(result)
+                return [
+                    {"title": item['title'], "url": item['link'], "snippet": item.get('snippet', '')}
+                    for item in search_results.get('items', [])
+                ]
+            except (asyncio.TimeoutError, httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code == 429 or e.response.status_code >= 500
+                if not retryable or attempt == attempts - 1:
+                    raise
+                delay = config.search.search_backoff * (2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))  # Full jitter
+
+    async def _cached_search_query(self, query: str, results_per_query: int) -> List[SearchResult]:
+        try:
+            items = await self.search_cache.get_or_fetch_results(
+                query,
+                results_per_query,
+                lambda: self._search_query(query, results_per_query)
+            )
+            return [SearchResult(**item) for item in items]
+        except Exception as e:
+            logger.error(f"Error searching for '{query}': {str(e)}")
+            return []
+
+    async def search_web(self, queries: List[str], results_per_query: int = config.search.max_results) -> List[SearchResult]:
+        """
+        Runs all queries concurrently and merges the results, keeping query and rank order.
+        """
+        per_query_results = await asyncio.gather(*[self._cached_search_query(query, results_per_query) for query in queries])
+
+        unique_results: Dict[str, SearchResult] = {}
+        for results in per_query_results:
+            for result in results:
+                unique_results.setdefault(url_key(result.url), result)
+
+        return list(unique_results.values())
+
+    async def _revalidate(self, entry: ContentEntry) -> bool:
+        """
+        Sends a conditional request for a stale cache entry. Returns True if the origin reports it unchanged.
+        """
+        headers = {}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        if not headers:
+            return False
+        try:
+            async with self.httpx_client.stream(
+                "GET", entry.url, headers=headers,
+                timeout=config.cache.content_cache_revalidate_timeout, follow_redirects=True
+            ) as response:
+                return response.status_code == 304
+        except Exception as e:
+            logger.info(f"Revalidation failed for {entry.url}: {str(e)}")
+            return False
+
+    async def _crawl(self, url: str) -> Optional[str]:
+        """
+        Crawls a URL through the shared scheduler. Concurrent crawls of the same page, including
+        those from different requests, share a single browser visit.
+        """
+        key = canonicalize_url(url)
+        if self.crawl_flights.in_flight(key):
+            self.crawl_scheduler.deduplicated += 1
+        return await self.crawl_flights.do(key, lambda: self._crawl_and_store(url))
+
+    async def _crawl_and_store(self, url: str) -> Optional[str]:
+        """
+        Tries the plain HTTP fast path first and only renders the page in the headless browser
+        when it needs JavaScript, then stores the markdown in the content cache.
+        """
+        started = time.perf_counter()
+        await self.domain_stats.load([url])
+        page = None
+        if self.static_fetcher and not self.static_fetcher.requires_browser(url):
+            page = await self.static_fetcher.fetch(url)
+
+        if page is not None:
+            record_crawl(url, "static", "success")
+            await self.domain_stats.record_crawl(url, "success", "static", time.perf_counter() - started)
+            markdown, etag, last_modified = page
+        else:
+            timeout = self.domain_stats.timeout_for(
+                url, config.crawler.crawl_timeout, config.domains.domain_timeout_multiplier, config.domains.domain_min_timeout
+            ) if config.domains.adaptive_crawl_timeouts else None
+            browser_started = time.perf_counter()
+            try:
+                result = await self.crawl_scheduler.crawl(url, timeout=timeout)
             except Exception as e:
-                logger.error(f"Error searching for '{query}': {str(e)}")
+                if isinstance(e, asyncio.TimeoutError):
+                    # Counted at the timeout itself; the elapsed time also includes waiting for a browser slot
+                    await self.domain_stats.record_crawl(url, "timeout", "browser", timeout or config.crawler.crawl_timeout)
+                else:
+                    await self.domain_stats.record_crawl(url, "failed", "browser", time.perf_counter() - browser_started)
+                raise
+            if not result or not result.markdown or result.markdown.strip() == "":
+                outcome = "empty" if result and result.success else "failed"
+                await self.domain_stats.record_crawl(url, outcome, "browser", time.perf_counter() - browser_started)
+                return None
+            await self.domain_stats.record_crawl(url, "success", "browser", time.perf_counter() - browser_started)
+            markdown = str(result.markdown)
+            headers = {k.lower(): v for k, v in (result.response_headers or {}).items()}
+            etag, last_modified = headers.get("etag"), headers.get("last-modified")
 
-        return all_results
+        observe_stage("crawl", time.perf_counter() - started)
+        if self.content_cache:
+            await self.content_cache.put(url, markdown, etag, last_modified)
+        return markdown
+
+    async def fetch_page_content(self, url: str) -> Optional[str]:
+        """
+        Returns the markdown for a URL, serving fresh or revalidated cache entries without crawling.
+        """
+        if self.content_cache:
+            entry = await self.content_cache.get(url)
+            if entry is not None:
+                if self.content_cache.is_fresh(entry):
+                    self.content_cache.stats.hits += 1
+                    return entry.markdown
+                if await self._revalidate(entry):
+                    self.content_cache.stats.hits += 1
+                    await self.content_cache.refresh(entry)
+                    return entry.markdown
+            self.content_cache.stats.misses += 1
+        return await self._crawl(url)
+
+    async def prepare_content(self, question: str, markdown: str, url: str, trace: Optional[ResearchTrace] = None) -> str:
+        """
+        Prunes crawled markdown down to the chunks most relevant to the question before extraction.
+        Tokenizing and scoring whole pages is CPU-bound, so it runs in a worker thread.
+        """
+        if not config.extraction.prune_content:
+            return markdown
+        pruned = await asyncio.to_thread(
+            prune_content,
+            question,
+            markdown,
+            chunk_tokens=config.extraction.chunk_tokens,
+            max_chunks=config.extraction.max_chunks,
+            token_budget=config.extraction.extraction_token_budget
+        )
+        logger.info(f"Pruned {url}: {pruned.original_tokens} -> {pruned.kept_tokens} tokens ({pruned.chunks_kept}/{pruned.chunks_total} chunks)")
+        if trace is not None:
+            trace.record_page(
+                url,
+                original_tokens=pruned.original_tokens,
+                kept_tokens=pruned.kept_tokens,
+                tokens_saved=pruned.tokens_saved
+            )
+        return pruned.text or markdown
+
+    async def fetch_and_extract_content(
+        self, urls: List[str], question: str, trace: Optional[ResearchTrace] = None, prefetched: Optional[Dict[str, asyncio.Future]] = None
+    ) -> Dict[str, str]:
+        """
+        Crawls and extracts the URLs, reusing crawls already started for them in `prefetched`.
+        """
+        trace = trace or ResearchTrace()
+        prefetched = prefetched or {}
+        batcher = self.llm_handler.extraction_batcher(question, urls)
 
-    async def fetch_and_extract_content(self, urls: List[str], question: str) -> Dict[str, str]:
         async def process_url(url: str) -> tuple[str, str]:
             try:
-                result = await asyncio.wait_for(self.crawler.arun(url=url), timeout=config.crawler.crawl_timeout)
-                if not result or not result.markdown or result.markdown.strip() == "":
+                trace.emit("crawl_started", url=url)
+                markdown = await (prefetched.pop(url) if url in prefetched else self.fetch_page_content(url))
+                trace.emit("crawl_done", url=url, ok=bool(markdown))
+                if not markdown:
                     logger.warning(f"No content retrieved from {url}")
                     return url, None
-                extracted_info = await self.llm_handler.extract_relevant_info(question, result.markdown, url)
+                markdown = await self.prepare_content(question, markdown, url, trace)
+                extracted_info = await self.llm_handler.extract_relevant_info(question, markdown, url, batcher=batcher)
+                trace.emit("extraction_done", url=url, relevant=extracted_info is not None)
                 return url, extracted_info
             except asyncio.TimeoutError:
                 logger.warning(f"crawl_timeout while crawling {url}")
+                trace.emit("crawl_done", url=url, ok=False, error="timeout")
                 return url, None
             except Exception as e:
                 logger.error(f"Error processing {url}: {str(e)}")
+                trace.emit("crawl_done", url=url, ok=False, error="error")
                 return url, None
-        
-        tasks = [process_url(url) for url in urls]
-        results = await asyncio.gather(*tasks)
-    
-        return {url: info for url, info in results if info is not None}
+            finally:
+                if batcher is not None:
+                    batcher.release(url)
+
+        try:
+            return await self._gather_until_quorum([process_url(url) for url in urls], urls, trace)
+        finally:
+            if batcher is not None:
+                batcher.close()
+
+    async def _gather_until_quorum(self, coroutines, urls: List[str], trace: ResearchTrace) -> Dict[str, str]:
+        """
+        Collects extractions as they finish and stops early once MIN_EXTRACTIONS good results are in,
+        or once SYNTHESIS_DEADLINE has passed with at least one good result. Remaining crawls are cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        min_extractions = config.crawler.min_extractions
+        deadline = loop.time() + config.crawler.synthesis_deadline if config.crawler.synthesis_deadline > 0 else None
+
+        extracted: Dict[str, str] = {}
+        pending = {asyncio.ensure_future(coroutine) for coroutine in coroutines}
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    url, info = task.result()
+                    if info is not None:
+                        extracted[url] = info
+
+                if not pending:
+                    break
+                if min_extractions > 0 and len(extracted) >= min_extractions:
+                    logger.info(f"Extraction quorum reached, cancelling {len(pending)} remaining URLs")
+                    trace.emit("quorum_reached", reason="quorum", cancelled=len(pending))
+                    break
+                if deadline is not None and loop.time() >= deadline:
+                    if extracted:
+                        logger.info(f"Synthesis deadline reached, cancelling {len(pending)} remaining URLs")
+                        trace.emit("quorum_reached", reason="deadline", cancelled=len(pending))
+                        break
+                    deadline = None  # Nothing usable yet; keep waiting for the crawl timeouts
+        finally:
+            for task in pending:
+                task.cancel()
+
+        # Keep the selection order so the most relevant sources come first in the answer prompt
+        return {url: extracted[url] for url in urls if url in extracted}
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import signal
+
+from config import config
+from jobs import JobQueue, JobWorker
+from main import ResearchAssistant
+from quotas import QuotaManager
+from rate_limiter import aioredis
+
+logger = logging.getLogger(__name__)
+
+
+async def run_worker():
+    """
+    Runs research jobs from the Redis queue until SIGTERM or SIGINT, then lets
+    running jobs finish for up to the graceful shutdown timeout.
+    """
+    redis_client = aioredis.from_url(config.redis.redis_url, decode_responses=True)
+    quota_manager = QuotaManager(
+        redis_client=redis_client,
+        client_id=str,  # Only settles reservations made by the API, which already hold the client key
+        per_ip_budget=config.quotas.quota_per_ip,
+        total_budget=config.quotas.quota_total,
+        interval=config.quotas.quota_interval,
+        reservation=config.quotas.quota_reservation,
+        weights=config.quotas.weights()
+    ) if config.quotas.quota_enabled else None
+
+    async with ResearchAssistant(redis_client=redis_client) as research_assistant:
+        worker = JobWorker(
+            queue=JobQueue(redis_client, max_queued=config.jobs.jobs_max_queued, result_ttl=config.jobs.jobs_result_ttl, lease_timeout=config.jobs.jobs_lease_timeout),
+            research_assistant=research_assistant,
+            concurrency=config.jobs.jobs_worker_concurrency,
+            quota_manager=quota_manager,
+            poll_interval=config.jobs.jobs_poll_interval
+        )
+        worker_task = asyncio.ensure_future(worker.run())
+
+        def shutdown():
+            # Stop claiming jobs and requeue whatever is still running after the timeout
+            worker.stop()
+            loop.call_later(config.api.api_graceful_timeout, worker_task.cancel)
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, shutdown)
+
+        logger.info(f"Job worker started with {config.jobs.jobs_worker_concurrency} slots")
+        try:
+            await worker_task
+        except asyncio.CancelledError:
+            logger.warning("Jobs did not finish in time, requeued them")
+
+    await redis_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())